@@ -1,6 +1,11 @@
 import redis
 import os
 import json
+import threading
+import asyncio
+import weakref
+import redis.asyncio as aioredis
+from collections import OrderedDict
 from logger import get_logger  
 from config import config
 
@@ -15,6 +20,9 @@ REDIS_DB = config.REDIS_DB
 # Load the list from the environment variable
 DEFAULT_PREDEFINED_VENDORS = os.getenv('DEFAULT_PREDEFINED_VENDORS', '').split(',')
 
+# Bumped by every model mapping write so readers can tell when their local copy is stale
+MODEL_MAPPING_VERSION_KEY = 'model_mapping:version'
+
 # Initialize logger
 logger = get_logger("RedisProcess")
 
@@ -28,6 +36,26 @@ except redis.ConnectionError as e:
     logger.error("Failed to connect to Redis: %s", str(e))
     raise
 
+# One async client (and connection pool) per event loop: asyncio connections cannot be shared across loops
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_redis():
+    """Async Redis client for the running event loop, backed by a pool of REDIS_ASYNC_POOL_SIZE connections."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool = aioredis.BlockingConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True,
+                                               max_connections=config.REDIS_ASYNC_POOL_SIZE)
+        client = _async_clients[loop] = aioredis.Redis(connection_pool=pool)
+    return client
+
+async def close_async_redis():
+    """Close the running loop's async client, if it has one (call before closing the loop)."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+        await client.connection_pool.disconnect()
+
 def load_or_create_vendors():
     logger.info("Loading vendor list from Redis")
     vendors = r.smembers('vendors')
@@ -51,8 +79,133 @@ def get_model_mapping():
     # logger.info("Model mapping fetched: %s", result)
     return result
 
+def get_model_mapping_version():
+    return int(r.get(MODEL_MAPPING_VERSION_KEY) or 0)
+
 def update_model_mapping(model, details):
+    """Write one model's details and bump the mapping version. Returns the new version."""
     model = model.strip().lower()
     logger.info("Updating model mapping for: %s", model)
-    r.hset('model_mapping', model.lower(), json.dumps(details))
+    pipe = r.pipeline()
+    pipe.hset('model_mapping', model.lower(), json.dumps(details))
+    pipe.incr(MODEL_MAPPING_VERSION_KEY)
+    _, version = pipe.execute()
     logger.info("Model %s updated with details: %s", model, details)
+    return version
+
+def _normalized_entry(entry):
+    return {k: str(v).strip().lower() for k, v in entry.items()}
+
+def _batches(items, batch_size):
+    items = list(items)
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+def bulk_update_model_mapping(entries, vendors=(), batch_size=None):
+    """
+    Apply many model mapping updates at once. `entries` maps model -> {vendor, height, width}
+    with None for unknown fields. Existing details are fetched with batched HMGETs and merged the
+    same way the row-by-row path does (new value if set, else the stored one); only entries that
+    change are written, in pipelined HSET batches, and `vendors` are added with batched SADDs.
+    Returns (models_written, vendors_added).
+    """
+    batch_size = batch_size or config.MODEL_MAPPING_BATCH_SIZE
+    entries = {model.strip().lower(): details for model, details in entries.items()}
+
+    changed = {}
+    for models in _batches(entries, batch_size):
+        for model, stored in zip(models, r.hmget('model_mapping', models)):
+            existing_entry = json.loads(stored) if stored else {}
+            updated_entry = {field: entries[model].get(field) or existing_entry.get(field)
+                             for field in ("vendor", "height", "width")}
+            if _normalized_entry(existing_entry) != _normalized_entry(updated_entry):
+                changed[model] = updated_entry
+
+    model_batches = list(_batches(changed, batch_size))
+    vendor_batches = list(_batches(vendors, batch_size))
+    pipe = r.pipeline(transaction=False)
+    for models in model_batches:
+        pipe.hset('model_mapping', mapping={model: json.dumps(changed[model]) for model in models})
+    for members in vendor_batches:
+        pipe.sadd('vendors', *members)
+    if changed:
+        pipe.incr(MODEL_MAPPING_VERSION_KEY)
+    results = pipe.execute()
+
+    vendors_added = sum(results[len(model_batches):len(model_batches) + len(vendor_batches)])
+    logger.info("Bulk model mapping update: %d of %d models written, %d new vendors",
+                len(changed), len(entries), vendors_added)
+    return len(changed), vendors_added
+
+class ModelCatalog:
+    """
+    Device catalog lookups against the 'model_mapping' hash, one HMGET per batch of models.
+
+    Found and missing models are remembered in a bounded LRU (maxsize 0 disables it). The
+    version counter is read in the same pipeline as the HMGET, and the cache is dropped once
+    it moves, so a lookup stays a single round trip unless the mapping has changed. Writes made
+    through update() are applied to the cache directly, so a process's own writes never drop it.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _fetch(self, redis_conn, models):
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.get(MODEL_MAPPING_VERSION_KEY)
+        pipe.hmget('model_mapping', models)
+        version, stored = pipe.execute() if models else (redis_conn.get(MODEL_MAPPING_VERSION_KEY), [])
+        return int(version or 0), {model: json.loads(value) if value else None for model, value in zip(models, stored)}
+
+    def lookup(self, models, redis_conn=None):
+        """Details dict (or None) for each distinct model in `models`."""
+        redis_conn = redis_conn or r
+        models = list(dict.fromkeys(models))
+        if not self.maxsize:
+            return self._fetch(redis_conn, models)[1]
+
+        with self._lock:
+            cached = {model: self._entries[model] for model in models if model in self._entries}
+        version, details = self._fetch(redis_conn, [model for model in models if model not in cached])
+
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+                stale = list(cached)
+                cached = {}
+            else:
+                stale = []
+                for model in cached:
+                    self._entries.move_to_end(model)
+            self.hits += len(cached)
+            self.misses += len(models) - len(cached)
+        if stale:
+            details.update(self._fetch(redis_conn, stale)[1])
+
+        with self._lock:
+            for model, entry in details.items():
+                self._entries[model] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return {**cached, **details}
+
+    def update(self, model, details):
+        """Write one model's details to Redis and the cache. Returns the new mapping version."""
+        version = update_model_mapping(model, details)
+        with self._lock:
+            # Only our own write happened since the last lookup: keep the cache, else the next lookup drops it
+            if self.maxsize and self._version == version - 1:
+                self._version = version
+                self._entries[model.strip().lower()] = json.loads(json.dumps(details))
+                self._entries.move_to_end(model.strip().lower())
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return version
+
+model_catalog = ModelCatalog(config.MODEL_CATALOG_CACHE_SIZE)
@@ -0,0 +1,231 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timezone
+import pyarrow.parquet as pq
+from logger import get_logger
+
+logger = get_logger("Benchmarks")
+
+
+def benchmark_cleaning(file_path, engines=("pandas", "arrow")):
+    """Clean a copy of `file_path` with each cleaning engine and compare time, rows and discard counters."""
+    from dataCleaning import clean_file
+
+    rows_in = pq.ParquetFile(file_path).metadata.num_rows
+    results = {}
+    for engine in engines:
+        with tempfile.TemporaryDirectory() as work_dir:
+            work_file = os.path.join(work_dir, os.path.basename(file_path))
+            shutil.copy(file_path, work_file)
+
+            start = time.perf_counter()
+            counters = clean_file(work_file, engine)
+            elapsed = time.perf_counter() - start
+
+            rows_out = pq.ParquetFile(work_file).metadata.num_rows if counters is not None else 0
+        results[engine] = {"seconds": elapsed, "rows_per_sec": rows_in / max(elapsed, 1e-9),
+                           "rows_out": rows_out, "counters": counters}
+        print(f"[cleaning/{engine}] {rows_in} rows in {elapsed:.2f}s "
+              f"({rows_in / max(elapsed, 1e-9):,.0f} rows/s), {rows_out} kept, discarded {counters}")
+    return results
+
+
+def benchmark_correction(file_path):
+    """
+    Run the row-wise and vectorized correct_data_with_mapping over every row group of a cleaned file,
+    check that they produce the same frame and compare rows/sec.
+    """
+    import pandas as pd
+    from correctTheData import correct_data_with_mapping, correct_data_with_mapping_rowwise
+    from RedisUtils.redisProcessing import r
+    from vendorMatcher import get_vendor_matcher
+
+    predefined_vendors = get_vendor_matcher()
+    timings = {"rowwise": 0.0, "vectorized": 0.0}
+    rows = 0
+    with pq.ParquetFile(file_path) as parquet_file:
+        for row_group_idx in range(parquet_file.num_row_groups):
+            chunk = parquet_file.read_row_group(row_group_idx).to_pandas()
+            rows += len(chunk)
+
+            start = time.perf_counter()
+            expected = correct_data_with_mapping_rowwise(chunk, predefined_vendors, None, r)
+            timings["rowwise"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = correct_data_with_mapping(chunk, predefined_vendors, None, r)
+            timings["vectorized"] += time.perf_counter() - start
+
+            # Values must match; dtypes may differ (the row-wise version rebuilds the frame from dicts)
+            pd.testing.assert_frame_equal(expected.reset_index(drop=True).astype(str),
+                                          actual.reset_index(drop=True).astype(str), check_dtype=False)
+
+    for name, elapsed in timings.items():
+        print(f"[correction/{name}] {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    print(f"[correction] outputs identical, speedup {timings['rowwise'] / max(timings['vectorized'], 1e-9):.1f}x")
+    return timings
+
+
+def benchmark_enrichment(file_path):
+    """
+    Run transform_chunk over every row group of a corrected file with the blocking and the
+    async Redis client, and report wall time and the longest event loop stall (time a 1 ms
+    heartbeat task was kept from running). Each client gets a cold pass (the file's location
+    keys are deleted first, so misses go to the geocoder) and a warm pass (all cache hits).
+    """
+    import asyncio
+    import pandas as pd
+    from fetchFromLatLong import transform_chunk, flush_location_writes, is_valid_lat_lon
+    from locationQuantization import location_quantizer
+    from RedisUtils.redisProcessing import r, get_async_redis, close_async_redis
+    from geocoderClient import close_geocoder_client
+
+    with pq.ParquetFile(file_path) as parquet_file:
+        row_groups = [parquet_file.read_row_group(i).to_pandas() for i in range(parquet_file.num_row_groups)]
+    rows = sum(len(row_group) for row_group in row_groups)
+    location_keys = {location_quantizer.cell(lat, lon)[0]
+                     for row_group in row_groups for lat, lon in zip(row_group["latitude"], row_group["longitude"])
+                     if pd.notna(lat) and pd.notna(lon) and is_valid_lat_lon(lat, lon)}
+
+    async def run(use_async):
+        stall = 0.0
+        running = True
+
+        async def heartbeat():
+            nonlocal stall
+            loop = asyncio.get_running_loop()
+            while running:
+                before = loop.time()
+                await asyncio.sleep(0.001)
+                stall = max(stall, loop.time() - before - 0.001)
+
+        ticker = asyncio.create_task(heartbeat())
+        redis_conn = get_async_redis() if use_async else r
+        start = time.perf_counter()
+        for row_group in row_groups:
+            await transform_chunk(row_group, redis_conn)
+        await flush_location_writes()
+        elapsed = time.perf_counter() - start
+        running = False
+        await ticker
+        await close_async_redis()
+        await close_geocoder_client()
+        return elapsed, stall
+
+    timings = {}
+    for name, use_async in (("blocking", False), ("async", True)):
+        for location_key_batch in range(0, len(location_keys), 1000):
+            r.delete(*list(location_keys)[location_key_batch:location_key_batch + 1000])
+        for cache in ("cold", "warm"):
+            elapsed, stall = asyncio.run(run(use_async))
+            timings[f"{name}/{cache}"] = elapsed
+            print(f"[enrichment/{name}/{cache}] {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s), "
+                  f"longest event loop stall {stall * 1000:.1f} ms")
+    return timings
+
+
+def transform_rows(row_group, location_data):
+    """
+    Row-by-row reference implementation of fetchFromLatLong.transform_columns: a list of row dicts and
+    the location lookups in, a list of output row dicts out. Used to check and time the columnar transform.
+    """
+    from fetchFromLatLong import TRANSFORMED_COLUMNS
+
+    expected_columns = list(TRANSFORMED_COLUMNS)
+    transformed_data = []
+    for row in row_group:  # Iterate through the row group (list of dictionaries)
+        loc_data = location_data.get((row.get("latitude"), row.get("longitude")), {})
+        transformed = {  
+            "refId": row.get("refId", ""),
+            "reqTime": row.get("date", ""),
+            # "reqTimeConverted": datetime.fromtimestamp(row.get("date", 0) / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if row.get("date") else "",
+           "reqTimeConverted": datetime.fromtimestamp(float(row.get("date", 0)) / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if row.get("date") else "",
+            "deviceIfa": row.get("device_ifa", ""),
+            "os": row.get("os", ""),
+            "osv": row.get("os_version", ""),
+            "normalized_osv": row.get("normalized_os_version", ""),
+            "ipAddress": row.get("ip", ""),
+            "carrier": row.get("carrier", ""),
+            "connectionType": int(row.get("connection_type", 0)) if row.get("connection_type") else None,
+            "device_vendor": row.get("device_vendor", ""),
+            "device_model": row.get("device_model", ""),
+            "device_height": row.get("device_height", ""),
+            "device_width": row.get("device_width", ""),
+            "deviceType": row.get("device_type", ""),
+            "location_type": int(row.get("location_type", 0)) if row.get("location_type") else None,
+            "latitude": row.get("latitude", None),
+            "longitude": row.get("longitude", None),
+            "appBundle": row.get("app_bundle", ""),
+            "city": loc_data.get("city", row.get("city", "")),
+            "region": loc_data.get("district", ""),
+            "state": loc_data.get("state", row.get("region", "")),
+            "device_country_name": loc_data.get("country", row.get("device_country_name", "")),
+            "device_country_code": loc_data.get("countrycode", row.get("device_country_code", "")),
+            "zip": loc_data.get("postcode", row.get("zip", "")),
+            "ua": row.get("ua", ""),
+            "ssp": row.get("ssp_endpoint_name", ""),
+            "dpidsha1": row.get("dpidsha1", ""),
+            "dpidmd5": row.get("dpidmd5", ""),
+         }
+        transformed_data.append({key: transformed.get(key, "") for key in expected_columns})
+    return transformed_data
+
+
+def benchmark_transform(file_path):
+    """
+    Run the row-wise transform_rows and the columnar transform_columns over every row group of a
+    corrected file, with the location lookups done once up front, check that they produce the same
+    values and compare rows/sec.
+    """
+    import asyncio
+    import pandas as pd
+    from fetchFromLatLong import transform_columns, bulk_fetch_location_data, _coordinate_index, _input_column
+    from RedisUtils.redisProcessing import r
+
+    def normalized(frame):
+        # The row-wise frame holds Python objects (ints become floats next to None); compare as text
+        return frame.map(lambda value: None if not pd.notna(value) else
+                         str(int(value)) if isinstance(value, float) and value.is_integer() else str(value))
+
+    timings = {"rowwise": 0.0, "columnar": 0.0}
+    rows = 0
+    with pq.ParquetFile(file_path) as parquet_file:
+        for row_group_idx in range(parquet_file.num_row_groups):
+            chunk = parquet_file.read_row_group(row_group_idx).to_pandas()
+            rows += len(chunk)
+            indices, pairs = _coordinate_index(_input_column(chunk, "latitude", len(chunk)),
+                                               _input_column(chunk, "longitude", len(chunk)))
+            location_data = asyncio.run(bulk_fetch_location_data(r, [pair for pair in pairs if pair]))
+
+            start = time.perf_counter()
+            expected = pd.DataFrame(transform_rows(chunk.to_dict('records'), location_data))
+            timings["rowwise"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = transform_columns(chunk, indices, pairs, location_data).to_pandas()
+            timings["columnar"] += time.perf_counter() - start
+
+            pd.testing.assert_frame_equal(normalized(expected), normalized(actual), check_dtype=False)
+
+    for name, elapsed in timings.items():
+        print(f"[transform/{name}] {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    print(f"[transform] outputs identical, speedup {timings['rowwise'] / max(timings['columnar'], 1e-9):.1f}x")
+    return timings
+
+
+BENCHMARKS = {
+    "cleaning": benchmark_cleaning,
+    "correction": benchmark_correction,
+    "enrichment": benchmark_enrichment,
+    "transform": benchmark_transform,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pipeline code paths on a local parquet file.")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("file_path", help="Parquet file to run the benchmark on")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.file_path)
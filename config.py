@@ -32,6 +32,55 @@ class Config:
     REDIS_HOST = os.getenv('REDIS_HOST', '127.0.0.1')
     REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
     REDIS_DB = int(os.getenv('REDIS_DB', 0))
+    # e.g. "{kind}/{date}/" or "dumps/{date}/{kind}-"; empty derives prefixes from the date range by walking the key levels
+    S3_LISTING_PREFIX_TEMPLATE = os.getenv('S3_LISTING_PREFIX_TEMPLATE', '')
+    DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', 4))  # objects downloaded in parallel
+    DOWNLOAD_PART_SIZE_MB = int(os.getenv('DOWNLOAD_PART_SIZE_MB', 16))  # ranged GET size per part
+    DOWNLOAD_PART_CONCURRENCY = int(os.getenv('DOWNLOAD_PART_CONCURRENCY', 4))  # parts in flight per object, in both download modes
+    DOWNLOAD_MODE = os.getenv('DOWNLOAD_MODE', 'stream').lower()  # 'stream' (decompress on the fly) or 'file'
+    STREAM_CHUNK_MB = int(os.getenv('STREAM_CHUNK_MB', 8))  # read/write buffer size when streaming
+    STREAM_READAHEAD_CHUNKS = int(os.getenv('STREAM_READAHEAD_CHUNKS', 4))  # 0 disables the read-ahead thread (streams of objects up to one part)
+    CLEANING_ENGINE = os.getenv('CLEANING_ENGINE', 'pandas').lower()  # 'pandas' or 'arrow'
+    CLEANED_ROW_GROUP_SIZE = int(os.getenv('CLEANED_ROW_GROUP_SIZE', 100_000))  # rows per row group in cleaned files
+    CLEANED_COMPRESSION = os.getenv('CLEANED_COMPRESSION', 'snappy')
+    CLEANING_WORKERS = int(os.getenv('CLEANING_WORKERS', 1))  # >1 cleans row groups in a process pool
+    GLOBAL_DEDUP = os.getenv('GLOBAL_DEDUP', 'false').lower() == 'true'  # dedup across row groups, files and dumps
+    DEDUP_MEMORY_BUDGET_MB = int(os.getenv('DEDUP_MEMORY_BUDGET_MB', 256))  # hash index size before spilling to disk
+    DEDUP_SPILL_DIR = os.getenv('DEDUP_SPILL_DIR', '')  # empty uses the system temp dir
+    # Columns a row is deduplicated on: the ones that reach the processed output and exist in both dumps; empty uses all columns
+    DEDUP_KEY_COLUMNS = [column.strip() for column in os.getenv('DEDUP_KEY_COLUMNS', 'refId,date,device_ifa,os,os_version,ip,carrier,connection_type,device_vendor,device_model,device_height,device_width,device_type,location_type,latitude,longitude,app_bundle,ua,ssp_endpoint_name,dpidsha1,dpidmd5').split(',') if column.strip()]
+    UA_CACHE_SIZE = int(os.getenv('UA_CACHE_SIZE', 100_000))  # distinct UAs memoized for vendor extraction
+    MODEL_MAPPING_BUILD_MODE = os.getenv('MODEL_MAPPING_BUILD_MODE', 'bulk').lower()  # 'bulk' or 'rowwise'
+    MODEL_MAPPING_BATCH_SIZE = int(os.getenv('MODEL_MAPPING_BATCH_SIZE', 1000))  # fields per pipelined HMGET/HSET/SADD
+    MODEL_CATALOG_CACHE_SIZE = int(os.getenv('MODEL_CATALOG_CACHE_SIZE', 100_000))  # models cached for lookups, 0 disables
+    LOCATION_QUANTIZATION = os.getenv('LOCATION_QUANTIZATION', 'none').lower()  # 'none', 'decimal' or 'geohash'
+    LOCATION_DECIMALS = int(os.getenv('LOCATION_DECIMALS', 4))  # decimal places kept in 'decimal' mode
+    LOCATION_GEOHASH_LENGTH = int(os.getenv('LOCATION_GEOHASH_LENGTH', 7))  # geohash chars in 'geohash' mode
+    LOCAL_GEOCODER_PATH = os.getenv('LOCAL_GEOCODER_PATH', '')  # gazetteer CSV/TSV; empty disables offline geocoding
+    LOCAL_GEOCODER_MAX_KM = float(os.getenv('LOCAL_GEOCODER_MAX_KM', 10))  # farther points fall back to the API
+    ENRICH_REDIS_ASYNC = os.getenv('ENRICH_REDIS_ASYNC', 'true').lower() == 'true'  # async Redis client for location lookups
+    REDIS_ASYNC_POOL_SIZE = int(os.getenv('REDIS_ASYNC_POOL_SIZE', 10))  # connections per event loop
+    GEOCODER_MIN_CONCURRENCY = int(os.getenv('GEOCODER_MIN_CONCURRENCY', 2))  # floor of the adaptive limit
+    GEOCODER_MAX_CONCURRENCY = int(os.getenv('GEOCODER_MAX_CONCURRENCY', 32))  # ceiling, also the connection pool size
+    GEOCODER_INITIAL_CONCURRENCY = int(os.getenv('GEOCODER_INITIAL_CONCURRENCY', 5))
+    GEOCODER_LATENCY_TARGET_MS = int(os.getenv('GEOCODER_LATENCY_TARGET_MS', 1000))  # slower responses shrink the limit
+    GEOCODER_TIMEOUT_SECONDS = float(os.getenv('GEOCODER_TIMEOUT_SECONDS', 10))
+    GEOCODER_MAX_RETRIES = int(os.getenv('GEOCODER_MAX_RETRIES', 3))  # retries of timeouts, 429 and 5xx
+    GEOCODER_BACKOFF_BASE_SECONDS = float(os.getenv('GEOCODER_BACKOFF_BASE_SECONDS', 0.2))
+    GEOCODER_BACKOFF_MAX_SECONDS = float(os.getenv('GEOCODER_BACKOFF_MAX_SECONDS', 5))
+    LOCATION_NEGATIVE_TTL_SECONDS = int(os.getenv('LOCATION_NEGATIVE_TTL_SECONDS', 3600))  # how long unresolvable points are not retried
+    PROCESSED_ROW_GROUP_SIZE = int(os.getenv('PROCESSED_ROW_GROUP_SIZE', 100_000))  # rows per row group in processed files
+    PROCESSED_COMPRESSION = os.getenv('PROCESSED_COMPRESSION', 'snappy')  # e.g. 'snappy' or 'zstd'
+    PROCESSED_OUTPUT_MODE = os.getenv('PROCESSED_OUTPUT_MODE', 'files').lower()  # 'files' (one per input) or 'dataset' (hive-partitioned)
+    PROCESSED_PARTITION_COLUMNS = [column.strip() for column in os.getenv('PROCESSED_PARTITION_COLUMNS', 'date,device_country_code').split(',') if column.strip()]
+    PROCESSED_MAX_ROWS_PER_FILE = int(os.getenv('PROCESSED_MAX_ROWS_PER_FILE', 1_000_000))  # cap per dataset file
+    PROCESSED_COMPACT_MIN_FILE_MB = int(os.getenv('PROCESSED_COMPACT_MIN_FILE_MB', 32))  # smaller dataset files get merged by main.py --compact, 0 disables
+    PROCESSED_CHECKPOINT_ROW_GROUPS = int(os.getenv('PROCESSED_CHECKPOINT_ROW_GROUPS', 10))  # input row groups per resumable segment staged under processed_dir/.checkpoints, 0 = whole file, no resume
+    RUN_LEDGER_PATH = os.getenv('RUN_LEDGER_PATH', 'run_ledger.db')  # SQLite ledger of per-object pipeline state
+    PIPELINE_DOWNLOAD_WORKERS = int(os.getenv('PIPELINE_DOWNLOAD_WORKERS', 2))
+    PIPELINE_CLEAN_WORKERS = int(os.getenv('PIPELINE_CLEAN_WORKERS', 1))
+    PIPELINE_ENRICH_WORKERS = int(os.getenv('PIPELINE_ENRICH_WORKERS', 1))
+    PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 2))  # files waiting between two stages
 
     @classmethod
     def check_env_variables(cls) -> Dict[str, str]:
@@ -12,26 +12,23 @@ import pandas as pd
 import redis
 import json
 import logging
+from vendorMatcher import extract_vendor_from_ua, matcher_for, ua_vendor_cache
+from RedisUtils.redisProcessing import model_catalog
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-def correct_data_with_mapping(chunk, predefined_vendors, model_mapping,r):
+def correct_data_with_mapping_rowwise(chunk, predefined_vendors, model_mapping,r):
     """
     Correct data in a chunk based on Redis model mapping, using bulk queries.
+    Row-by-row reference implementation of correct_data_with_mapping, kept for benchmarks.
     """
     corrected_rows = []
 
-    # Extract all unique models in bulk for Redis lookup
+    # Extract all unique models (after vendor prefix stripping) in bulk for Redis lookup
     unique_models = chunk['device_model'].dropna().str.strip().str.lower().unique()
-    redis_keys = [f"model_mapping:{model}" for model in unique_models]
-
-    # Bulk fetch data from Redis
-    redis_data = r.mget(redis_keys)
-    model_mapping_bulk = {
-        model: json.loads(data) if data else None 
-        for model, data in zip(unique_models, redis_data)
-    }
+    model_mapping_bulk = _lookup_models(
+        [_strip_vendor_prefix(model, predefined_vendors)[0] for model in unique_models], model_mapping, r)
 
     for _, row in chunk.iterrows():
         try:
@@ -51,12 +48,9 @@ def correct_data_with_mapping(chunk, predefined_vendors, model_mapping,r):
                 corrected_rows.append(updated_row)
                 continue
 
-            for predefined_vendor in predefined_vendors:
-                if predefined_vendor in model:
-                    model = model.replace(predefined_vendor, "").strip("_ .").replace("_", " ").replace(".", " ").strip()
-                    if not vendor:
-                        vendor = predefined_vendor
-                    break
+            model, predefined_vendor = _strip_vendor_prefix(model, predefined_vendors)
+            if predefined_vendor and not vendor:
+                vendor = predefined_vendor
 
             redis_entry = model_mapping_bulk.get(model, None)
 
@@ -82,15 +76,83 @@ def correct_data_with_mapping(chunk, predefined_vendors, model_mapping,r):
     return pd.DataFrame(corrected_rows)
 
 
-def extract_vendor_from_ua(ua, predefined_vendors, current_vendor=None):
-    """Extract vendor from the 'ua' field using predefined vendor names."""
-    if pd.notna(ua):
-        ua_section = ua.split(")")[0] if ")" in ua else ua
-        for vendor in predefined_vendors:
-            if vendor in ua_section:
-                if current_vendor and "android" in current_vendor and vendor == "apple":
-                    continue
-                elif current_vendor and "apple" in current_vendor and vendor == "android":
-                    continue
-                return vendor
-    return None
+def _strip_vendor_prefix(model, predefined_vendors):
+    """Remove the longest predefined vendor found in a model name. Returns (model, matched_vendor)."""
+    predefined_vendor = matcher_for(predefined_vendors).find(model)
+    if predefined_vendor:
+        return model.replace(predefined_vendor, "").strip("_ .").replace("_", " ").replace(".", " ").strip(), predefined_vendor
+    return model, None
+
+def _lookup_models(models, model_mapping, r):
+    """Catalog entries for the distinct models, one HMGET on the 'model_mapping' hash (model_mapping: a ModelCatalog or None)."""
+    return (model_mapping or model_catalog).lookup(models, r)
+
+# Input columns the correction reads
+CORRECTION_COLUMNS = ("device_model", "device_vendor", "os_version", "ua", "device_height", "device_width")
+
+def _is_str_or_missing(value):
+    return isinstance(value, str) or not pd.notna(value)
+
+def correct_data_with_mapping(chunk, predefined_vendors, model_mapping,r):
+    """
+    Correct data in a chunk based on Redis model mapping, using bulk queries.
+
+    Column-wise equivalent of correct_data_with_mapping_rowwise: string work is done once per
+    distinct model / (ua, vendor) pair and broadcast back, and the Redis mapping is joined with a merge.
+    model_mapping is the ModelCatalog to look models up in (None uses the shared one).
+    """
+    if chunk.empty:
+        return pd.DataFrame()
+
+    # Rows the row-wise version cannot process (non-string model/vendor/os_version) are dropped
+    os_version = chunk['os_version'] if 'os_version' in chunk.columns else pd.Series("", index=chunk.index)
+    valid = (chunk['device_model'].map(lambda value: isinstance(value, str))
+             & chunk['device_vendor'].map(_is_str_or_missing)
+             & os_version.map(_is_str_or_missing))
+    if not valid.all():
+        logger.error(f"Dropped {int((~valid).sum())} rows with non-string device fields in data correction")
+    corrected = chunk[valid].reset_index(drop=True)
+    os_version = os_version[valid].reset_index(drop=True)
+
+    model = corrected['device_model'].str.strip().str.lower()
+    vendor = corrected['device_vendor'].str.strip().str.lower().fillna("")
+    normalized_os_version = os_version.str.split('.').str[0].fillna("")
+
+    # Android devices: take the vendor from the user agent, keep the model as is
+    is_android = model.str.contains("android", regex=False) | vendor.str.contains("android", regex=False)
+    android_ua = corrected['ua'][is_android]
+    android_vendor = vendor[is_android]
+    extracted = ua_vendor_cache.vendors_for(matcher_for(predefined_vendors), android_ua, android_vendor)
+    android_device_vendor = extracted.where(extracted.notna(), android_vendor)
+
+    # Other devices: strip a vendor prefix from the model, once per distinct model
+    stripped = {value: _strip_vendor_prefix(value, predefined_vendors) for value in model[~is_android].unique()}
+    other_model = model[~is_android].map(lambda value: stripped[value][0])
+    prefix_vendor = model[~is_android].map(lambda value: stripped[value][1] or "")
+    other_vendor = vendor[~is_android].where(vendor[~is_android] != "", prefix_vendor)
+
+    # Fetch the catalog entries of the distinct stripped models and join them on the stripped model
+    model_mapping_bulk = _lookup_models([entry[0] for entry in stripped.values()], model_mapping, r)
+    mapping_table = pd.DataFrame(
+        [{"device_model": key,
+          "__vendor": entry.get('vendor'), "__has_vendor": 'vendor' in entry,
+          "__height": entry.get('height'), "__has_height": 'height' in entry,
+          "__width": entry.get('width'), "__has_width": 'width' in entry}
+         for key, entry in model_mapping_bulk.items() if entry],
+        columns=["device_model", "__vendor", "__has_vendor", "__height", "__has_height", "__width", "__has_width"])
+    others = pd.DataFrame({"device_model": other_model.values}).merge(mapping_table, on="device_model", how="left")
+    others.index = other_model.index
+
+    def mapped(field, default):
+        has_field = others[f"__has_{field}"].eq(True)
+        return others[f"__{field}"].where(has_field, default)
+
+    corrected.loc[is_android, 'device_vendor'] = android_device_vendor
+    corrected.loc[~is_android, 'device_vendor'] = mapped("vendor", other_vendor)
+    corrected.loc[~is_android, 'device_model'] = other_model
+    if not others.empty:
+        corrected.loc[~is_android, 'device_height'] = mapped("height", corrected['device_height'][~is_android])
+        corrected.loc[~is_android, 'device_width'] = mapped("width", corrected['device_width'][~is_android])
+    corrected['normalized_os_version'] = normalized_os_version
+
+    return corrected
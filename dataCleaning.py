@@ -113,111 +113,488 @@
 #     logger.info(f"Total discarded rows with empty deviceId, sha, and md5: {total_discarded_all_null_ids}")
 #     logger.info(f"Total discarded duplicate rows: {total_discarded_duplicates}")
 
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 import pandas as pd
 import numpy as np
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from logger import get_logger
+from config import config
+from parquetIO import RowGroupWriter, column_all_empty, row_group_bytes, scan_stats
+from deduplication import RowHashIndex, DEDUP_SCOPES
 
 logger = get_logger("DataCleaning")
 
-def clean_data(temp_dir):
-    """Clean data in the given files from the temporary directory."""
-    total_discarded_make_model = 0
-    total_discarded_lat_long = 0
-    total_discarded_all_null_ids = 0
-    total_discarded_duplicates = 0
+CLEANING_COUNTERS = ("make_model", "lat_long", "all_null_ids", "duplicates") + tuple(f"duplicates_{scope}" for scope in DEDUP_SCOPES)
+NUMERIC_COLUMNS = ['date', 'bid_price', 'bid_req_adv_floor_sum', 'dsp_net_price_sum', 'curr_excg_rate']
+# Strings pd.to_numeric would accept; anything else becomes null (errors='coerce')
+NUMERIC_PATTERN = r"^[+-]?((\d+\.?\d*|\.\d+)(e[+-]?\d+)?|inf|infinity)$"  # matched ignoring case
+INTEGER_PATTERN = r"^[+-]?\d+$"
+
+def _clean_chunk_pandas(table, counters):
+    """Clean one row group through pandas. Returns the cleaned DataFrame."""
+    chunk = table.to_pandas()
+
+    # Convert specific columns to string to prevent type issues
+    chunk['device_ifa'] = chunk['device_ifa'].astype(str)
+    chunk['dpidsha1'] = chunk['dpidsha1'].astype(str)
+    chunk['dpidmd5'] = chunk['dpidmd5'].astype(str)
+
+    # Fill NaN values with empty strings
+    chunk = chunk.fillna("").astype(str)
+
+    # Convert numeric columns safely
+    for col in NUMERIC_COLUMNS:
+        if col in chunk.columns:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+
+    # Discard rows with empty make/model
+    initial_count = len(chunk)
+    chunk = chunk[~((chunk['device_vendor'] == '') & (chunk['device_model'] == ''))]
+    counters["make_model"] += (initial_count - len(chunk))
+
+    # Discard rows with empty latitude/longitude
+    initial_count = len(chunk)
+    chunk = chunk[~((chunk['latitude'] == '') & (chunk['longitude'] == ''))]
+    counters["lat_long"] += (initial_count - len(chunk))
+
+    # Discard rows with all three empty IDs
+    initial_count = len(chunk)
+    chunk = chunk[~((chunk['device_ifa'] == '') & (chunk['dpidsha1'] == '') & (chunk['dpidmd5'] == ''))]
+    counters["all_null_ids"] += (initial_count - len(chunk))
+
+    # Replace empty 'device_ifa' with 'dpidsha1' or 'dpidmd5'
+    chunk['device_ifa'] = np.where(chunk['device_ifa'] != '', chunk['device_ifa'],
+                                np.where(chunk['dpidsha1'] != '', chunk['dpidsha1'], chunk['dpidmd5']))
+
+    # Drop duplicates within the current chunk
+    initial_count = len(chunk)
+    chunk = chunk.drop_duplicates()
+    counters["duplicates"] += (initial_count - len(chunk))
+
+    return chunk
+
+def _as_clean_string(column, null=""):
+    """
+    Arrow equivalent of fillna("").astype(str) on a column; with null="None", of astype(str) on an ID
+    column, which turns nulls into "None". Numbers and booleans are cast in Arrow and written the way
+    pandas writes them: integer columns with nulls become floats there, so their values read "5.0", and
+    null floats read "nan" in ID columns. Other types go through pandas once.
+    """
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return pc.fill_null(pc.cast(column, pa.string()), null)
+    if pa.types.is_boolean(column.type):
+        return pc.fill_null(pc.if_else(column, "True", "False"), null)
+    if pa.types.is_integer(column.type) and column.null_count == 0:
+        return pc.cast(column, pa.string())
+    if pa.types.is_integer(column.type) or column.type in (pa.float32(), pa.float64()):
+        missing = pc.fill_null(pc.is_null(column, nan_is_null=True), False)
+        if not pa.types.is_floating(column.type) or (null != "None" and pc.any(missing).as_py()):
+            # pandas holds integers with nulls as float64, and fillna turns float32 values into Python floats
+            column = pc.cast(column, pa.float64(), safe=False)
+        return pc.if_else(missing, "nan" if null == "None" else null, _float_as_string(column))
+    values = column.to_pandas()
+    return pa.array((values if null == "None" else values.fillna(null)).astype(str), pa.string())
+
+def _float_as_string(column):
+    """Floats as Python prints them: Arrow's shortest digits, with Python's "1.0" and exponent rules."""
+    text = pc.cast(column, pa.string())
+    # Arrow writes integral floats without a fraction ("1", "-0")
+    text = pc.if_else(pc.match_substring_regex(text, r"^-?\d+$"), pc.binary_join_element_wise(text, ".0", ""), text)
+    # and one-digit exponents unpadded ("1e-9" for "1e-09")
+    text = pc.replace_substring_regex(text, r"e([+-])(\d)$", r"e\10\2")
+    # Python uses exponent notation below 1e-4 and from 1e16 on, Arrow at other magnitudes; the values
+    # the two disagree on are formatted one by one
+    magnitude = pc.abs(column)
+    python_exponent = pc.or_(pc.and_(pc.greater(magnitude, 0), pc.less(magnitude, 1e-4)),
+                             pc.and_(pc.greater_equal(magnitude, 1e16), pc.is_finite(magnitude)))
+    odd = pc.fill_null(pc.xor(python_exponent, pc.match_substring(text, "e")), False)
+    if pc.any(odd).as_py():
+        odd, text = [array.combine_chunks() if isinstance(array, pa.ChunkedArray) else array for array in (odd, text)]
+        values = pc.filter(column, odd).to_numpy(zero_copy_only=False)
+        text = pc.replace_with_mask(text, odd, pa.array([str(value) for value in values], pa.string()))
+    return text
+
+def _to_numeric(column):
+    """Arrow equivalent of pd.to_numeric(errors='coerce') on a string column."""
+    column = pc.utf8_trim_whitespace(column)
+    # Like pandas, stay integer only when every value parses as an integer
+    if pc.all(pc.match_substring_regex(column, INTEGER_PATTERN)).as_py() is not False:
+        return pc.cast(column, pa.int64())
+    valid = pc.match_substring_regex(column, NUMERIC_PATTERN, ignore_case=True)
+    return pc.cast(pc.if_else(valid, column, pa.scalar(None, pa.string())), pa.float64())
+
+def _drop_duplicate_rows(table):
+    """Keep the first occurrence of every distinct row, preserving row order."""
+    if table.num_rows == 0:
+        return table
+    row_ids = table.append_column("__row_id", pa.array(np.arange(table.num_rows, dtype=np.int64)))
+    first_rows = row_ids.group_by(table.column_names, use_threads=False).aggregate([("__row_id", "min")])
+    return table.take(np.sort(first_rows["__row_id_min"].to_numpy()))
+
+ID_COLUMNS = ('device_ifa', 'dpidsha1', 'dpidmd5')
+
+def _clean_chunk_arrow(table, counters):
+    """
+    Clean one row group with pyarrow.compute, without materialising Python strings. Matches
+    _clean_chunk_pandas row for row: null IDs become "None" rather than empty, and numeric columns
+    are converted before duplicates are dropped.
+    """
+    table = pa.table({name: _as_clean_string(table[name], "None" if name in ID_COLUMNS else "")
+                      for name in table.column_names})
+
+    # Convert numeric columns safely
+    for col in NUMERIC_COLUMNS:
+        if col in table.column_names:
+            table = table.set_column(table.column_names.index(col), col, _to_numeric(table[col]))
+
+    def is_empty(name):
+        return pc.equal(table[name], "")
+
+    # Discard rows with empty make/model, empty latitude/longitude, or all three empty IDs
+    empty_make_model = pc.and_(is_empty('device_vendor'), is_empty('device_model'))
+    empty_lat_long = pc.and_(is_empty('latitude'), is_empty('longitude'))
+    empty_ids = pc.and_(pc.and_(is_empty('device_ifa'), is_empty('dpidsha1')), is_empty('dpidmd5'))
+
+    # Count each reason only for rows not already discarded by an earlier one, like the sequential filters do
+    counters["make_model"] += pc.sum(empty_make_model).as_py() or 0
+    counters["lat_long"] += pc.sum(pc.and_not(empty_lat_long, empty_make_model)).as_py() or 0
+    counters["all_null_ids"] += pc.sum(
+        pc.and_not(empty_ids, pc.or_(empty_make_model, empty_lat_long))).as_py() or 0
+    table = table.filter(pc.invert(pc.or_(pc.or_(empty_make_model, empty_lat_long), empty_ids)))
+
+    # Replace empty 'device_ifa' with 'dpidsha1' or 'dpidmd5'
+    device_ifa = pc.if_else(pc.not_equal(table['device_ifa'], ""), table['device_ifa'],
+                            pc.if_else(pc.not_equal(table['dpidsha1'], ""), table['dpidsha1'], table['dpidmd5']))
+    table = table.set_column(table.column_names.index('device_ifa'), 'device_ifa', device_ifa)
+
+    # Drop duplicates within the current chunk
+    initial_count = table.num_rows
+    table = _drop_duplicate_rows(table)
+    counters["duplicates"] += (initial_count - table.num_rows)
+
+    return table
+
+def cleaned_schema(input_schema):
+    """Fixed output schema for a cleaned file: epoch-millisecond 'date', float prices, strings elsewhere."""
+    fields = []
+    for name in input_schema.names:
+        if name == 'date':
+            fields.append(pa.field(name, pa.int64()))
+        elif name in NUMERIC_COLUMNS:
+            fields.append(pa.field(name, pa.float64()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+def _clean_table(table, engine, schema, counters):
+    """Clean one row group with the chosen engine and cast it to the cleaned file schema."""
+    if engine == "arrow":
+        cleaned = _clean_chunk_arrow(table, counters)
+    else:
+        chunk = _clean_chunk_pandas(table, counters)
+        cleaned = pa.Table.from_pandas(chunk, preserve_index=False)
+    return cleaned.select(schema.names).cast(schema)
+
+LAT_LONG_COLUMNS = ('latitude', 'longitude')
+MAKE_MODEL_COLUMNS = ('device_vendor', 'device_model')
+
+def _clean_read_columns(metadata, row_group_idx):
+    """
+    Columns cleaning reads from a row group: all of them (None), or only make/model when the row group
+    statistics show every latitude and longitude is null or empty, as all its rows are discarded then.
+    """
+    if all(column_all_empty(metadata, row_group_idx, name) for name in LAT_LONG_COLUMNS):
+        return list(MAKE_MODEL_COLUMNS)
+    return None
+
+def _read_and_clean(parquet_file, row_group_idx, engine, schema, counters):
+    """Read and clean one row group. Returns (cleaned table, compressed bytes read, whether the row group was skipped)."""
+    columns = _clean_read_columns(parquet_file.metadata, row_group_idx)
+    table = parquet_file.read_row_group(row_group_idx, columns=columns)
+    bytes_read = row_group_bytes(parquet_file.metadata, row_group_idx, columns)
+    if columns is None:
+        return _clean_table(table, engine, schema, counters), bytes_read, False
+
+    # No row has a location: count each under the first filter that drops it, make/model before lat/long
+    empty_make_model = pc.sum(pc.and_(pc.equal(_as_clean_string(table['device_vendor']), ""),
+                                      pc.equal(_as_clean_string(table['device_model']), ""))).as_py() or 0
+    counters["make_model"] += empty_make_model
+    counters["lat_long"] += table.num_rows - empty_make_model
+    return schema.empty_table(), bytes_read, True
+
+def _drop_seen_rows(cleaned, file_name, dedup_index, counters):
+    """Filter rows already seen by the cross-file dedup index, if there is one."""
+    if dedup_index is None:
+        return cleaned
+    cleaned, removed = dedup_index.filter_table(cleaned, file_name)
+    for scope, count in removed.items():
+        counters[f"duplicates_{scope}"] += count
+    return cleaned
+
+def _replace_with_cleaned(file_path, output_file_path):
+    # Rename cleaned file back to the original name
+    os.remove(file_path)  # Delete original file
+    os.rename(output_file_path, file_path)  # Rename cleaned file
+    logger.info(f"Replaced original file with cleaned version: {file_path}")
+
+def _cleaned_output_path(file_path):
+    return os.path.join(os.path.dirname(file_path), f"cleaned_{os.path.basename(file_path)}")  # Use a new cleaned file
+
+def _cleaned_row_groups(parquet_file, file_path, engine, schema, counters, executor=None, workers=None):
+    """
+    Yield (cleaned table, bytes read, skipped) for each row group of a file, in order. With a
+    ProcessPoolExecutor the row groups are cleaned there, at most 2 * workers at a time.
+    """
+    file_name = os.path.basename(file_path)
+    if executor is None:
+        for row_group_idx in range(parquet_file.num_row_groups):
+            logger.info(f"Processing Row Group {row_group_idx + 1}/{parquet_file.num_row_groups} for {file_name}")
+            yield _read_and_clean(parquet_file, row_group_idx, engine, schema, counters)
+        return
+
+    window = 2 * (workers or config.CLEANING_WORKERS)
+    in_flight = deque()
+    try:
+        for row_group_idx in range(parquet_file.num_row_groups):
+            if len(in_flight) >= window:
+                yield _collect_row_group(in_flight.popleft(), counters)
+            in_flight.append(executor.submit(_clean_row_group_task, file_path, row_group_idx, engine))
+        while in_flight:
+            yield _collect_row_group(in_flight.popleft(), counters)
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+def _collect_row_group(future, counters):
+    cleaned, row_group_counters, bytes_read, skipped = future.result()
+    for key, value in row_group_counters.items():
+        counters[key] += value
+    return cleaned, bytes_read, skipped
+
+def clean_file(file_path, engine=None, dedup_index=None, ledger=None, executor=None, workers=None):
+    """
+    Clean a single parquet file in place. Returns the discarded row counters for the file,
+    or None if the file could not be processed. With a RunLedger the file is recorded as cleaned or failed.
+
+    With a ProcessPoolExecutor `executor` (of `workers` processes, default CLEANING_WORKERS) the row
+    groups are cleaned in the pool, so several threads can share one pool; output and dedup order
+    stay those of the serial path.
+
+    With a RowHashIndex, rows already seen in an earlier row group or file are dropped as well
+    and counted per scope (duplicates_file, duplicates_cross_file, duplicates_cross_dump). The file's
+    rows are committed to the index only once it is cleaned, and discarded if it fails.
+
+    engine is "pandas" or "arrow" (defaults to CLEANING_ENGINE). The arrow engine runs the same
+    filters on Arrow arrays and produces the same rows and counters.
+    """
+    engine = engine or config.CLEANING_ENGINE
+    file_name = os.path.basename(file_path)
+    output_file_path = _cleaned_output_path(file_path)
+    logger.info(f"Processing file: {file_name} ({engine} engine{', process pool' if executor else ''})")
+
+    counters = dict.fromkeys(CLEANING_COUNTERS, 0)
+    start = time.perf_counter()
+
+    try:
+        with pq.ParquetFile(file_path) as parquet_file:
+            raw_rows = parquet_file.metadata.num_rows
+            schema = cleaned_schema(parquet_file.schema_arrow)
+            scan_stats.record("clean", file_bytes=os.path.getsize(file_path))
+            with RowGroupWriter(output_file_path, schema, config.CLEANED_ROW_GROUP_SIZE,
+                                compression=config.CLEANED_COMPRESSION) as writer:
+
+                # Process each row group separately; cleaned rows are streamed straight to the output file.
+                # A row group is read as an Arrow Table (only make/model when it has no locations) and cleaned
+                for cleaned, bytes_read, skipped in _cleaned_row_groups(parquet_file, file_path, engine, schema,
+                                                                        counters, executor, workers):
+                    scan_stats.record("clean", bytes_read=bytes_read, row_groups=1, skipped=int(skipped))
+                    writer.write(_drop_seen_rows(cleaned, file_name, dedup_index, counters))
+
+            logger.info(f"Cleaned data saved to {output_file_path} ({writer.rows_written} rows, "
+                        f"{writer.row_groups_written} row groups)")
+
+        _replace_with_cleaned(file_path, output_file_path)
+        if dedup_index is not None:
+            dedup_index.commit(file_name)
+
+    except Exception as e:
+        logger.error(f"Error processing parquet file {file_name}: {e}")
+        if dedup_index is not None:
+            dedup_index.discard(file_name)  # Its rows were never written, so they have not been seen
+        if os.path.exists(output_file_path):
+            os.remove(output_file_path)  # Drop the partially written output
+        if ledger is not None:
+            ledger.failed(file_name, "clean", e)
+        return None
+
+    if ledger is not None:
+        ledger.record(file_name, "cleaned", raw_rows=raw_rows, cleaned_rows=writer.rows_written,
+                      clean_seconds=time.perf_counter() - start)
+    return counters
+
+def _clean_row_group_task(file_path, row_group_idx, engine):
+    """Process-pool task: clean one row group of a file. Returns (cleaned_table, counters, bytes_read, skipped)."""
+    counters = dict.fromkeys(CLEANING_COUNTERS, 0)
+    with pq.ParquetFile(file_path) as parquet_file:
+        schema = cleaned_schema(parquet_file.schema_arrow)
+        cleaned, bytes_read, skipped = _read_and_clean(parquet_file, row_group_idx, engine, schema, counters)
+    return cleaned, counters, bytes_read, skipped
+
+def clean_files_parallel(file_paths, engine=None, workers=None, dedup_index=None, ledger=None):
+    """
+    Clean files by spreading their (file, row group) units over a ProcessPoolExecutor.
+
+    Results are consumed in submission order, so each output file keeps its input row order, and
+    the dedup index (if any) sees rows in the same order as the serial path. At most 2 * workers
+    row groups are in flight. Returns the summed discard counters. With a RunLedger each file is recorded
+    as cleaned or failed when its last row group is collected.
+    """
+    engine = engine or config.CLEANING_ENGINE
+    workers = workers or config.CLEANING_WORKERS
+    totals = dict.fromkeys(CLEANING_COUNTERS, 0)
+
+    # Read the footers up front to know each file's row groups and output schema
+    plans = []
+    raw_rows = {}
+    for file_path in file_paths:
+        try:
+            with pq.ParquetFile(file_path) as parquet_file:
+                plans.append((file_path, parquet_file.num_row_groups, cleaned_schema(parquet_file.schema_arrow)))
+                raw_rows[file_path] = parquet_file.metadata.num_rows
+            scan_stats.record("clean", file_bytes=os.path.getsize(file_path))
+        except Exception as e:
+            logger.error(f"Error reading parquet file {os.path.basename(file_path)}: {e}")
+            if ledger is not None:
+                ledger.failed(os.path.basename(file_path), "clean", e)
+
+    def units():
+        for file_path, num_row_groups, _ in plans:
+            for row_group_idx in range(num_row_groups):
+                yield file_path, row_group_idx
+
+    schemas = {file_path: schema for file_path, _, schema in plans}
+    remaining = {file_path: num_row_groups for file_path, num_row_groups, _ in plans}
+    writers = {}
+    failed = set()
+    start = time.perf_counter()
+
+    def open_writer(file_path):
+        logger.info(f"Processing file: {os.path.basename(file_path)} ({engine} engine, {workers} workers)")
+        writers[file_path] = RowGroupWriter(_cleaned_output_path(file_path), schemas[file_path],
+                                            config.CLEANED_ROW_GROUP_SIZE, compression=config.CLEANED_COMPRESSION)
+
+    def finish_file(file_path):
+        writer = writers.pop(file_path, None)
+        output_file_path = _cleaned_output_path(file_path)
+        try:
+            if file_path in failed:
+                raise RuntimeError("a row group failed to clean")
+            if writer is None:
+                open_writer(file_path)  # File without row groups
+                writer = writers.pop(file_path)
+            writer.close()
+            logger.info(f"Cleaned data saved to {output_file_path} ({writer.rows_written} rows, "
+                        f"{writer.row_groups_written} row groups)")
+            _replace_with_cleaned(file_path, output_file_path)
+            if dedup_index is not None:
+                dedup_index.commit(os.path.basename(file_path))
+            if ledger is not None:
+                # Row groups of all files overlap in the pool, so the duration is since the pool started
+                ledger.record(os.path.basename(file_path), "cleaned", raw_rows=raw_rows[file_path],
+                              cleaned_rows=writer.rows_written, clean_seconds=time.perf_counter() - start)
+        except Exception as e:
+            logger.error(f"Error processing parquet file {os.path.basename(file_path)}: {e}")
+            if dedup_index is not None:
+                dedup_index.discard(os.path.basename(file_path))
+            if writer is not None:
+                writer.abort()
+            if os.path.exists(output_file_path):
+                os.remove(output_file_path)  # Drop the partially written output
+            if ledger is not None:
+                ledger.failed(os.path.basename(file_path), "clean", e)
+
+    def collect(file_path, future):
+        try:
+            cleaned, counters, bytes_read, skipped = future.result()
+            scan_stats.record("clean", bytes_read=bytes_read, row_groups=1, skipped=int(skipped))
+            if file_path not in failed:
+                cleaned = _drop_seen_rows(cleaned, os.path.basename(file_path), dedup_index, counters)
+                if file_path not in writers:
+                    open_writer(file_path)
+                writers[file_path].write(cleaned)
+                for key, value in counters.items():
+                    totals[key] += value
+        except Exception as e:
+            logger.error(f"Error cleaning a row group of {os.path.basename(file_path)}: {e}")
+            failed.add(file_path)
+        remaining[file_path] -= 1
+        if remaining[file_path] == 0:
+            finish_file(file_path)
+
+    for file_path, num_row_groups, _ in plans:
+        if num_row_groups == 0:
+            finish_file(file_path)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for file_path, row_group_idx in units():
+            if len(in_flight) >= 2 * workers:
+                collect(*in_flight.popleft())
+            in_flight.append((file_path, executor.submit(_clean_row_group_task, file_path, row_group_idx, engine)))
+        while in_flight:
+            collect(*in_flight.popleft())
+
+    return totals
+
+def log_cleaning_summary(totals):
+    """Log the final cleaning summary for a dict of discarded row counters."""
+    logger.info("Cleaning Summary:")
+    logger.info(f"Total discarded rows with empty make/model: {totals['make_model']}")
+    logger.info(f"Total discarded rows with empty lat/long: {totals['lat_long']}")
+    logger.info(f"Total discarded rows with empty deviceId, sha, and md5: {totals['all_null_ids']}")
+    logger.info(f"Total discarded duplicate rows: {totals['duplicates']}")
+    if any(totals[f"duplicates_{scope}"] for scope in DEDUP_SCOPES):
+        logger.info(f"Total discarded duplicates across row groups of a file: {totals['duplicates_file']}")
+        logger.info(f"Total discarded duplicates across files of the same dump: {totals['duplicates_cross_file']}")
+        logger.info(f"Total discarded duplicates across the bid and nobid dumps: {totals['duplicates_cross_dump']}")
+
+def create_dedup_index():
+    """The cross-file dedup index for one run, or None when GLOBAL_DEDUP is off."""
+    if not config.GLOBAL_DEDUP:
+        return None
+    return RowHashIndex(config.DEDUP_MEMORY_BUDGET_MB, config.DEDUP_SPILL_DIR, config.DEDUP_KEY_COLUMNS)
+
+def clean_data(temp_dir, engine=None, workers=None, ledger=None):
+    """
+    Clean data in the given files from the temporary directory.
+    With more than one worker (CLEANING_WORKERS / --workers) row groups are cleaned in a process pool.
+    With a RunLedger every file is recorded as cleaned or failed.
+    """
+    workers = workers or config.CLEANING_WORKERS
+    totals = dict.fromkeys(CLEANING_COUNTERS, 0)
+    dedup_index = create_dedup_index()
 
     # List all Parquet files in the temporary directory
-    for file_name in os.listdir(temp_dir):
-        if file_name.endswith(".parquet"):
-            file_path = os.path.join(temp_dir, file_name)
-            output_file_path = os.path.join(temp_dir, f"cleaned_{file_name}")  # Use a new cleaned file
-            logger.info(f"Processing file: {file_name}")
-
-            discarded_make_model = 0
-            discarded_lat_long = 0
-            discarded_all_null_ids = 0
-            discarded_duplicates = 0
-
-            try:
-                with pq.ParquetFile(file_path) as parquet_file:
-                    cleaned_data_list = []  # Store chunks to avoid memory issues
-
-                    # Process each row group separately
-                    for row_group_idx in range(parquet_file.num_row_groups):
-                        logger.info(f"Processing Row Group {row_group_idx + 1}/{parquet_file.num_row_groups} for {file_name}")
-
-                        # Read a row group as an Arrow Table and convert it to a Pandas DataFrame
-                        chunk = parquet_file.read_row_group(row_group_idx).to_pandas()
-
-                        # Convert specific columns to string to prevent type issues
-                        chunk['device_ifa'] = chunk['device_ifa'].astype(str)
-                        chunk['dpidsha1'] = chunk['dpidsha1'].astype(str)
-                        chunk['dpidmd5'] = chunk['dpidmd5'].astype(str)
-
-                        # Fill NaN values with empty strings
-                        chunk = chunk.fillna("").astype(str)
-
-                        # Convert numeric columns safely
-                        numeric_columns = ['date', 'bid_price', 'bid_req_adv_floor_sum', 'dsp_net_price_sum', 'curr_excg_rate']
-                        for col in numeric_columns:
-                            if col in chunk.columns:
-                                chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
-
-                        # Discard rows with empty make/model
-                        initial_count = len(chunk)
-                        chunk = chunk[~((chunk['device_vendor'] == '') & (chunk['device_model'] == ''))]
-                        discarded_make_model += (initial_count - len(chunk))
-
-                        # Discard rows with empty latitude/longitude
-                        initial_count = len(chunk)
-                        chunk = chunk[~((chunk['latitude'] == '') & (chunk['longitude'] == ''))]
-                        discarded_lat_long += (initial_count - len(chunk))
-
-                        # Discard rows with all three empty IDs
-                        initial_count = len(chunk)
-                        chunk = chunk[~((chunk['device_ifa'] == '') & (chunk['dpidsha1'] == '') & (chunk['dpidmd5'] == ''))]
-                        discarded_all_null_ids += (initial_count - len(chunk))
-
-                        # Replace empty 'device_ifa' with 'dpidsha1' or 'dpidmd5'
-                        chunk['device_ifa'] = np.where(chunk['device_ifa'] != '', chunk['device_ifa'],
-                                                    np.where(chunk['dpidsha1'] != '', chunk['dpidsha1'], chunk['dpidmd5']))
-
-                        # Drop duplicates within the current chunk
-                        initial_count = len(chunk)
-                        chunk = chunk.drop_duplicates()
-                        discarded_duplicates += (initial_count - len(chunk))
-
-                        cleaned_data_list.append(chunk)  # Store cleaned chunks
-
-                    # Merge all cleaned chunks into a single DataFrame
-                    if cleaned_data_list:
-                        final_df = pd.concat(cleaned_data_list, ignore_index=True)
-
-                        # Write to a new Parquet file
-                        final_df.to_parquet(output_file_path, engine="pyarrow", index=False, compression="snappy")
-
-                        logger.info(f"Cleaned data saved to {output_file_path}")
-
-                    # Update total discarded row counts
-                    total_discarded_make_model += discarded_make_model
-                    total_discarded_lat_long += discarded_lat_long
-                    total_discarded_all_null_ids += discarded_all_null_ids
-                    total_discarded_duplicates += discarded_duplicates
-
-                # Rename cleaned file back to the original name
-                os.remove(file_path)  # Delete original file
-                os.rename(output_file_path, file_path)  # Rename cleaned file
-                logger.info(f"Replaced original file with cleaned version: {file_path}")
-
-            except Exception as e:
-                logger.error(f"Error processing parquet file {file_name}: {e}")
-                continue
-
-    # Log final cleaning summary
-    logger.info("Cleaning Summary:")
-    logger.info(f"Total discarded rows with empty make/model: {total_discarded_make_model}")
-    logger.info(f"Total discarded rows with empty lat/long: {total_discarded_lat_long}")
-    logger.info(f"Total discarded rows with empty deviceId, sha, and md5: {total_discarded_all_null_ids}")
-    logger.info(f"Total discarded duplicate rows: {total_discarded_duplicates}")
+    file_paths = [os.path.join(temp_dir, file_name) for file_name in sorted(os.listdir(temp_dir))
+                  if file_name.endswith(".parquet")]
+
+    if workers > 1:
+        totals = clean_files_parallel(file_paths, engine, workers, dedup_index, ledger)
+    else:
+        for file_path in file_paths:
+            counters = clean_file(file_path, engine, dedup_index, ledger)
+
+            # Update total discarded row counts
+            for key, value in (counters or {}).items():
+                totals[key] += value
+
+    log_cleaning_summary(totals)
+    scan_stats.log_stats("clean")
+
+    if dedup_index is not None:
+        dedup_index.close()
@@ -0,0 +1,289 @@
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from logger import get_logger
+
+logger = get_logger("Deduplication")
+
+DEDUP_SCOPES = ("file", "cross_file", "cross_dump")
+_PARTITION_BITS = 6  # 64 partitions keyed on the top bits of the row hash
+_TIER_RATIO = 2  # a new run is merged into the previous one while it is at least 1/_TIER_RATIO of its size
+_MAX_SPILLED_RUNS = 4  # spilled runs per partition before they are merged on disk
+_COMMIT_CHUNK = 1 << 20  # staged entries moved into the index at a time
+_ENTRY_BYTES = 8 + 2  # uint64 hash + uint16 source id
+_NULL_HASH = np.uint64(0x9E3779B97F4A7C15)
+
+
+def row_hashes(table, columns=None):
+    """
+    64-bit hash of every row of an Arrow table over `columns` (default: all of them, in order). A key
+    column the table lacks hashes like an all-null column, so tables with different column sets still
+    compare on the columns they share. Each column is dictionary-encoded first, so only its distinct
+    values are hashed and the per-row work is a numpy gather.
+    """
+    combined = np.full(table.num_rows, 0x345678, dtype=np.uint64)
+    multiplier = np.uint64(1000003)
+    for name in (table.column_names if columns is None else columns):
+        if name in table.column_names:
+            column = table[name]
+            encoded = pc.dictionary_encode(column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column)
+            value_hashes = pd.util.hash_array(encoded.dictionary.to_numpy(zero_copy_only=False))
+            value_hashes = np.append(value_hashes, _NULL_HASH)  # slot for nulls
+            indices = pc.fill_null(encoded.indices, len(encoded.dictionary)).to_numpy()
+            combined = (combined ^ value_hashes[indices]) * multiplier
+        else:
+            combined = (combined ^ _NULL_HASH) * multiplier
+        multiplier += np.uint64(82520)
+    return combined
+
+
+def dump_kind(file_name):
+    """'nobid' or 'bid' depending on which dump a file came from."""
+    name = os.path.basename(file_name).lower()
+    return "nobid" if "nobid" in name else "bid"
+
+
+def _merge_runs(runs):
+    hashes = np.concatenate([run[0] for run in runs])
+    sources = np.concatenate([run[1] for run in runs])
+    order = np.argsort(hashes, kind="stable")
+    return hashes[order], sources[order]
+
+
+class _Partition:
+    """
+    Sorted runs of (hash, source) pairs; a run is an in-memory array or a memory-mapped spill file.
+
+    Runs are merged by size tier, like an LSM tree: a new run is merged into the previous one only while
+    it is at least 1/_TIER_RATIO of its size, so every entry is merged O(log n) times and a partition
+    holds O(log n) runs. Spilled runs are merged on disk once there are more than _MAX_SPILLED_RUNS.
+    """
+
+    def __init__(self):
+        self.runs = []  # list of (hashes, sources, spill_base); spill_base is None for in-memory runs
+
+    @property
+    def memory_bytes(self):
+        return sum(len(hashes) * _ENTRY_BYTES for hashes, _, spill_base in self.runs if spill_base is None)
+
+    def lookup(self, hashes):
+        """Return the source id of each hash already in the partition, or -1."""
+        if not self.runs:
+            return np.full(len(hashes), -1, dtype=np.int32)
+        # Sorted queries walk each run in order, which is far more cache friendly on large runs
+        order = np.argsort(hashes)
+        queries = hashes[order]
+        found_origins = np.full(len(hashes), -1, dtype=np.int32)
+        for run_hashes, run_sources, _ in self.runs:
+            if not len(run_hashes):
+                continue
+            positions = np.searchsorted(run_hashes, queries)
+            positions[positions == len(run_hashes)] = 0
+            found = (run_hashes[positions] == queries) & (found_origins < 0)
+            found_origins[found] = run_sources[positions[found]]
+        origins = np.empty_like(found_origins)
+        origins[order] = found_origins
+        return origins
+
+    def add(self, hashes, sources):
+        if not len(hashes):
+            return
+        order = np.argsort(hashes, kind="stable")
+        run = (hashes[order], sources[order], None)
+        while self.runs and self.runs[-1][2] is None and len(run[0]) * _TIER_RATIO >= len(self.runs[-1][0]):
+            run = (*_merge_runs([self.runs.pop(), run]), None)
+        self.runs.append(run)
+
+    def spill(self, base):
+        """
+        Merge the in-memory runs into one run written to `base`_*.npy and memory-mapped back. Spilled runs
+        of a similar size are folded into it, and all of them once there are more than _MAX_SPILLED_RUNS.
+        """
+        merging = [run for run in self.runs if run[2] is None]
+        if not merging:
+            return
+        spilled = [run for run in self.runs if run[2] is not None]
+        size = sum(len(run[0]) for run in merging)
+        while spilled and (size * _TIER_RATIO >= len(spilled[-1][0]) or len(spilled) >= _MAX_SPILLED_RUNS):
+            run = spilled.pop()
+            merging.insert(0, run)
+            size += len(run[0])
+        merged_hashes, merged_sources = _merge_runs(merging)
+        np.save(f"{base}_hashes.npy", merged_hashes)
+        np.save(f"{base}_sources.npy", merged_sources)
+        del merged_hashes, merged_sources
+        for _, _, spill_base in merging:
+            _remove_spill(spill_base)
+        self.runs = spilled + [(np.load(f"{base}_hashes.npy", mmap_mode="r"),
+                                np.load(f"{base}_sources.npy", mmap_mode="r"), base)]
+
+    def drop(self):
+        """Forget every run and delete the spill files."""
+        for _, _, spill_base in self.runs:
+            _remove_spill(spill_base)
+        self.runs = []
+
+
+def _remove_spill(base):
+    if base is None:
+        return
+    for suffix in ("_hashes.npy", "_sources.npy"):
+        try:
+            os.remove(f"{base}{suffix}")
+        except OSError:
+            pass
+
+
+class _StagedFile:
+    """Hashes and duplicate counts of a file being cleaned, kept out of the index until it succeeds."""
+
+    def __init__(self):
+        self.partition = _Partition()
+        self.removed = dict.fromkeys(DEDUP_SCOPES, 0)
+
+
+class RowHashIndex:
+    """
+    Global duplicate filter across row groups, files and the bid/nobid dumps of a run.
+
+    Rows are reduced to 64-bit hashes of their `key_columns` (all columns when empty), kept in sorted
+    numpy runs split into partitions by the top hash bits. When the in-memory runs, staged ones
+    included, exceed `memory_budget_mb`, the largest partitions are spilled to memory-mapped files in
+    `spill_dir`.
+
+    The hashes of a file are staged until commit(file_name) once the file is cleaned, or dropped by
+    discard(file_name) when it fails, so a failed file never hides its rows from a retry or from
+    another file. Files cleaned at the same time are not deduplicated against each other.
+    Thread-safe, so pipeline workers can share it.
+    """
+
+    def __init__(self, memory_budget_mb=256, spill_dir=None, key_columns=None):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.key_columns = list(key_columns) if key_columns else None
+        self._spill_root = spill_dir or None
+        self._spill_dir = None
+        self._partitions = [_Partition() for _ in range(1 << _PARTITION_BITS)]
+        self._sources = []  # file names by source id
+        self._staged = {}  # file name -> _StagedFile
+        self._spill_count = 0
+        self._lock = threading.Lock()
+        self.removed = dict.fromkeys(DEDUP_SCOPES, 0)
+
+    def _source_id(self, file_name):
+        if file_name not in self._sources:
+            if len(self._sources) >= np.iinfo(np.uint16).max:
+                raise ValueError("RowHashIndex supports at most 65535 source files")
+            self._sources.append(file_name)
+        return self._sources.index(file_name)
+
+    def filter_table(self, table, file_name):
+        """
+        Drop rows of `table` already seen earlier in this file or in a committed one and stage the rest
+        for commit(file_name). Returns (filtered_table, {scope: removed_rows}).
+        """
+        removed = dict.fromkeys(DEDUP_SCOPES, 0)
+        if table.num_rows == 0:
+            return table, removed
+
+        hashes = row_hashes(table, self.key_columns)
+        with self._lock:
+            source = self._source_id(file_name)
+            staged = self._staged.setdefault(file_name, _StagedFile())
+            origins = np.full(len(hashes), -1, dtype=np.int32)
+            partition_ids = hashes >> np.uint64(64 - _PARTITION_BITS)
+            for partition_id in np.unique(partition_ids):
+                mask = partition_ids == partition_id
+                origins[mask] = self._partitions[partition_id].lookup(hashes[mask])
+
+            # Repeats of earlier row groups or inside this batch count as duplicates within the file
+            _, first_positions = np.unique(hashes, return_index=True)
+            first_in_batch = np.zeros(len(hashes), dtype=bool)
+            first_in_batch[first_positions] = True
+            origins[(origins < 0) & ((staged.partition.lookup(hashes) >= 0) | ~first_in_batch)] = source
+
+            keep = origins < 0
+            staged.partition.add(hashes[keep], np.full(int(keep.sum()), source, dtype=np.uint16))
+            self._enforce_budget()
+
+            for origin in np.unique(origins[~keep]):
+                count = int((origins == origin).sum())
+                if origin == source:
+                    scope = "file"
+                elif dump_kind(self._sources[origin]) == dump_kind(file_name):
+                    scope = "cross_file"
+                else:
+                    scope = "cross_dump"
+                removed[scope] += count
+                staged.removed[scope] += count
+
+        return table.filter(pa.array(keep)), removed
+
+    def commit(self, file_name):
+        """Add the staged hashes of a successfully cleaned file to the index."""
+        with self._lock:
+            staged = self._staged.pop(file_name, None)
+            if staged is None:
+                return
+            runs, staged.partition.runs = staged.partition.runs, []
+            for run_hashes, run_sources, spill_base in runs:
+                # Spilled runs are read back a chunk at a time
+                for start in range(0, len(run_hashes), _COMMIT_CHUNK):
+                    hashes = np.asarray(run_hashes[start:start + _COMMIT_CHUNK])
+                    sources = np.asarray(run_sources[start:start + _COMMIT_CHUNK])
+                    partition_ids = hashes >> np.uint64(64 - _PARTITION_BITS)
+                    for partition_id in np.unique(partition_ids):
+                        mask = partition_ids == partition_id
+                        self._partitions[partition_id].add(hashes[mask], sources[mask])
+                    self._enforce_budget()
+                del run_hashes, run_sources
+                _remove_spill(spill_base)
+            for scope, count in staged.removed.items():
+                self.removed[scope] += count
+
+    def discard(self, file_name):
+        """Forget the staged hashes of a file that failed, so its rows are not treated as seen."""
+        with self._lock:
+            staged = self._staged.pop(file_name, None)
+            if staged is not None:
+                staged.partition.drop()
+
+    @property
+    def memory_bytes(self):
+        """In-memory size of the committed and the staged hashes, which share `memory_budget`."""
+        return (sum(partition.memory_bytes for partition in self._partitions)
+                + sum(staged.partition.memory_bytes for staged in self._staged.values()))
+
+    def _enforce_budget(self):
+        memory_bytes = self.memory_bytes
+        if memory_bytes <= self.memory_budget:
+            return
+        if self._spill_dir is None:
+            if self._spill_root:
+                os.makedirs(self._spill_root, exist_ok=True)
+            self._spill_dir = tempfile.mkdtemp(prefix="dedup_spill_", dir=self._spill_root)
+
+        # Spill the largest partitions, committed or staged, until the in-memory runs fit in half the budget
+        partitions = [(f"part{partition_id:02d}", partition) for partition_id, partition in enumerate(self._partitions)]
+        partitions += [(f"staged{self._sources.index(file_name)}", staged.partition)
+                       for file_name, staged in self._staged.items()]
+        for label, partition in sorted(partitions, key=lambda item: -item[1].memory_bytes):
+            if memory_bytes <= self.memory_budget // 2:
+                break
+            partition_bytes = partition.memory_bytes
+            partition.spill(os.path.join(self._spill_dir, f"{label}_{self._spill_count}"))
+            self._spill_count += 1
+            memory_bytes -= partition_bytes
+        logger.info(f"Dedup index spilled to {self._spill_dir}; {memory_bytes / 1024 / 1024:.1f} MB left in memory")
+
+    def close(self):
+        """Release the index and delete its spill files."""
+        self._partitions = [_Partition() for _ in range(1 << _PARTITION_BITS)]
+        self._staged = {}
+        if self._spill_dir:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
@@ -1,10 +1,20 @@
 import os
+import re
 import tempfile
+from datetime import datetime, timedelta
 import zstandard as zstd
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
 from logger import get_logger
 from config import config
+from runLedger import object_name
 
 ACCESS_KEY = config.ACCESS_KEY_TEST
 SECRET_KEY = config.SECRET_KEY_TEST
@@ -14,92 +24,409 @@ BUCKET_NAME = config.BUCKET_NAME_TEST
 
 logger=get_logger("DownloadingAndDecompressing")
 
+MB = 1024 * 1024
+
+DUMP_KINDS = ("bid", "nobid")
+
+_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+LISTING_DISCOVERY_DEPTH = 3  # key levels walked to find date directories when no prefix template is set
+
+def _get_s3_client(max_pool_connections=10):
+    """One client can be shared by all download threads; size its pool to the number of concurrent requests."""
+    return boto3.client(
+        "s3",
+        config=BotoConfig(max_pool_connections=max(max_pool_connections, 10)),
+        region_name=REGION_NAME,
+        endpoint_url=ENDPOINT_URL,
+        aws_access_key_id=ACCESS_KEY,
+        aws_secret_access_key=SECRET_KEY,
+    )
+
+def _expand_dates(date_filter):
+    """Turn a single date or an inclusive (start, end) range into a list of 'YYYY-MM-DD' strings."""
+    if not date_filter:
+        return []
+    if isinstance(date_filter, str):
+        return [date_filter]
+    start, end = date_filter
+    start_date = datetime.strptime(start, "%Y-%m-%d").date()
+    end_date = datetime.strptime(end, "%Y-%m-%d").date()
+    if end_date < start_date:
+        raise ValueError(f"Invalid date range: {start} is after {end}")
+    return [(start_date + timedelta(days=offset)).isoformat()
+            for offset in range((end_date - start_date).days + 1)]
+
+def _listing_prefixes(dates):
+    """Build the S3 prefixes to list from S3_LISTING_PREFIX_TEMPLATE; [''] lists the whole bucket."""
+    template = config.S3_LISTING_PREFIX_TEMPLATE
+    if not template or (dates == [] and "{date}" in template):
+        return [""]
+    prefixes = []
+    for date in dates or [""]:
+        for kind in (DUMP_KINDS if "{kind}" in template else ("",)):
+            prefix = template.format(date=date, kind=kind)
+            if prefix not in prefixes:
+                prefixes.append(prefix)
+    return prefixes
+
+def _list_objects(paginator, bucket_name, prefix, page_size):
+    """Yield every object under `prefix`, following all pages of the listing."""
+    logger.info(f"Listing s3://{bucket_name}/{prefix}")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, PaginationConfig={"PageSize": page_size}):
+        yield from page.get("Contents", [])
+
+def _walk_dated_objects(paginator, bucket_name, dates, page_size, prefix="", depth=0):
+    """
+    Yield the objects that can belong to `dates` without a prefix template: the key hierarchy is walked
+    '/' level by level, and a "directory" naming a date (e.g. 2024-02-27/ or dt=2024-02-27/) is listed
+    only when that date is wanted, so other days are never listed. Below LISTING_DISCOVERY_DEPTH levels,
+    or once a wanted date is found, the rest is listed flat.
+    """
+    if depth >= LISTING_DISCOVERY_DEPTH:
+        yield from _list_objects(paginator, bucket_name, prefix, page_size)
+        return
+    children = []
+    pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter="/", PaginationConfig={"PageSize": page_size})
+    for page in pages:
+        yield from page.get("Contents", [])
+        children.extend(common["Prefix"] for common in page.get("CommonPrefixes", []))
+    for child in children:
+        named_dates = _DATE_PATTERN.findall(child[len(prefix):])
+        if not named_dates:
+            yield from _walk_dated_objects(paginator, bucket_name, dates, page_size, child, depth + 1)
+        elif any(date in dates for date in named_dates):
+            yield from _list_objects(paginator, bucket_name, child, page_size)
+
+def iterFilesInBucket(bucket_name, date_filter=None, s3_client=None, page_size=1000):
+    """
+    Lazily yield (key, size_kb, etag) for 'bid'/'nobid' files in the bucket.
+
+    date_filter is either a single 'YYYY-MM-DD' date or an inclusive (start, end) tuple. The dates and
+    dump kinds are pushed down to S3 as prefixes built from S3_LISTING_PREFIX_TEMPLATE when it is set;
+    otherwise the prefixes are derived from the date range by walking the key hierarchy, skipping the
+    directories of other dates. Every page of the listing is followed, so buckets with more than 1,000
+    keys are listed completely.
+    """
+    s3_client = s3_client or _get_s3_client()
+    dates = _expand_dates(date_filter)
+    paginator = s3_client.get_paginator("list_objects_v2")
+    if dates and not config.S3_LISTING_PREFIX_TEMPLATE:
+        prefixes = None
+        objects = _walk_dated_objects(paginator, bucket_name, dates, page_size)
+    else:
+        prefixes = _listing_prefixes(dates)
+        objects = (item for prefix in prefixes for item in _list_objects(paginator, bucket_name, prefix, page_size))
+    seen_keys = set()
+
+    for item in objects:
+        file_name = item["Key"]
+        lower_name = file_name.lower()
+
+        # Include files with 'bid' or 'nobid' in their names ('nobid' contains 'bid')
+        if "bid" not in lower_name:
+            continue
+        if dates and not any(date in file_name for date in dates):
+            continue
+        if prefixes and len(prefixes) > 1:
+            if file_name in seen_keys:
+                continue
+            seen_keys.add(file_name)
+
+        yield file_name, item["Size"] / 1024, item.get("ETag", "").strip('"')  # Convert size to KB
+
 def listFilesInBucket(bucket_name, date_filter=None):
     """List files in the specified bucket, only including files with 'bid' or 'nobid' in their names."""
     try:
-        s3_client = boto3.client(
-            "s3",
-            region_name=REGION_NAME,
-            endpoint_url=ENDPOINT_URL,
-            aws_access_key_id=ACCESS_KEY,
-            aws_secret_access_key=SECRET_KEY,
-        )
-        response = s3_client.list_objects_v2(Bucket=bucket_name)
-        
-        if "Contents" in response:
-            files = response["Contents"]
-            filtered_files = []
-
-            print("Files in S3 Bucket:")
-            for item in files:
-                file_name = item["Key"]
-                file_size = item["Size"] / 1024  # Convert size to KB
-                
-                # Include files with 'bid' or 'nobid' in their names
-                if "bid" in file_name.lower() or "nobid" in file_name.lower():
-                    if date_filter:
-                        if date_filter in file_name:
-                            filtered_files.append((file_name, file_size))
-                    else:
-                        filtered_files.append((file_name, file_size))
-
-            for file in filtered_files:
-                print(f" {file[0]} - {file[1]/1024:.2f} KB")
-
-            return filtered_files
-        else:
+        filtered_files = list(iterFilesInBucket(bucket_name, date_filter))
+
+        if not filtered_files:
             logger.info("No files found in the bucket.")
             return []
+
+        print("Files in S3 Bucket:")
+        for file in filtered_files:
+            print(f" {file[0]} - {file[1]:.2f} KB")
+
+        return filtered_files
     except (NoCredentialsError, PartialCredentialsError) as e:
         logger.error(f"Error: {e}")
         return []
 
 
 
-def downloadAndDecompressFiles(files):
-    """Download and decompress files in a temp directory inside the current folder."""
-    s3_client = boto3.client(
-        "s3",
-        region_name=REGION_NAME,
-        endpoint_url=ENDPOINT_URL,
-        aws_access_key_id=ACCESS_KEY,
-        aws_secret_access_key=SECRET_KEY,
+def _decompress_file(file_name, temp_file_path):
+    """Decompress a downloaded .zst file next to itself and remove the compressed copy."""
+    decompressed_file_path = temp_file_path[:-4]  # Remove .zst extension
+    try:
+        with open(temp_file_path, 'rb') as compressed_file, open(decompressed_file_path, 'wb') as output_file:
+            dctx = zstd.ZstdDecompressor()
+            with dctx.stream_reader(compressed_file) as reader:
+                while True:
+                    chunk = reader.read(65536)  # 64KB chunks
+                    if not chunk:
+                        break
+                    output_file.write(chunk)
+
+        logger.info(f"Decompressed: {temp_file_path} to {decompressed_file_path}")
+
+        # Replace the compressed file with the decompressed one
+        os.remove(temp_file_path)
+
+        logger.info(f"Replaced compressed file with decompressed file: {decompressed_file_path}")
+        return decompressed_file_path
+    except Exception as e:
+        logger.error(f"Error decompressing {file_name}: {e}")
+        return None
+
+class _ReadAheadBody:
+    """
+    File-like wrapper around an S3 StreamingBody that counts bytes and, when `prefetch_chunks` > 0,
+    reads the body on a background thread so network reads overlap with decompression.
+    """
+
+    def __init__(self, body, chunk_size, prefetch_chunks=0):
+        self._body = body
+        self._chunk_size = chunk_size
+        self._buffer = b""
+        self._eof = False
+        self.bytes_read = 0
+        self._queue = None
+        self._closed = False
+        if prefetch_chunks > 0:
+            self._queue = queue.Queue(maxsize=prefetch_chunks)
+            self._thread = threading.Thread(target=self._prefetch, name="s3-readahead", daemon=True)
+            self._thread.start()
+
+    def _prefetch(self):
+        try:
+            while not self._closed:
+                chunk = self._body.read(self._chunk_size)
+                self._queue.put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self._queue.put(e)
+
+    def _next_chunk(self):
+        chunk = self._queue.get() if self._queue else self._body.read(self._chunk_size)
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._next_chunk()
+            if not chunk:
+                self._eof = True
+                break
+            self.bytes_read += len(chunk)
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self._closed = True
+        if self._queue:
+            # Unblock the prefetch thread if the consumer stopped early
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        self._body.close()
+
+class _RangedBody:
+    """
+    File-like body of an S3 object fetched as ranged GETs of `part_size` bytes, up to `concurrency`
+    of them in flight, handed out in order. Every part is pinned to `etag`, so an object replaced
+    mid-stream fails instead of mixing versions. Holds at most `concurrency` parts in memory.
+    """
+
+    def __init__(self, s3_client, bucket_name, key, size, etag, part_size, concurrency):
+        self._s3_client = s3_client
+        self._bucket_name = bucket_name
+        self._key = key
+        self._size = size
+        self._etag = etag
+        self._part_size = part_size
+        self._next_offset = 0
+        self._parts = deque()
+        self._part = memoryview(b"")
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="s3-range")
+        for _ in range(concurrency):
+            self._submit_next()
+
+    def _fetch(self, first, last):
+        response = self._s3_client.get_object(Bucket=self._bucket_name, Key=self._key, Range=f"bytes={first}-{last}",
+                                              IfMatch=self._etag)
+        return response["Body"].read()
+
+    def _submit_next(self):
+        if self._next_offset < self._size:
+            last = min(self._next_offset + self._part_size, self._size) - 1
+            self._parts.append(self._executor.submit(self._fetch, self._next_offset, last))
+            self._next_offset = last + 1
+
+    def read(self, size=-1):
+        if not self._part and self._parts:
+            self._part = memoryview(self._parts.popleft().result())
+            self._submit_next()
+        if size < 0:
+            size = len(self._part)
+        data, self._part = bytes(self._part[:size]), self._part[size:]
+        return data
+
+    def close(self):
+        for part in self._parts:
+            part.cancel()
+        self._executor.shutdown(wait=False)
+
+def _stream_one(s3_client, bucket_name, file_name, temp_dir, transfer_config):
+    """
+    Pipe a .zst object straight through the zstd decompressor, so the compressed bytes never touch
+    disk. Objects larger than one part (transfer_config.multipart_chunksize) are fetched as ordered
+    ranged GETs with up to transfer_config.max_concurrency parts in flight, like a regular download;
+    smaller ones with a single GetObject. Other objects fall back to a regular download.
+    Returns (local_path, bytes_downloaded, seconds).
+    """
+    if not file_name.endswith('.zst'):
+        return _download_one(s3_client, bucket_name, file_name, temp_dir, transfer_config)
+
+    decompressed_file_path = os.path.join(temp_dir, os.path.basename(file_name)[:-4])  # Remove .zst extension
+    partial_file_path = f"{decompressed_file_path}.partial"
+    chunk_size = config.STREAM_CHUNK_MB * MB
+    start = time.perf_counter()
+
+    part_size = transfer_config.multipart_chunksize
+    concurrency = transfer_config.max_concurrency if transfer_config.use_threads else 1
+    head = s3_client.head_object(Bucket=bucket_name, Key=file_name) if concurrency > 1 else None
+    if head is not None and head["ContentLength"] > part_size:
+        # The parts are already fetched ahead, so no read-ahead thread on top
+        body = _ReadAheadBody(_RangedBody(s3_client, bucket_name, file_name, head["ContentLength"], head["ETag"],
+                                          part_size, concurrency), chunk_size)
+    else:
+        response = s3_client.get_object(Bucket=bucket_name, Key=file_name)
+        body = _ReadAheadBody(response["Body"], chunk_size, prefetch_chunks=config.STREAM_READAHEAD_CHUNKS)
+    try:
+        with open(partial_file_path, 'wb', buffering=chunk_size) as output_file:
+            dctx = zstd.ZstdDecompressor()
+            with dctx.stream_reader(body, read_size=chunk_size, read_across_frames=True) as reader:
+                while True:
+                    chunk = reader.read(chunk_size)
+                    if not chunk:
+                        break
+                    output_file.write(chunk)
+        os.replace(partial_file_path, decompressed_file_path)
+    except Exception:
+        if os.path.exists(partial_file_path):
+            os.remove(partial_file_path)
+        raise
+    finally:
+        body.close()
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Streamed and decompressed: {file_name} to {decompressed_file_path} "
+                f"({body.bytes_read / MB:.2f} MB in {elapsed:.2f}s, {body.bytes_read / MB / max(elapsed, 1e-9):.2f} MB/s)")
+    return decompressed_file_path, body.bytes_read, elapsed
+
+def _download_one(s3_client, bucket_name, file_name, temp_dir, transfer_config):
+    """Download (and decompress) a single object. Returns (local_path, bytes_downloaded, seconds)."""
+    temp_file_path = os.path.join(temp_dir, os.path.basename(file_name))
+    start = time.perf_counter()
+
+    # Download the file; parts are fetched with ranged GETs according to transfer_config
+    s3_client.download_file(bucket_name, file_name, temp_file_path, Config=transfer_config)
+    elapsed = time.perf_counter() - start
+    size_bytes = os.path.getsize(temp_file_path)
+    logger.info(f"Downloaded: {file_name} to {temp_file_path} "
+                f"({size_bytes / MB:.2f} MB in {elapsed:.2f}s, {size_bytes / MB / max(elapsed, 1e-9):.2f} MB/s)")
+
+    # Decompress if the file is .zst
+    if temp_file_path.endswith('.zst'):
+        temp_file_path = _decompress_file(file_name, temp_file_path)
+
+    return temp_file_path, size_bytes, elapsed
+
+def prepare_transfer(workers, part_size_mb=None, part_concurrency=None, mode=None):
+    """
+    Build the shared S3 client, TransferConfig and per-object fetch function for `workers`
+    concurrent downloads. fetch_one(s3_client, bucket_name, key, temp_dir, transfer_config)
+    returns (local_path, bytes_downloaded, seconds).
+    """
+    part_size = (part_size_mb or config.DOWNLOAD_PART_SIZE_MB) * MB
+    part_concurrency = part_concurrency or config.DOWNLOAD_PART_CONCURRENCY
+    fetch_one = _stream_one if (mode or config.DOWNLOAD_MODE) == "stream" else _download_one
+
+    s3_client = _get_s3_client(max_pool_connections=workers * part_concurrency)
+    transfer_config = TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=part_concurrency,
+        use_threads=part_concurrency > 1,
     )
+    return s3_client, transfer_config, fetch_one
+
+def downloadAndDecompressFiles(files, workers=None, part_size_mb=None, part_concurrency=None, bucket_name=BUCKET_NAME,
+                               mode=None, ledger=None):
+    """
+    Download and decompress files in a temp directory inside the current folder.
+
+    Objects are downloaded by a bounded pool of `workers` threads sharing one S3 client; each object
+    is split into `part_size_mb` ranged parts fetched with up to `part_concurrency` threads. `files`
+    may be a lazy iterable (e.g. iterFilesInBucket), downloads start as soon as keys arrive.
+    In "stream" mode (DOWNLOAD_MODE) .zst objects are decompressed on the fly instead of being
+    written to disk first. With a RunLedger each object is recorded as listed, then downloaded or failed.
+    Returns the local paths of the downloaded files.
+    """
+    workers = workers or config.DOWNLOAD_WORKERS
+    s3_client, transfer_config, fetch_one = prepare_transfer(workers, part_size_mb, part_concurrency, mode)
 
     # Create a "temp" directory inside the current working directory
     temp_dir = os.path.join(os.getcwd(), "temp")
     os.makedirs(temp_dir, exist_ok=True)
     logger.info(f"Using temporary directory: {temp_dir}")
 
-    for file_name, _ in files:
-        temp_file_path = os.path.join(temp_dir, os.path.basename(file_name))
+    downloaded_paths = []
+    total_bytes = 0
+    start = time.perf_counter()
 
+    def collect(future, file_name):
+        nonlocal total_bytes
         try:
-            # Download the file
-            s3_client.download_file(BUCKET_NAME, file_name, temp_file_path)
-            logger.info(f"Downloaded: {file_name} to {temp_file_path}")
-
-            # Decompress if the file is .zst
-            if temp_file_path.endswith('.zst'):
-                decompressed_file_path = temp_file_path[:-4]  # Remove .zst extension
-                try:
-                    with open(temp_file_path, 'rb') as compressed_file, open(decompressed_file_path, 'wb') as output_file:
-                        dctx = zstd.ZstdDecompressor()
-                        with dctx.stream_reader(compressed_file) as reader:
-                            while True:
-                                chunk = reader.read(65536)  # 64KB chunks
-                                if not chunk:
-                                    break
-                                output_file.write(chunk)
-
-                    logger.info(f"Decompressed: {temp_file_path} to {decompressed_file_path}")
+            local_path, size_bytes, seconds = future.result()
+            total_bytes += size_bytes
+            if local_path:
+                downloaded_paths.append(local_path)
+                if ledger is not None:
+                    ledger.record(object_name(file_name), "downloaded", downloaded_bytes=size_bytes,
+                                  download_seconds=seconds)
+            elif ledger is not None:
+                ledger.failed(object_name(file_name), "download", "decompression failed")
+        except Exception as e:
+            logger.error(f"Failed to download {file_name}: {e}")
+            if ledger is not None:
+                ledger.failed(object_name(file_name), "download", e)
 
-                    # Replace the compressed file with the decompressed one
-                    os.remove(temp_file_path)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3-download") as executor:
+        in_flight = {}
+        for file_name, size_kb, etag in files:
+            if ledger is not None:
+                ledger.record(object_name(file_name), "listed", s3_key=file_name, size_bytes=round(size_kb * 1024),
+                              etag=etag)
+            # Keep at most 2 * workers submitted so a lazy listing is not drained into memory up front
+            while len(in_flight) >= 2 * workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, in_flight.pop(future))
+            future = executor.submit(fetch_one, s3_client, bucket_name, file_name, temp_dir, transfer_config)
+            in_flight[future] = file_name
 
-                    logger.info(f"Replaced compressed file with decompressed file: {decompressed_file_path}")
-                except Exception as e:
-                    logger.error(f"Error decompressing {file_name}: {e}")
+        for future in as_completed(in_flight):
+            collect(future, in_flight[future])
 
-        except Exception as e:
-            logger.error(f"Failed to download {file_name}: {e}")
\ No newline at end of file
+    elapsed = time.perf_counter() - start
+    logger.info(f"Downloaded {len(downloaded_paths)} files, {total_bytes / MB:.2f} MB in {elapsed:.2f}s "
+                f"({total_bytes / MB / max(elapsed, 1e-9):.2f} MB/s total)")
+    return downloaded_paths
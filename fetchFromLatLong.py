@@ -2,14 +2,19 @@ import os
 import pandas as pd
 import json
 import asyncio
+import threading
+import weakref
+import concurrent.futures
 import aiohttp
 import redis.asyncio as redis
-from datetime import datetime, timezone
 from logger import get_logger
 from config import config
-import pyarrow.parquet as pq
 import pyarrow as pa
+import pyarrow.compute as pc
 from RedisUtils.redisProcessing import r
+from locationQuantization import location_quantizer, location_cache_stats
+from offlineGeocoder import get_offline_geocoder
+from geocoderClient import get_geocoder_client
 
 
 logger = get_logger("Filling Data from Redis and Api")
@@ -19,8 +24,6 @@ API=config.REVERSE_GEOCODER_API
 # PROGRESS_FILE = "progress.json"
 # ROW_GROUP_SIZE = 10_000  # Process in row groups of 10,000
 
-SEMAPHORE_LIMIT = 5
-semaphore = asyncio.Semaphore(SEMAPHORE_LIMIT)
 
 # async def get_redis_connection():
 #     return await redis.from_url(f"redis://{REDIS_HOST}:{REDIS_PORT}", decode_responses=True)
@@ -43,116 +46,315 @@ def is_valid_lat_lon(lat, lon):
     lat, lon = float(lat), float(lon) 
     return (-90 <= lat <= 90) and (-180 <= lon <= 180)
 
+LOCATION_TTL_SECONDS = 2592000  # 30 days
+
+# Background SET pipelines still writing location entries, by event loop, awaited by flush_location_writes().
+# Each enrichment worker thread runs its own loop and only touches its own set.
+_pending_writes = weakref.WeakKeyDictionary()
+
+# Geocoder requests in flight, by cache key, shared by every row group (and event loop) asking for the same cell
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+async def _mget(redis_conn, keys):
+    """MGET on either the async client (non-blocking) or the blocking one."""
+    if isinstance(redis_conn, redis.Redis):
+        return await redis_conn.mget(keys) or []
+    return redis_conn.mget(keys) or []
+
+def _store_locations(redis_conn, entries):
+    """
+    SET the (key, value, ttl) entries in one pipeline. With the async client the pipeline runs in the
+    background so the next row group's lookups and geocoder calls overlap with it;
+    flush_location_writes() waits for it.
+    """
+    if not entries:
+        return
+    redis_pipeline = redis_conn.pipeline()
+    for key, value, ttl in entries:
+        redis_pipeline.set(key, json.dumps(value), ex=ttl)
+    if not isinstance(redis_conn, redis.Redis):
+        redis_pipeline.execute()
+        return
+
+    async def write():
+        async with redis_pipeline as pipe:
+            await pipe.execute()
+
+    loop = asyncio.get_running_loop()
+    task = loop.create_task(write())
+    _pending_writes.setdefault(loop, set()).add(task)
+    task.add_done_callback(_write_done)
+
+def _write_done(task):
+    _pending_writes.get(task.get_loop(), set()).discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Error storing location data in Redis: {task.exception()}")
+
+async def flush_location_writes():
+    """Wait for the background location writes started on the running loop."""
+    pending = list(_pending_writes.get(asyncio.get_running_loop(), ()))
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+async def _geocode_cells(keys, cell_requests):
+    """
+    Geocode cells, coalescing with requests already in flight: a cell another row group is
+    fetching is awaited instead of requested again. Returns ({key: response or None}, number of
+    cells this call requested).
+    """
+    owned, shared = {}, {}
+    with _in_flight_lock:
+        for key in keys:
+            if key in _in_flight:
+                shared[key] = _in_flight[key]
+            else:
+                owned[key] = _in_flight[key] = concurrent.futures.Future()
+
+    try:
+        client = get_geocoder_client()
+        responses = await asyncio.gather(*[fetch_location_data(client, *cell_requests[key]) for key in owned])
+        for key, response in zip(owned, responses):
+            owned[key].set_result(response)
+    except BaseException as e:
+        for future in owned.values():
+            if not future.done():
+                future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            for key in owned:
+                _in_flight.pop(key, None)
+
+    results = {key: future.result() for key, future in owned.items()}
+    shared_responses = await asyncio.gather(*[asyncio.wrap_future(future) for future in shared.values()])
+    results.update(zip(shared, shared_responses))
+    return results, len(owned)
+
 async def bulk_fetch_location_data(redis_conn, lat_lon_pairs):
-    """Fetch location data from Redis and API (if missing)."""
-    redis_keys = [f"location:{lat}:{lon}" for lat, lon in lat_lon_pairs]
+    """
+    Fetch location data from Redis and API (if missing).
+
+    Coordinates are mapped to cells by the configured LocationQuantizer; each distinct cell is
+    looked up once and geocoded once, and the result is returned for every (lat, lon) pair.
+    Cells the geocoder could not resolve are cached as negative entries for
+    LOCATION_NEGATIVE_TTL_SECONDS, and a cell already being fetched for another row group is
+    awaited rather than requested twice.
+    With LOCAL_GEOCODER_PATH set, cells are first resolved in-process by the offline geocoder and
+    only the ones it cannot place within LOCAL_GEOCODER_MAX_KM go to Redis and the API.
+    redis_conn may be the blocking client or the async one from get_async_redis().
+    """
+    cells = {pair: location_quantizer.cell(*pair) for pair in dict.fromkeys(lat_lon_pairs)}
+    cell_requests = {key: (lat, lon) for key, lat, lon in cells.values()}
 
     logger.info("Here in Bulk Fetch Location")
-    if not redis_keys:  # Ensure there are keys to fetch
+    if not cell_requests:  # Ensure there are keys to fetch
         return {}
 
-    # cached_data = await redis_conn.mget(redis_keys)
-    cached_data = redis_conn.mget(redis_keys) or []
+    cell_data = {}
+    offline_geocoder = get_offline_geocoder()
+    if offline_geocoder:
+        keys = list(cell_requests)
+        lats, lons = zip(*(cell_requests[key] for key in keys))
+        for key, resolved in zip(keys, offline_geocoder.resolve(lats, lons)):
+            if resolved:
+                cell_data[key] = resolved
+    offline_count = len(cell_data)
+    redis_keys = [key for key in cell_requests if key not in cell_data]
+
+    cached_data = await _mget(redis_conn, redis_keys) if redis_keys else []
 
-    result = {}
-    missing_coords = []
     missing_keys = []
+    negative_hits = 0
 
-    for i, data in enumerate(cached_data):
-        if data:
-            result[lat_lon_pairs[i]] = json.loads(data)
+    for key, data in zip(redis_keys, cached_data):
+        if not data:
+            missing_keys.append(key)
+            continue
+        entry = json.loads(data)
+        if entry.get("_negative"):
+            negative_hits += 1  # Known to have no result; not asked again until the entry expires
         else:
-            missing_coords.append(lat_lon_pairs[i])
-            missing_keys.append(redis_keys[i])
+            cell_data[key] = entry
 
-    if missing_coords:
-        async with aiohttp.ClientSession() as session:
-            tasks = [fetch_location_data(session, lat, lon) for lat, lon in missing_coords]
-            responses = await asyncio.gather(*tasks)
+    api_calls = 0
+    if missing_keys:
+        responses, api_calls = await _geocode_cells(missing_keys, cell_requests)
 
-        # Store only valid API responses in Redis
-        redis_pipeline = redis_conn.pipeline()
-        for key, coord, response in zip(missing_keys, missing_coords, responses):
+        # Store API responses in Redis with the precision they were resolved at; failures as short-lived negatives
+        precision = location_quantizer.precision
+        entries = []
+        for key, response in responses.items():
             if response:
-                redis_pipeline.set(key, json.dumps(response), ex=2592000)  # Expire in 30 days
-                result[coord] = response
-        redis_pipeline.execute()
+                cell_data[key] = {**response, "_precision": precision}
+                entries.append((key, cell_data[key], LOCATION_TTL_SECONDS))
+            else:
+                entries.append((key, {"_negative": True, "_precision": precision},
+                                config.LOCATION_NEGATIVE_TTL_SECONDS))
+        _store_locations(redis_conn, entries)
+
+    location_cache_stats.record(len(cells), len(cell_requests), len(redis_keys) - len(missing_keys), api_calls,
+                                offline_count, negative_hits, len(missing_keys) - api_calls)
+    location_cache_stats.log_stats()
 
-    return result
+    return {pair: cell_data[key] for pair, (key, _, _) in cells.items() if key in cell_data}
 
-async def fetch_location_data(session, lat, lon):
-    """Fetch location data from an external API with a concurrency limit."""
-    url = f"{API}/reverse?lat={lat}&lon={lon}"
+async def fetch_location_data(client, lat, lon):
+    """Fetch location data from the external API through the shared GeocoderClient (retries and concurrency included)."""
     logger.info("Here in Fetch Location")
-    
-    async with semaphore:  # Limit concurrent tasks
+    return await client.reverse(lat, lon)
+
+
+# Output columns of the transform: (input column, type); None marks columns filled from the location lookup
+TRANSFORMED_COLUMNS = {
+    "refId": ("refId", pa.string()),
+    "reqTime": ("date", pa.int64()),
+    "reqTimeConverted": (None, pa.string()),
+    "deviceIfa": ("device_ifa", pa.string()),
+    "os": ("os", pa.string()),
+    "osv": ("os_version", pa.string()),
+    "normalized_osv": ("normalized_os_version", pa.string()),
+    "ipAddress": ("ip", pa.string()),
+    "carrier": ("carrier", pa.string()),
+    "connectionType": ("connection_type", pa.int64()),
+    "device_vendor": ("device_vendor", pa.string()),
+    "device_model": ("device_model", pa.string()),
+    "device_height": ("device_height", pa.string()),
+    "device_width": ("device_width", pa.string()),
+    "deviceType": ("device_type", pa.string()),
+    "location_type": ("location_type", pa.int64()),
+    "latitude": ("latitude", pa.string()),
+    "longitude": ("longitude", pa.string()),
+    "appBundle": ("app_bundle", pa.string()),
+    "city": (None, pa.string()),
+    "region": (None, pa.string()),
+    "state": (None, pa.string()),
+    "device_country_name": (None, pa.string()),
+    "device_country_code": (None, pa.string()),
+    "zip": (None, pa.string()),
+    "ua": ("ua", pa.string()),
+    "ssp": ("ssp_endpoint_name", pa.string()),
+    "dpidsha1": ("dpidsha1", pa.string()),
+    "dpidmd5": ("dpidmd5", pa.string()),
+}
+TRANSFORMED_SCHEMA = pa.schema([(name, type_) for name, (_, type_) in TRANSFORMED_COLUMNS.items()])
+
+# Location columns: (geocoder property, input column used when the property is missing; None means "")
+LOCATION_COLUMNS = {
+    "city": ("city", "city"),
+    "region": ("district", None),
+    "state": ("state", "region"),
+    "device_country_name": ("country", "device_country_name"),
+    "device_country_code": ("countrycode", "device_country_code"),
+    "zip": ("postcode", "zip"),
+}
+
+COORDINATE_SEPARATOR = "\x1f"
+COORDINATE_COLUMNS = ("latitude", "longitude")
+
+# Input columns the transform reads (output sources, location fallbacks and coordinates)
+TRANSFORM_INPUT_COLUMNS = tuple(dict.fromkeys(
+    [source for source, _ in TRANSFORMED_COLUMNS.values() if source]
+    + [fallback for _, fallback in LOCATION_COLUMNS.values() if fallback] + list(COORDINATE_COLUMNS)))
+
+
+def _input_column(chunk, name, num_rows, default=""):
+    """Column `name` of a DataFrame as an Arrow array; a missing column reads as `default` like row.get(name, default)."""
+    if name not in chunk.columns:
+        return pa.array([default] * num_rows, pa.string())
+    try:
+        return pa.array(chunk[name], from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed Python types: keep the values as text
+        return pa.array([str(value) if pd.notna(value) else None for value in chunk[name]], pa.string())
+
+def _as_string(array):
+    return array if array.type == pa.string() else pc.cast(array, pa.string())
+
+def _to_int64(array):
+    """int() of each value; null where it is missing or not an integer."""
+    if pa.types.is_integer(array.type):
+        return array.cast(pa.int64())
+    if pa.types.is_floating(array.type):
+        return pc.cast(pc.trunc(array), pa.int64(), safe=False)
+    text = pc.utf8_trim_whitespace(_as_string(array))
+    return pc.cast(pc.if_else(pc.match_substring_regex(text, r"^[+-]?\d+$"), text, pa.scalar(None, pa.string())),
+                   pa.int64())
+
+def _as_code(array):
+    """
+    Integer code columns: null where the row-wise transform leaves None, i.e. where the input is
+    falsy (missing, "" or a numeric 0). The string "0" is truthy there, so it stays 0.
+    """
+    values = _to_int64(array)
+    if pa.types.is_integer(array.type) or pa.types.is_floating(array.type):
+        return pc.if_else(pc.fill_null(pc.equal(array, 0), False), pa.scalar(None, pa.int64()), values)
+    return values
+
+def _timestamp_strings(date):
+    """'%Y-%m-%d %H:%M:%S' UTC of epoch-millisecond dates; "" for missing or 0, like the row-wise transform."""
+    millis = _to_int64(date)
+    seconds = pc.cast(pc.floor(pc.divide(pc.cast(millis, pa.float64()), 1000.0)), pa.int64(), safe=False)
+    formatted = pc.strftime(pc.cast(seconds, pa.timestamp("s", tz="UTC")), format="%Y-%m-%d %H:%M:%S")
+    return pc.fill_null(pc.if_else(pc.equal(millis, 0), "", formatted), "")
+
+def _coordinate_index(latitude, longitude):
+    """
+    Index every row into the distinct (latitude, longitude) pairs of the chunk.
+    Returns (indices, pairs) where pairs[i] is the pair for index i, or None if it is not a valid coordinate.
+    """
+    keys = pc.binary_join_element_wise(_as_string(latitude), _as_string(longitude), COORDINATE_SEPARATOR)
+    encoded = keys.dictionary_encode()
+    pairs = []
+    for key in encoded.dictionary.to_pylist():
+        lat, lon = key.split(COORDINATE_SEPARATOR)
         try:
-            async with session.get(url, timeout=10) as response:
-                if response.status == 200:
-                    json_data = await response.json()
-                    features = json_data.get("features", [])
-                    if features:
-                        return features[0].get("properties", {})
-                logger.error(f"No API response for ({lat}, {lon})")
-        except asyncio.TimeoutError:
-            logger.error(f"Timeout error fetching ({lat}, {lon})")
-        except Exception as e:
-            logger.error(f"Error fetching location for ({lat}, {lon}): {e}")
-    return None
-
-
-def save_transformed_row_group(transformed_data, output_file_path):
-    table = pa.Table.from_pandas(pd.DataFrame(transformed_data))
-    pq.write_table(table, output_file_path) # Overwrites the file each time a row group is written. More efficient than appending.
-
-async def transform_row_group(row_group, redis_conn):
-    expected_columns = ["refId", "reqTime", "reqTimeConverted", "deviceIfa", "os", "osv", "normalized_osv", "ipAddress", 
-        "carrier", "connectionType", "device_vendor", "device_model", "device_height", "device_width", 
-        "deviceType", "location_type", "latitude", "longitude", "appBundle", "city", "region", "state", 
-        "device_country_name", "device_country_code", "zip", "ua", "ssp", "dpidsha1", "dpidmd5" ]
-
-    #  creates a list of valid (latitude, longitude) pairs from row_group, filtering out entries where latitude or longitude is NaN or invalid (out of range)
-    lat_lon_pairs = [(row["latitude"], row["longitude"]) for row in row_group
-                     if pd.notna(row.get("latitude")) and pd.notna(row.get("longitude"))
-                     and is_valid_lat_lon(row["latitude"], row["longitude"])]
-
-    location_data = await bulk_fetch_location_data(redis_conn, lat_lon_pairs)
-    logger.info("Here after Bulk Fetch Location")
-    transformed_data = []
-    for row in row_group:  # Iterate through the row group (list of dictionaries)
-        loc_data = location_data.get((row.get("latitude"), row.get("longitude")), {})
-        transformed = {  
-            "refId": row.get("refId", ""),
-            "reqTime": row.get("date", ""),
-            # "reqTimeConverted": datetime.fromtimestamp(row.get("date", 0) / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if row.get("date") else "",
-           "reqTimeConverted": datetime.fromtimestamp(float(row.get("date", 0)) / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if row.get("date") else "",
-            "deviceIfa": row.get("device_ifa", ""),
-            "os": row.get("os", ""),
-            "osv": row.get("os_version", ""),
-            "normalized_osv": row.get("normalized_os_version", ""),
-            "ipAddress": row.get("ip", ""),
-            "carrier": row.get("carrier", ""),
-            "connectionType": int(row.get("connection_type", 0)) if row.get("connection_type") else None,
-            "device_vendor": row.get("device_vendor", ""),
-            "device_model": row.get("device_model", ""),
-            "device_height": row.get("device_height", ""),
-            "device_width": row.get("device_width", ""),
-            "deviceType": row.get("device_type", ""),
-            "location_type": int(row.get("location_type", 0)) if row.get("location_type") else None,
-            "latitude": row.get("latitude", None),
-            "longitude": row.get("longitude", None),
-            "appBundle": row.get("app_bundle", ""),
-            "city": loc_data.get("city", row.get("city", "")),
-            "region": loc_data.get("district", ""),
-            "state": loc_data.get("state", row.get("region", "")),
-            "device_country_name": loc_data.get("country", row.get("device_country_name", "")),
-            "device_country_code": loc_data.get("countrycode", row.get("device_country_code", "")),
-            "zip": loc_data.get("postcode", row.get("zip", "")),
-            "ua": row.get("ua", ""),
-            "ssp": row.get("ssp_endpoint_name", ""),
-            "dpidsha1": row.get("dpidsha1", ""),
-            "dpidmd5": row.get("dpidmd5", ""),
-         }
-        transformed_data.append({key: transformed.get(key, "") for key in expected_columns})
-    logger.info("Here after Transformation")
-    return transformed_data
+            pairs.append((lat, lon) if is_valid_lat_lon(lat, lon) else None)
+        except ValueError:
+            pairs.append(None)
+    return encoded.indices, pairs
+
+def transform_columns(chunk, indices, pairs, location_data):
+    """
+    Build the output table of a corrected chunk column by column: renames and casts in bulk,
+    a vectorized timestamp conversion, and the location properties taken per distinct coordinate
+    (`pairs`, addressed by `indices`) instead of per row. Returns a table with TRANSFORMED_SCHEMA.
+    """
+    num_rows = len(chunk)
+    inputs = {}
+    for source, _ in TRANSFORMED_COLUMNS.values():
+        if source and source not in inputs:
+            inputs[source] = _input_column(chunk, source, num_rows, None if source in COORDINATE_COLUMNS else "")
+    for _, fallback in LOCATION_COLUMNS.values():
+        if fallback and fallback not in inputs:
+            inputs[fallback] = _input_column(chunk, fallback, num_rows)
+
+    locations = [location_data.get(pair, {}) if pair else {} for pair in pairs]
+
+    columns = []
+    for name, (source, type_) in TRANSFORMED_COLUMNS.items():
+        if name == "reqTimeConverted":
+            column = _timestamp_strings(inputs["date"])
+        elif name in LOCATION_COLUMNS:
+            prop, fallback = LOCATION_COLUMNS[name]
+            found = pa.array([prop in location for location in locations], pa.bool_())
+            values = pa.array([None if location.get(prop) is None else str(location[prop]) for location in locations],
+                              pa.string())
+            default = _as_string(inputs[fallback]) if fallback else pa.array([""] * num_rows, pa.string())
+            column = pc.if_else(pc.fill_null(pc.take(found, indices), False), pc.take(values, indices), default)
+        elif source == "date":
+            column = _to_int64(inputs[source])
+        elif type_ == pa.int64():
+            column = _as_code(inputs[source])
+        else:
+            column = _as_string(inputs[source])
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=TRANSFORMED_SCHEMA)
+
+async def transform_chunk(chunk, redis_conn):
+    """Columnar transform: corrected DataFrame in, pyarrow Table with TRANSFORMED_SCHEMA out."""
+    num_rows = len(chunk)
+    indices, pairs = _coordinate_index(_input_column(chunk, "latitude", num_rows),
+                                       _input_column(chunk, "longitude", num_rows))
+    location_data = await bulk_fetch_location_data(redis_conn, [pair for pair in pairs if pair])
+    return transform_columns(chunk, indices, pairs, location_data)
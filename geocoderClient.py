@@ -0,0 +1,242 @@
+import time
+import random
+import asyncio
+import weakref
+import threading
+from collections import deque
+import aiohttp
+from config import config
+from logger import get_logger
+
+logger = get_logger("GeocoderClient")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for an async client. Each fast success adds 1/limit (about +1 per
+    round of requests); a throttled or failed request, or one slower than `latency_target`, halves
+    the limit, at most once per typical response time (a moving average of latencies) so one
+    burst of errors counts once. The limit stays between `floor` and `ceiling`.
+
+    One limiter can be shared by clients on several event loops (the enrichment workers), so the
+    limit applies to all their requests together: its state is guarded by a lock and waiters on
+    other loops are woken with call_soon_threadsafe.
+    """
+
+    def __init__(self, floor, ceiling, initial, latency_target):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.limit = float(min(max(initial, floor), ceiling))
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._latency = latency_target / 10
+        self._waiters = deque()  # (loop, future)
+        self._lock = threading.Lock()
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return self
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+        try:
+            await waiter  # the slot is taken for us by _wake()
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def _grant(self, waiter):
+        """Runs on the waiter's loop: hand it the slot taken in _wake(), or give the slot back if it gave up."""
+        if waiter.done():
+            self._release()
+        else:
+            waiter.set_result(None)
+
+    def _wake(self):
+        """Hand free slots to waiters in FIFO order (called with the lock held)."""
+        while self._waiters and self.in_flight < int(self.limit):
+            loop, waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            try:
+                loop.call_soon_threadsafe(self._grant, waiter)
+            except RuntimeError:  # the waiter's loop is closed
+                continue
+            self.in_flight += 1
+
+    def on_success(self, latency):
+        with self._lock:
+            self._latency = 0.9 * self._latency + 0.1 * latency
+            if latency > self.latency_target:
+                self._decrease()
+            else:
+                self.limit = min(self.ceiling, self.limit + 1 / self.limit)
+                self._wake()
+
+    def on_overload(self):
+        with self._lock:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= min(self._latency, self.latency_target):
+            self.limit = max(self.floor, self.limit / 2)
+            self._last_decrease = now
+
+
+def _first_properties(body):
+    """
+    Properties of the first feature of a reverse geocoder response body, or None when it has no
+    features. Raises ValueError when the body is not a feature collection.
+    """
+    features = body.get("features", []) if isinstance(body, dict) else None
+    if not isinstance(features, list):
+        raise ValueError(f"expected a feature collection, got {type(body).__name__}")
+    if not features:
+        return None
+    properties = features[0].get("properties", {}) if isinstance(features[0], dict) else None
+    if not isinstance(properties, dict):
+        raise ValueError("first feature has no properties object")
+    return properties
+
+
+class GeocoderClient:
+    """
+    Long-lived reverse geocoder client for one event loop: a keep-alive TCPConnector sized to the
+    concurrency ceiling, transient errors (timeouts, connection errors, 429 and 5xx) retried with
+    full-jitter exponential backoff, and concurrency driven by an AdaptiveLimiter (`limiter`, which
+    get_geocoder_client() shares between the clients of all loops).
+    reverse() returns the first feature's properties, or None. A 200 response whose body is not
+    a feature collection counts as a failed lookup: it is neither retried nor treated as overload.
+    """
+
+    def __init__(self, base_url, min_concurrency=None, max_concurrency=None, initial_concurrency=None,
+                 timeout=None, max_retries=None, backoff_base=None, backoff_max=None, latency_target=None,
+                 limiter=None):
+        self.base_url = base_url
+        self.max_retries = config.GEOCODER_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = backoff_base or config.GEOCODER_BACKOFF_BASE_SECONDS
+        self.backoff_max = backoff_max or config.GEOCODER_BACKOFF_MAX_SECONDS
+        self.timeout = aiohttp.ClientTimeout(total=timeout or config.GEOCODER_TIMEOUT_SECONDS)
+        self.limiter = limiter or AdaptiveLimiter(min_concurrency or config.GEOCODER_MIN_CONCURRENCY,
+                                       max_concurrency or config.GEOCODER_MAX_CONCURRENCY,
+                                       initial_concurrency or config.GEOCODER_INITIAL_CONCURRENCY,
+                                       (latency_target or config.GEOCODER_LATENCY_TARGET_MS) / 1000)
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limiter.ceiling, limit_per_host=self.limiter.ceiling,
+                                             keepalive_timeout=30, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def reverse(self, lat, lon):
+        url = f"{self.base_url}/reverse?lat={lat}&lon={lon}"
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            async with self.limiter:
+                self.requests += 1
+                start = time.monotonic()
+                try:
+                    async with self.session.get(url) as response:
+                        if response.status == 200:
+                            try:
+                                properties = _first_properties(await response.json())
+                            except (ValueError, aiohttp.ContentTypeError) as e:
+                                # The server answered, so this says nothing about overload
+                                self.limiter.on_success(time.monotonic() - start)
+                                self.failures += 1
+                                logger.error(f"Malformed geocoder response for ({lat}, {lon}): {e}")
+                                return None
+                            self.limiter.on_success(time.monotonic() - start)
+                            if properties is None:
+                                logger.error(f"No API response for ({lat}, {lon})")
+                            return properties
+                        if response.status not in RETRY_STATUSES:
+                            self.limiter.on_success(time.monotonic() - start)
+                            logger.error(f"Geocoder returned {response.status} for ({lat}, {lon})")
+                            return None
+                        self.limiter.on_overload()
+                        retry_after = response.headers.get("Retry-After")
+                        error = f"HTTP {response.status}"
+                except asyncio.TimeoutError:
+                    self.limiter.on_overload()
+                    error = "timeout"
+                except aiohttp.ClientError as e:
+                    self.limiter.on_overload()
+                    error = str(e) or type(e).__name__
+
+            if attempt < self.max_retries:
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        self.failures += 1
+        logger.error(f"Error fetching location for ({lat}, {lon}) after {self.max_retries + 1} attempts: {error}")
+        return None
+
+    def stats(self):
+        return {"requests": self.requests, "retries": self.retries, "failures": self.failures,
+                "concurrency": int(self.limiter.limit)}
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+# One client per event loop, like the async Redis clients, all sharing one concurrency limit
+_clients = weakref.WeakKeyDictionary()
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+def get_shared_limiter():
+    """The AdaptiveLimiter every loop's geocoder client uses, so GEOCODER_*_CONCURRENCY bound the whole process."""
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = AdaptiveLimiter(config.GEOCODER_MIN_CONCURRENCY, config.GEOCODER_MAX_CONCURRENCY,
+                                              config.GEOCODER_INITIAL_CONCURRENCY,
+                                              config.GEOCODER_LATENCY_TARGET_MS / 1000)
+        return _shared_limiter
+
+def get_geocoder_client():
+    """GeocoderClient for REVERSE_GEOCODER_API on the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = GeocoderClient(config.REVERSE_GEOCODER_API, limiter=get_shared_limiter())
+    return client
+
+async def close_geocoder_client():
+    """Close the running loop's geocoder client, if it has one (call before closing the loop)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        logger.info(f"Geocoder client: {client.stats()}")
+        await client.close()
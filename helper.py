@@ -1,39 +1,48 @@
 import json
 import os
+import shutil
 from logger import get_logger
 
 logger=get_logger("Helpers")
 
-PROGRESS_FILE = "progress.json"
-
-def save_progress(file_path, row_count):
-    """Save processing progress to a JSON file."""
-    progress_data = {"file": file_path, "row_count": row_count}
-    with open(PROGRESS_FILE, "w") as f:
-        json.dump(progress_data, f)
-
-def load_progress():
-    """Load the last saved progress."""
-    if os.path.exists(PROGRESS_FILE):
-        with open(PROGRESS_FILE, "r") as f:
+CHECKPOINT_DIR = ".checkpoints"  # inside processed_dir; hidden, so dataset readers skip it
+
+def _checkpoint_path(processed_dir, file_name):
+    return os.path.join(processed_dir, CHECKPOINT_DIR, f"{file_name}.json")
+
+def segment_path(processed_dir, file_name, first_row_group):
+    """Staged output of the segment of `file_name` that starts at input row group `first_row_group`."""
+    return os.path.join(processed_dir, CHECKPOINT_DIR, f"{file_name}.segments", f"part-{first_row_group:05d}.parquet")
+
+def save_progress(processed_dir, file_name, checkpoint):
+    """Atomically replace the checkpoint of one input file (temp file, fsync, rename)."""
+    path = _checkpoint_path(processed_dir, file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def load_progress(processed_dir, file_name):
+    """The saved checkpoint of one input file, or None."""
+    path = _checkpoint_path(processed_dir, file_name)
+    if os.path.exists(path):
+        with open(path, "r") as f:
             return json.load(f)
     return None
 
-def update_status_file(status_file, status_dict):
-    """Update the status file by appending the new file processing results."""
-    # Check if status_file already exists
-    if os.path.exists(status_file):
-        with open(status_file, 'r') as f:
-            # Load existing status data
-            existing_data = json.load(f)
-    else:
-        existing_data = {}
-
-    # Append new status data
-    existing_data.update(status_dict)
-
-    # Save the updated status back to the file
-    with open(status_file, 'w') as f:
-        json.dump(existing_data, f, indent=4)
-
-    logger.info(f"Status of processed files has been updated in {status_file}.")    
\ No newline at end of file
+def clear_progress(processed_dir, file_name):
+    """Forget the checkpoint of an input file and delete its staged segments."""
+    path = _checkpoint_path(processed_dir, file_name)
+    if os.path.exists(path):
+        os.remove(path)
+    shutil.rmtree(os.path.dirname(segment_path(processed_dir, file_name, 0)), ignore_errors=True)
+
+def pending_progress(processed_dir):
+    """Input files that still have a checkpoint, i.e. were started but not finished."""
+    checkpoint_dir = os.path.join(processed_dir, CHECKPOINT_DIR)
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    return [name[:-len(".json")] for name in os.listdir(checkpoint_dir) if name.endswith(".json")]
@@ -1,106 +1,137 @@
 import os
+import time
 import pandas as pd
 import pyarrow.parquet as pq
 import gc
 from logger import get_logger
-from helper import save_progress,load_progress,update_status_file
-from correctTheData import correct_data_with_mapping
-from fetchFromLatLong import transform_row_group
-from RedisUtils.redisProcessing import load_or_create_vendors, get_model_mapping, r
+from helper import save_progress,load_progress,clear_progress,segment_path
+from correctTheData import correct_data_with_mapping, CORRECTION_COLUMNS
+from fetchFromLatLong import transform_chunk, flush_location_writes, TRANSFORMED_SCHEMA, TRANSFORM_INPUT_COLUMNS
+from parquetIO import RowGroupWriter, present_columns, row_group_bytes, scan_stats
+from processedDataset import publish_segments
+from RedisUtils.redisProcessing import model_catalog, r, get_async_redis, close_async_redis
+from config import config
+from geocoderClient import close_geocoder_client
+from vendorMatcher import get_vendor_matcher, ua_vendor_cache
 
 logger = get_logger("Integrated Processing")
+
+# Input columns enrichment reads; the rest of a cleaned file is never decoded
+ENRICH_COLUMNS = tuple(dict.fromkeys(CORRECTION_COLUMNS + TRANSFORM_INPUT_COLUMNS))
 # BASE_DIR = 'temp_dir'
 # PROCESSED_DIR = 'processed_dir'
 
-async def process_data_with_corrections(base_dir,processed_dir,status_file):
+async def process_file_with_corrections(file_path, processed_dir, ledger, predefined_vendors, model_mapping):
+    """
+    Correct device data and enrich location details for a single parquet file.
+
+    Row groups are enriched in segments of PROCESSED_CHECKPOINT_ROW_GROUPS input row groups (0: the whole
+    file), staged under processed_dir/.checkpoints. Each segment is written atomically and then recorded in
+    the file's checkpoint, so a restarted run skips the row groups of committed segments; a segment written
+    but not yet recorded is simply rewritten. Once every segment is in, they are published as the file's
+    output (one file named like the input, or its dataset files) and only then is the previous output of
+    the input removed, so a failed run leaves it intact.
+    The file ends up enriched or failed in the RunLedger `ledger`.
+    """
+    file = os.path.basename(file_path)
+    start = time.perf_counter()
+    redis_conn = get_async_redis() if config.ENRICH_REDIS_ASYNC else r  # Redis connection
+
+    logger.info(f"Processing file: {file_path}")
+    try:
+        with pq.ParquetFile(file_path) as parquet_file:
+            num_row_groups = parquet_file.num_row_groups
+            columns = present_columns(parquet_file, ENRICH_COLUMNS)
+            scan_stats.record("enrich", file_bytes=os.path.getsize(file_path))
+            identity = {"size": os.path.getsize(file_path), "num_row_groups": num_row_groups}
+            checkpoint = load_progress(processed_dir, file)
+            if (checkpoint and all(checkpoint.get(key) == value for key, value in identity.items())
+                    and all(os.path.exists(segment) for segment in checkpoint["segments"])):
+                logger.info(f"Resuming {file_path} after {checkpoint['row_groups_done']}/{num_row_groups} "
+                            f"committed row groups")
+            else:
+                clear_progress(processed_dir, file)  # stale segments only; published output stays until replaced
+                checkpoint = dict(identity, row_groups_done=0, segments=[], rows_written=0, row_groups_written=0)
+
+            segment_size = config.PROCESSED_CHECKPOINT_ROW_GROUPS or max(num_row_groups, 1)
+            for first in range(checkpoint["row_groups_done"], num_row_groups, segment_size):
+                last = min(first + segment_size, num_row_groups)
+                segment = segment_path(processed_dir, file, first)
+                os.makedirs(os.path.dirname(segment), exist_ok=True)
+                with RowGroupWriter(segment, TRANSFORMED_SCHEMA, config.PROCESSED_ROW_GROUP_SIZE,
+                                    compression=config.PROCESSED_COMPRESSION, atomic=True) as writer:
+                    for row_group_index in range(first, last):
+                        # Read row group (only the columns enrichment uses)
+                        table = parquet_file.read_row_group(row_group_index, columns=columns)
+                        scan_stats.record("enrich", row_groups=1,
+                                          bytes_read=row_group_bytes(parquet_file.metadata, row_group_index, columns))
+                        df_chunk = table.to_pandas()
+
+                        # Step 1: Correct device data
+                        corrected_chunk = correct_data_with_mapping(df_chunk, predefined_vendors, model_mapping,r)
+                        logger.info("Filled the chunk with make,model from Redis")
+
+                        # Step 2: Fetch and enrich location details (columnar, straight to an Arrow table)
+                        transformed_chunk = await transform_chunk(corrected_chunk, redis_conn)
+
+                        # Step 3: Stream the row group to the segment (staged until the segment is done)
+                        writer.write(transformed_chunk)
+
+                        del df_chunk, corrected_chunk, transformed_chunk, table
+                        gc.collect()
+
+                    await flush_location_writes()
+
+                # Step 4: Commit the segment by recording it in the file's checkpoint
+                checkpoint["row_groups_done"] = last
+                checkpoint["segments"].append(segment)
+                checkpoint["rows_written"] += writer.rows_written
+                checkpoint["row_groups_written"] += writer.row_groups_written
+                save_progress(processed_dir, file, checkpoint)
+                logger.info(f"Committed row groups {first}-{last - 1} of {file_path} ({last}/{num_row_groups})")
+
+        # Step 5: Publish the segments as the file's output, replacing what earlier runs wrote
+        publish_segments(processed_dir, file, checkpoint["segments"], TRANSFORMED_SCHEMA)
+        logger.info(f"Processed file saved at: {processed_dir} ({checkpoint['rows_written']} rows, "
+                    f"{checkpoint['row_groups_written']} row groups in {len(checkpoint['segments'])} segments)")
+        ua_vendor_cache.log_stats()
+        ledger.record(file, "enriched", enriched_rows=checkpoint["rows_written"],
+                      enrich_seconds=time.perf_counter() - start)
+        clear_progress(processed_dir, file)
+        os.remove(file_path)
+        logger.info(f"Deleted the file: {file_path}")
+        return True
+
+    except Exception as e:
+        ledger.failed(file, "enrich", e)
+        logger.error(f"Error processing file '{file_path}': {e}")
+        return False
+
+async def process_data_with_corrections(base_dir,processed_dir,ledger):
     """Process parquet files by first correcting device data and then enriching location details."""
     if not os.path.exists(base_dir):
         logger.error(f"Directory '{base_dir}' does not exist.")
         return
-    
+
     if not os.path.exists(processed_dir):
-        os.makedirs(processed_dir) 
-    
-    progress = load_progress()
-    last_processed_file = progress.get("file") if progress else None
-    last_processed_row = progress.get("row_count", 0) if progress else 0 # Row group count
+        os.makedirs(processed_dir)
 
     logger.info("Starting integrated processing of Parquet files.")
 
-    predefined_vendors = load_or_create_vendors()
-    model_mapping = get_model_mapping()
-    redis_conn = r  # Redis connection
-
-    status_dict = {}
+    predefined_vendors = get_vendor_matcher()
+    model_mapping = model_catalog  # models are looked up per row group, no full-hash download
 
     for file in os.listdir(base_dir):
         # if file.endswith('.parquet') and file.startswith("cleaned_"):
         if file.endswith('.parquet'):
             file_path = os.path.join(base_dir, file)
-            output_file_path = os.path.join(processed_dir, f"{file}")
-
-            logger.info(f"Processing file: {file_path}")
-            try:
-                with pq.ParquetFile(file_path) as parquet_file:
-                    # parquet_file = pq.ParquetFile(file_path)
-                    processed_row_group_count = last_processed_row if file_path == last_processed_file else 0
-                    for row_group_index in range(parquet_file.num_row_groups):
-                        # Read row group
-                        table = parquet_file.read_row_group(row_group_index)
-                        df_chunk = table.to_pandas()
+            await process_file_with_corrections(file_path, processed_dir, ledger, predefined_vendors, model_mapping)
 
-                        # Step 1: Correct device data
-                        corrected_chunk = correct_data_with_mapping(df_chunk, predefined_vendors, model_mapping,r)
-                        logger.info("Filled the chunk with make,model from Redis")
+    await close_async_redis()
+    await close_geocoder_client()
 
-                        # Step 2: Fetch and enrich location details
-                        transformed_chunk = await transform_row_group(corrected_chunk.to_dict('records'), redis_conn)
-
-                        if transformed_chunk:
-                            # save_transformed_row_group(transformed_data, output_file_path) # Save the row group
-                            processed_row_group_count += 1
-                            save_progress(file_path, processed_row_group_count)
-                            logger.info(f"Total row groups processed so far from {file_path}: {processed_row_group_count}")
-
-                        # Convert back to DataFrame
-                        transformed_df = pd.DataFrame(transformed_chunk)
-
-                    if os.path.exists(output_file_path):
-                        existing_table = pq.read_table(output_file_path)
-                        new_table = pq.Table.from_pandas(transformed_df)
-                        combined_table = pq.concat_tables([existing_table, new_table])
-
-                        # Write the combined table back to the Parquet file
-                        pq.write_table(combined_table, output_file_path, compression='snappy')
-                    else:
-                        # If the file doesn't exist, write as a new Parquet file
-                        transformed_df.to_parquet(output_file_path, engine='pyarrow', compression='snappy', index=False)
-
-                    # Write the final transformed data
-
-                    # transformed_df.to_parquet(
-                    #     output_file_path,
-                    #     engine='pyarrow',
-                    #     compression='snappy',
-                    #     index=False,
-                    #     append=True if os.path.exists(output_file_path) else False
-                    # )
-
-                    del df_chunk, corrected_chunk, transformed_chunk, transformed_df, table
-                    gc.collect()
-                
-                status_dict[file] = "success"
-                logger.info(f"Processed file saved at: {output_file_path}")
-                update_status_file(status_file, status_dict) 
-                os.remove(file_path)
-                logger.info(f"Deleted the file: {file_path}")
-            
-            except Exception as e:
-                status_dict[file] = "failed"
-                update_status_file(status_file, status_dict) 
-                logger.error(f"Error processing file '{file_path}': {e}")
-
-    # update_status_file(status_file, status_dict)
+    scan_stats.log_stats("enrich")
+    ledger.log_summary()
     logger.info("Processing completed for all files.")
 
 # Example usage:
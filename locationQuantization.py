@@ -0,0 +1,134 @@
+import threading
+from config import config
+from logger import get_logger
+
+logger = get_logger("LocationQuantization")
+
+QUANTIZATION_MODES = ("none", "decimal", "geohash")
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat, lon, length):
+    """Standard base32 geohash of a point."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < length:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+def geohash_center(geohash):
+    """Center (lat, lon) of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+class LocationQuantizer:
+    """
+    Maps coordinates to the cell used for both the Redis cache key and the geocoder request.
+
+    mode "none" keeps the raw location:{lat}:{lon} keys, "decimal" rounds to `decimals` places
+    (4 is ~11 m) and "geohash" buckets into geohash cells of `geohash_length` chars (7 is ~150 m)
+    and asks the geocoder for the cell center. Keys carry the precision, so entries resolved at
+    different precisions never mix.
+    """
+
+    def __init__(self, mode="none", decimals=4, geohash_length=7):
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown location quantization '{mode}', expected one of {QUANTIZATION_MODES}")
+        self.mode = mode
+        self.decimals = decimals
+        self.geohash_length = geohash_length
+
+    @property
+    def precision(self):
+        """Label of the precision entries are resolved at, stored with each cache entry."""
+        if self.mode == "decimal":
+            return f"decimal:{self.decimals}"
+        if self.mode == "geohash":
+            return f"geohash:{self.geohash_length}"
+        return "raw"
+
+    def cell(self, lat, lon):
+        """(cache key, request lat, request lon) for a coordinate pair."""
+        if self.mode == "decimal":
+            lat, lon = f"{float(lat):.{self.decimals}f}", f"{float(lon):.{self.decimals}f}"
+            return f"location:d{self.decimals}:{lat}:{lon}", lat, lon
+        if self.mode == "geohash":
+            geohash = geohash_encode(float(lat), float(lon), self.geohash_length)
+            center_lat, center_lon = geohash_center(geohash)
+            return f"location:gh:{geohash}", round(center_lat, 6), round(center_lon, 6)
+        return f"location:{lat}:{lon}", lat, lon
+
+
+class LocationCacheStats:
+    """
+    Running totals of the location lookups: coordinates asked for, cells resolved, cells answered
+    by the offline geocoder, Redis cache hits (over the remaining cells, negative entries included),
+    API calls made and cells that shared another row group's in-flight request.
+    """
+
+    def __init__(self):
+        self.coordinates = 0
+        self.cells = 0
+        self.offline = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.api_calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+
+    def record(self, coordinates, cells, hits, api_calls, offline=0, negative_hits=0, coalesced=0):
+        with self._lock:
+            self.coordinates += coordinates
+            self.cells += cells
+            self.offline += offline
+            self.hits += hits
+            self.negative_hits += negative_hits
+            self.api_calls += api_calls
+            self.coalesced += coalesced
+
+    def stats(self):
+        cached_cells = self.cells - self.offline
+        return {"coordinates": self.coordinates, "cells": self.cells, "offline": self.offline,
+                "hits": self.hits, "negative_hits": self.negative_hits, "api_calls": self.api_calls,
+                "coalesced": self.coalesced,
+                "hit_ratio": self.hits / cached_cells if cached_cells else 0.0,
+                # Calls a per-coordinate lookup without any cache would have made
+                "api_calls_saved": self.coordinates - self.api_calls}
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(f"Location cache: {stats['offline']}/{stats['cells']} cells resolved offline, "
+                    f"{stats['hits']}/{stats['cells'] - stats['offline']} cached ({stats['hit_ratio']:.1%} hit ratio, "
+                    f"{stats['negative_hits']} negative), {stats['coalesced']} coalesced with in-flight requests, "
+                    f"{stats['api_calls']} API calls for {stats['coordinates']} distinct coordinates "
+                    f"({stats['api_calls_saved']} saved)")
+
+
+location_quantizer = LocationQuantizer(config.LOCATION_QUANTIZATION, config.LOCATION_DECIMALS,
+                                       config.LOCATION_GEOHASH_LENGTH)
+location_cache_stats = LocationCacheStats()
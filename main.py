@@ -1,40 +1,80 @@
-from downloadingAndDecompressing import listFilesInBucket, downloadAndDecompressFiles
+from downloadingAndDecompressing import listFilesInBucket, downloadAndDecompressFiles, iterFilesInBucket
 from dataCleaning import clean_data
 from processingData import process_parquet_files
 from integratedProcessing import process_data_with_corrections
+from pipelineScheduler import run_pipeline
+from runLedger import RunLedger
+from processedDataset import compact_processed
+from helper import pending_progress
+from config import config
+import argparse
 import asyncio
 
 temp_dir = 'temp'
 processed_dir = 'processed_dir'
-status_file="status.json"
+ledger_path = config.RUN_LEDGER_PATH
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download, clean and enrich bid/nobid dumps.")
+    parser.add_argument("--date", default="2024-02-27", help="Date to process (YYYY-MM-DD)")
+    parser.add_argument("--bucket", default="test-es-backup", help="Source S3 bucket")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Overlap download, cleaning and enrichment instead of running them one after another")
+    parser.add_argument("--download-workers", type=int, default=None)
+    parser.add_argument("--clean-workers", type=int, default=None)
+    parser.add_argument("--enrich-workers", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes used to clean row groups in parallel (default: CLEANING_WORKERS); "
+                             "with --pipelined the clean workers share them")
+    parser.add_argument("--queue-size", type=int, default=None, help="Files allowed to wait between two stages")
+    parser.add_argument("--compact", action="store_true",
+                        help="Only merge the small files of the processed dataset, then exit. Compacted rows are "
+                             "not replaced when their input is reprocessed, so compact once the inputs are final")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    date_filter = "2024-02-27"
-    bucket_name = "test-es-backup"
+    args = parse_args()
+    if args.compact:
+        merged, written = compact_processed(processed_dir, exclude_inputs=pending_progress(processed_dir))
+        print(f"Compacted {merged} files into {written}.")
+        raise SystemExit(0)
+
+    date_filter = args.date
+    bucket_name = args.bucket
+    ledger = RunLedger(ledger_path)
+
+    try:
+        if args.pipelined:
+            run_pipeline(iterFilesInBucket(bucket_name, date_filter), bucket_name, temp_dir, processed_dir, ledger,
+                         download_workers=args.download_workers, clean_workers=args.clean_workers,
+                         enrich_workers=args.enrich_workers, queue_size=args.queue_size, clean_processes=args.workers)
+        else:
+            # Step 1: List and filter files in the bucket
+            filtered_files = listFilesInBucket(bucket_name, date_filter)
 
-    # Step 1: List and filter files in the bucket
-    filtered_files = listFilesInBucket(bucket_name, date_filter)
-    
-    if filtered_files:
-         # Step 2: Download and decompress files in temporary directory
-        downloadAndDecompressFiles(filtered_files)
+            if filtered_files:
+                 # Step 2: Download and decompress files in temporary directory
+                downloadAndDecompressFiles(filtered_files, ledger=ledger)
 
-        # Step 3: Clean the downloaded files in the same temporary directory
-        clean_data(temp_dir)
-        # clean_data("SampleData")
+                # Step 3: Clean the downloaded files in the same temporary directory
+                clean_data(temp_dir, workers=args.workers, ledger=ledger)
+                # clean_data("SampleData")
 
-        # Step 4: Make Json in Redis using the data 
-        # process_parquet_files()
+                # Step 4: Make Json in Redis using the data 
+                # process_parquet_files()
 
-        #Step 5:Fill in the empty values of make from redis and processed data from lat,long
-        asyncio.run(process_data_with_corrections(temp_dir,processed_dir,status_file))
+                #Step 5:Fill in the empty values of make from redis and processed data from lat,long
+                asyncio.run(process_data_with_corrections(temp_dir,processed_dir,ledger))
   
 
 
-    else:
-        print("No files found for the specified date.")
+            else:
+                print("No files found for the specified date.")
+    finally:
+        ledger.close()
 
 # clean_data("SampleData")
 
-# asyncio.run(process_data_with_corrections("SampleData","processed_dir","status.json"))
\ No newline at end of file
+# asyncio.run(process_data_with_corrections("SampleData","processed_dir",RunLedger("run_ledger.db")))
@@ -0,0 +1,122 @@
+import csv
+import threading
+import numpy as np
+import pandas as pd
+from config import config
+from logger import get_logger
+
+logger = get_logger("OfflineGeocoder")
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Headerless GeoNames postal code dump (allCountries.txt / <CC>.txt from download.geonames.org/export/zip)
+GEONAMES_POSTAL_COLUMNS = ["countrycode", "postcode", "city", "state", "state_code", "district", "district_code",
+                           "community", "community_code", "latitude", "longitude", "accuracy"]
+
+# Column names accepted in gazetteers with a header row, mapped to the geocoder API property names
+HEADER_ALIASES = {
+    "name": "city", "place_name": "city", "city": "city",
+    "admin_name1": "state", "state": "state", "region": "state",
+    "admin_name2": "district", "district": "district",
+    "country": "country", "country_name": "country",
+    "country_code": "countrycode", "countrycode": "countrycode",
+    "postal_code": "postcode", "postcode": "postcode", "zip": "postcode",
+    "latitude": "latitude", "lat": "latitude",
+    "longitude": "longitude", "lon": "longitude", "lng": "longitude",
+}
+
+PLACE_PROPERTIES = ["city", "district", "state", "country", "countrycode", "postcode"]
+
+
+def _unit_vectors(lats, lons):
+    """Points on the unit sphere, so euclidean nearest neighbours are great-circle nearest neighbours."""
+    lat, lon = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def _chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+def read_gazetteer(path):
+    """
+    Read a gazetteer into a frame with latitude, longitude and the PLACE_PROPERTIES it has.
+    Accepts the headerless GeoNames postal code TSV, or a CSV/TSV with a header row.
+    """
+    sep = "\t" if path.endswith((".tsv", ".txt")) else ","
+    places = pd.read_csv(path, sep=sep, header=None, dtype=str, keep_default_na=False, nrows=1)
+    if len(places.columns) == len(GEONAMES_POSTAL_COLUMNS) and _is_number(places.iloc[0, 9]):
+        places = pd.read_csv(path, sep=sep, header=None, names=GEONAMES_POSTAL_COLUMNS, dtype=str,
+                             keep_default_na=False, quoting=csv.QUOTE_NONE)
+    else:
+        places = pd.read_csv(path, sep=sep, dtype=str, keep_default_na=False)
+        places = places.rename(columns=lambda column: HEADER_ALIASES.get(column.strip().lower(), column))
+
+    missing = {"latitude", "longitude"} - set(places.columns)
+    if missing:
+        raise ValueError(f"Gazetteer {path} has no {', '.join(sorted(missing))} column")
+    places = places[["latitude", "longitude"] + [column for column in PLACE_PROPERTIES if column in places.columns]].copy()
+    places["latitude"] = pd.to_numeric(places["latitude"], errors="coerce")
+    places["longitude"] = pd.to_numeric(places["longitude"], errors="coerce")
+    return places.dropna(subset=["latitude", "longitude"]).reset_index(drop=True)
+
+
+class OfflineGeocoder:
+    """
+    In-process reverse geocoder: nearest gazetteer place of each point, found with a KD-tree over
+    the places' unit vectors. resolve() answers whole lat/lon arrays in one call and returns the
+    same properties as the geocoder API, or None for points farther than max_km from any place.
+    """
+
+    def __init__(self, places):
+        from scipy.spatial import cKDTree
+
+        self.places = places
+        self._properties = places[[column for column in PLACE_PROPERTIES if column in places.columns]].to_dict("records")
+        self._tree = cKDTree(_unit_vectors(places["latitude"], places["longitude"]))
+
+    @classmethod
+    def load(cls, path):
+        places = read_gazetteer(path)
+        logger.info(f"Loaded {len(places)} places for offline geocoding from {path}")
+        return cls(places)
+
+    def nearest(self, lats, lons):
+        """(place index, distance in km) of the nearest place for each point."""
+        chord, index = self._tree.query(_unit_vectors(lats, lons), k=1)
+        return index, _chord_to_km(chord)
+
+    def resolve(self, lats, lons, max_km=None):
+        """Location properties per point (None beyond max_km, default LOCAL_GEOCODER_MAX_KM)."""
+        max_km = config.LOCAL_GEOCODER_MAX_KM if max_km is None else max_km
+        if len(lats) == 0:
+            return []
+        index, distance = self.nearest(lats, lons)
+        return [dict(self._properties[i], _source="offline") if km <= max_km else None
+                for i, km in zip(index, distance)]
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+def get_offline_geocoder():
+    """The shared OfflineGeocoder for LOCAL_GEOCODER_PATH, loaded on first use; None when disabled or unavailable."""
+    global _geocoder
+    if not config.LOCAL_GEOCODER_PATH:
+        return None
+    with _geocoder_lock:
+        if _geocoder is None:
+            try:
+                _geocoder = OfflineGeocoder.load(config.LOCAL_GEOCODER_PATH)
+            except ImportError:
+                logger.error("Offline geocoding needs scipy; falling back to the geocoder API")
+                _geocoder = False
+            except Exception as e:
+                logger.error(f"Could not load gazetteer {config.LOCAL_GEOCODER_PATH}: {e}")
+                _geocoder = False
+        return _geocoder or None
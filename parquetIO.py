@@ -0,0 +1,134 @@
+import os
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+from logger import get_logger
+
+logger = get_logger("ParquetIO")
+
+
+class RowGroupWriter:
+    """
+    Stream tables into a parquet file with a fixed schema. Incoming tables are buffered and written
+    as row groups of `row_group_size` rows, so memory stays at about one row group however large
+    the file gets.
+
+    With atomic=True the file is written as `<path>.tmp` and renamed over `path` on close, so
+    readers never see a partial file and an aborted write leaves any previous output untouched.
+    """
+
+    def __init__(self, path, schema, row_group_size, compression="snappy", atomic=False):
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+        self.row_groups_written = 0
+        self._buffer = []
+        self._buffered_rows = 0
+        self._write_path = f"{path}.tmp" if atomic else path
+        self._writer = pq.ParquetWriter(self._write_path, schema, compression=compression)
+
+    def write(self, table):
+        """Buffer `table` (cast to the writer schema) and flush every full row group."""
+        if table.num_rows == 0:
+            return
+        self._buffer.append(table.select(self.schema.names).cast(self.schema))
+        self._buffered_rows += table.num_rows
+        if self._buffered_rows >= self.row_group_size:
+            self._flush(final=False)
+
+    def _flush(self, final):
+        if not self._buffer:
+            return
+        pending = pa.concat_tables(self._buffer)
+        full_rows = pending.num_rows if final else pending.num_rows - pending.num_rows % self.row_group_size
+        if full_rows:
+            self._writer.write_table(pending.slice(0, full_rows), row_group_size=self.row_group_size)
+            self.rows_written += full_rows
+            self.row_groups_written += -(-full_rows // self.row_group_size)
+        remainder = pending.slice(full_rows)
+        self._buffer = [remainder] if remainder.num_rows else []
+        self._buffered_rows = remainder.num_rows
+
+    def close(self):
+        self._flush(final=True)
+        self._writer.close()
+        if self._write_path != self.path:
+            os.replace(self._write_path, self.path)
+
+    def abort(self):
+        """Close the file without flushing buffered rows; an atomic writer also deletes its temp file."""
+        self._buffer = []
+        self._buffered_rows = 0
+        self._writer.close()
+        if self._write_path != self.path and os.path.exists(self._write_path):
+            os.remove(self._write_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def row_group_bytes(metadata, row_group_idx, columns=None):
+    """Compressed size of the column chunks of `columns` (all when None) in a row group: what reading them costs."""
+    row_group = metadata.row_group(row_group_idx)
+    return sum(row_group.column(i).total_compressed_size for i in range(row_group.num_columns)
+               if columns is None or row_group.column(i).path_in_schema in columns)
+
+def column_all_empty(metadata, row_group_idx, name):
+    """True when a row group's statistics prove every value of column `name` is null or an empty string."""
+    row_group = metadata.row_group(row_group_idx)
+    for i in range(row_group.num_columns):
+        column = row_group.column(i)
+        if column.path_in_schema == name:
+            statistics = column.statistics
+            if statistics is None:
+                return False
+            if statistics.has_null_count and statistics.null_count == row_group.num_rows:
+                return True
+            return statistics.has_min_max and statistics.min in ("", b"") and statistics.max in ("", b"")
+    return False
+
+def present_columns(parquet_file, columns):
+    """The names in `columns` the file has, in file order (for read_row_group(columns=...))."""
+    wanted = set(columns)
+    return [name for name in parquet_file.schema_arrow.names if name in wanted]
+
+
+class ScanStats:
+    """
+    Per-stage totals of parquet reads: bytes of the files scanned, bytes of the column chunks actually
+    read after column projection and row-group skipping, and row groups read or skipped by their statistics.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, file_bytes=0, bytes_read=0, row_groups=0, skipped=0):
+        with self._lock:
+            totals = self._stages.setdefault(stage, dict.fromkeys(("file_bytes", "bytes_read", "row_groups", "skipped"), 0))
+            totals["file_bytes"] += file_bytes
+            totals["bytes_read"] += bytes_read
+            totals["row_groups"] += row_groups
+            totals["skipped"] += skipped
+
+    def stats(self):
+        with self._lock:
+            return {stage: dict(totals, read_ratio=totals["bytes_read"] / totals["file_bytes"] if totals["file_bytes"] else 0.0)
+                    for stage, totals in self._stages.items()}
+
+    def log_stats(self, stage=None):
+        for name, totals in self.stats().items():
+            if stage is None or name == stage:
+                logger.info(f"Parquet reads [{name}]: {totals['bytes_read'] / 2**20:.2f} MB read of "
+                            f"{totals['file_bytes'] / 2**20:.2f} MB in files ({totals['read_ratio']:.1%}), "
+                            f"{totals['skipped']}/{totals['row_groups']} row groups skipped by statistics")
+
+
+scan_stats = ScanStats()
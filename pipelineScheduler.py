@@ -0,0 +1,190 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from logger import get_logger
+from config import config
+from downloadingAndDecompressing import prepare_transfer
+from dataCleaning import clean_file, log_cleaning_summary, create_dedup_index, CLEANING_COUNTERS
+from integratedProcessing import process_file_with_corrections
+from RedisUtils.redisProcessing import model_catalog, close_async_redis
+from vendorMatcher import get_vendor_matcher
+from geocoderClient import close_geocoder_client
+from runLedger import object_name
+from parquetIO import scan_stats
+
+logger = get_logger("PipelineScheduler")
+
+_DONE = object()  # Sentinel telling a stage worker there is no more input
+
+
+class _Stage:
+    """
+    A pool of worker threads that take items from `in_queue`, run `func` on them and put non-None
+    results on `out_queue`. Bounded queues give backpressure: a stage blocks when the next one is
+    full, so at most `queue_size` finished items wait between two stages.
+    """
+
+    def __init__(self, name, func, workers, in_queue, out_queue=None, next_workers=0, init_worker=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.next_workers = next_workers
+        self.init_worker = init_worker
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+        self._alive = workers
+        self._threads = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        state = self.init_worker() if self.init_worker else None
+        try:
+            while True:
+                item = self.in_queue.get()
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                try:
+                    result = self.func(item, state) if self.init_worker else self.func(item)
+                except Exception as e:
+                    result = None
+                    logger.error(f"[{self.name}] Failed on {item}: {e}")
+                elapsed = time.perf_counter() - start
+
+                with self._lock:
+                    self.busy_seconds += elapsed
+                    if result is None:
+                        self.failed += 1
+                    else:
+                        self.processed += 1
+                if result is not None and self.out_queue is not None:
+                    self.out_queue.put(result)
+        finally:
+            if isinstance(state, asyncio.AbstractEventLoop):
+                state.run_until_complete(close_async_redis())
+                state.run_until_complete(close_geocoder_client())
+                state.close()
+            with self._lock:
+                self._alive -= 1
+                last_worker = self._alive == 0
+            # The last worker to exit closes the next stage
+            if last_worker and self.out_queue is not None:
+                for _ in range(self.next_workers):
+                    self.out_queue.put(_DONE)
+
+
+def run_pipeline(files, bucket_name, temp_dir, processed_dir, ledger,
+                 download_workers=None, clean_workers=None, enrich_workers=None, queue_size=None, clean_processes=None):
+    """
+    Run download, cleaning and enrichment as overlapping stages connected by bounded queues,
+    so file N+1 downloads while file N is cleaned and file N-1 is enriched.
+
+    With more than one `clean_processes` (default CLEANING_WORKERS, --workers) the clean workers share a
+    process pool of that size that cleans their row groups. The enrichment workers share one geocoder
+    concurrency limit.
+
+    `files` is an iterable of (key, size_kb, etag) tuples, e.g. iterFilesInBucket(); it is consumed lazily.
+    Every stage records its objects in the RunLedger `ledger` (listed, downloaded, cleaned, enriched or failed).
+    """
+    download_workers = download_workers or config.PIPELINE_DOWNLOAD_WORKERS
+    clean_workers = clean_workers or config.PIPELINE_CLEAN_WORKERS
+    enrich_workers = enrich_workers or config.PIPELINE_ENRICH_WORKERS
+    queue_size = queue_size or config.PIPELINE_QUEUE_SIZE
+    clean_processes = clean_processes or config.CLEANING_WORKERS
+
+    os.makedirs(temp_dir, exist_ok=True)
+    os.makedirs(processed_dir, exist_ok=True)
+
+    s3_client, transfer_config, fetch_one = prepare_transfer(download_workers)
+    predefined_vendors = get_vendor_matcher()
+    model_mapping = model_catalog  # models are looked up per row group, no full-hash download
+
+    cleaning_totals = dict.fromkeys(CLEANING_COUNTERS, 0)
+    dedup_index = create_dedup_index()  # Shared by all clean workers
+    clean_pool = ProcessPoolExecutor(max_workers=clean_processes) if clean_processes > 1 else None
+    totals_lock = threading.Lock()
+
+    def download(item):
+        file_name = item[0]
+        try:
+            local_path, size_bytes, seconds = fetch_one(s3_client, bucket_name, file_name, temp_dir, transfer_config)
+        except Exception as e:
+            ledger.failed(object_name(file_name), "download", e)
+            raise
+        if local_path is None:
+            ledger.failed(object_name(file_name), "download", "decompression failed")
+        else:
+            ledger.record(object_name(file_name), "downloaded", downloaded_bytes=size_bytes, download_seconds=seconds)
+        return local_path
+
+    def clean(file_path):
+        counters = clean_file(file_path, dedup_index=dedup_index, ledger=ledger, executor=clean_pool,
+                              workers=clean_processes)
+        if counters is None:
+            return None
+        with totals_lock:
+            for key, value in counters.items():
+                cleaning_totals[key] += value
+        return file_path
+
+    def enrich(file_path, loop):
+        success = loop.run_until_complete(process_file_with_corrections(
+            file_path, processed_dir, ledger, predefined_vendors, model_mapping))
+        return file_path if success else None
+
+    download_queue = queue.Queue(maxsize=queue_size)
+    clean_queue = queue.Queue(maxsize=queue_size)
+    enrich_queue = queue.Queue(maxsize=queue_size)
+
+    stages = [
+        _Stage("download", download, download_workers, download_queue, clean_queue, clean_workers),
+        _Stage("clean", clean, clean_workers, clean_queue, enrich_queue, enrich_workers),
+        # Each enrichment worker drives its own event loop
+        _Stage("enrich", enrich, enrich_workers, enrich_queue, init_worker=asyncio.new_event_loop),
+    ]
+
+    start = time.perf_counter()
+    for stage in stages:
+        stage.start()
+
+    listed = 0
+    try:
+        for item in files:
+            file_name, size_kb, etag = item
+            ledger.record(object_name(file_name), "listed", s3_key=file_name, size_bytes=round(size_kb * 1024), etag=etag)
+            download_queue.put(item)  # Blocks while downloads are queue_size files behind
+            listed += 1
+    finally:
+        # Even if the listing fails part-way, let the files already queued drain and the stages exit
+        for _ in range(download_workers):
+            download_queue.put(_DONE)
+        for stage in stages:
+            stage.join()
+        if clean_pool is not None:
+            clean_pool.shutdown()
+        if dedup_index is not None:
+            dedup_index.close()
+    elapsed = time.perf_counter() - start
+
+    log_cleaning_summary(cleaning_totals)
+    scan_stats.log_stats()
+    ledger.log_summary()
+    logger.info(f"Pipeline finished {listed} listed files in {elapsed:.2f}s")
+    for stage in stages:
+        logger.info(f"Stage {stage.name}: {stage.processed} succeeded, {stage.failed} failed, "
+                    f"{stage.busy_seconds:.2f}s busy across {stage.workers} workers")
+    return {stage.name: {"processed": stage.processed, "failed": stage.failed} for stage in stages}
@@ -0,0 +1,303 @@
+import os
+import re
+import uuid
+import queue
+import shutil
+import threading
+from collections import defaultdict
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from config import config
+from logger import get_logger
+from parquetIO import RowGroupWriter
+
+logger = get_logger("ProcessedDataset")
+
+# Partition columns computed from the transformed table rather than taken from it
+DERIVED_PARTITION_COLUMNS = {
+    "date": lambda table: pc.utf8_slice_codeunits(table["reqTimeConverted"], 0, 10),  # YYYY-MM-DD
+}
+
+_DONE = object()
+_ABORT = object()
+
+
+def partition_schema(schema, partition_columns=None):
+    """Schema of the hive partition keys: derived columns are strings, others keep their type in `schema`."""
+    partition_columns = config.PROCESSED_PARTITION_COLUMNS if partition_columns is None else partition_columns
+    fields = []
+    for column in partition_columns:
+        if column in DERIVED_PARTITION_COLUMNS:
+            fields.append(pa.field(column, pa.string()))
+        elif column in schema.names:
+            fields.append(schema.field(column))
+        else:
+            raise ValueError(f"Unknown partition column '{column}'")
+    return pa.schema(fields)
+
+def _data_files(root):
+    """Parquet files of a dataset, skipping hidden and '_' entries (staging dirs, temp files)."""
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [name for name in dirs if not name.startswith((".", "_"))]
+        for name in files:
+            if name.endswith(".parquet") and not name.startswith((".", "_")):
+                yield os.path.join(directory, name)
+
+def _write_options(compression):
+    return ds.ParquetFileFormat().make_write_options(compression=compression, write_statistics=True)
+
+
+class DatasetWriter:
+    """
+    Stream tables into a hive-partitioned parquet dataset under `root` (e.g. date=.../device_country_code=...),
+    with the same interface as RowGroupWriter. Tables are fed to one pyarrow.dataset.write_dataset call
+    running in a background thread, which splits rows by partition, caps files at `max_rows_per_file`
+    rows and writes row groups of `row_group_size` rows with min/max statistics.
+
+    Files are written to a hidden staging directory and moved into their partitions on close, named
+    `<basename>-<run>-<n>.parquet`; files an earlier run wrote for the same basename are removed then,
+    so reprocessing an input replaces its rows instead of duplicating them. abort() drops the staging
+    directory and leaves the dataset as it was. Empty partition values are written as nulls.
+    """
+
+    def __init__(self, root, basename, schema, row_group_size, compression="snappy",
+                 partition_columns=None, max_rows_per_file=None):
+        self.root = self.path = root
+        self.basename = basename
+        self.schema = schema
+        self.partitioning = partition_schema(schema, partition_columns)
+        self.row_group_size = row_group_size
+        self.max_rows_per_file = max_rows_per_file or config.PROCESSED_MAX_ROWS_PER_FILE
+        self.rows_written = 0
+        self.row_groups_written = 0
+        self.files_written = 0
+        self.paths = []  # files published by close()
+        self._run = uuid.uuid4().hex[:12]
+        self._staging = os.path.join(root, f".staging-{basename}-{self._run}")
+        self._written = []
+        self._error = None
+        self._queue = queue.Queue(maxsize=4)
+        derived = [column for column in self.partitioning.names if column in DERIVED_PARTITION_COLUMNS]
+        self._write_schema = pa.schema(list(schema) + [self.partitioning.field(column) for column in derived])
+        self._thread = threading.Thread(target=self._run_writer, args=(compression,), daemon=True,
+                                        name=f"dataset-writer-{basename}")
+        self._thread.start()
+
+    def _batches(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            if item is _ABORT:
+                raise RuntimeError("dataset write aborted")
+            yield from item.to_batches()
+
+    def _file_written(self, written_file):
+        self._written.append(written_file.path)
+        self.rows_written += written_file.metadata.num_rows
+        self.row_groups_written += written_file.metadata.num_row_groups
+
+    def _run_writer(self, compression):
+        try:
+            ds.write_dataset(pa.RecordBatchReader.from_batches(self._write_schema, self._batches()), self._staging,
+                             format="parquet", partitioning=ds.partitioning(self.partitioning, flavor="hive"),
+                             basename_template=f"{self.basename}-{self._run}-{{i}}.parquet",
+                             file_options=_write_options(compression), max_rows_per_file=self.max_rows_per_file,
+                             min_rows_per_group=min(self.row_group_size, self.max_rows_per_file),
+                             max_rows_per_group=min(self.row_group_size, self.max_rows_per_file),
+                             max_partitions=100_000, existing_data_behavior="overwrite_or_ignore",
+                             file_visitor=self._file_written)
+        except Exception as e:
+            self._error = e
+            # Unblock a producer waiting on a full queue
+            while not self._queue.empty():
+                self._queue.get_nowait()
+
+    def _put(self, item):
+        while self._thread.is_alive():
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        if self._error is not None:
+            raise self._error
+
+    def _prepare(self, table):
+        table = table.select(self.schema.names).cast(self.schema)
+        for column in self.partitioning.names:
+            values = DERIVED_PARTITION_COLUMNS[column](table) if column in DERIVED_PARTITION_COLUMNS else table[column]
+            if pa.types.is_string(values.type):
+                # An array of nulls: if_else with a null scalar mangles sliced string arrays in pyarrow 19
+                values = pc.if_else(pc.equal(values, ""), pa.nulls(len(values), pa.string()), values)
+            index = table.schema.get_field_index(column)
+            table = table.set_column(index, column, values) if index >= 0 else table.append_column(column, values)
+        return table
+
+    def write(self, table):
+        """Queue `table` (cast to the writer schema) for the background writer."""
+        if self._error is not None:
+            raise self._error
+        if table.num_rows:
+            self._put(self._prepare(table))
+
+    def close(self):
+        self._put(_DONE)
+        self._thread.join()
+        if self._error is not None:
+            shutil.rmtree(self._staging, ignore_errors=True)
+            raise self._error
+        self.files_written = len(self._written)
+        for path in self._written:
+            target = os.path.join(self.root, os.path.relpath(path, self._staging))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+            self.paths.append(target)
+        previous_run = re.compile(rf"{re.escape(self.basename)}-(?!{self._run}-)[0-9a-f]{{12}}-\d+\.parquet")
+        for path in _data_files(self.root):
+            if previous_run.fullmatch(os.path.basename(path)):
+                os.remove(path)
+        shutil.rmtree(self._staging, ignore_errors=True)
+
+    def abort(self):
+        """Stop the writer and delete everything staged; the dataset keeps its previous files."""
+        if self._thread.is_alive():
+            self._put(_ABORT)
+            self._thread.join()
+        shutil.rmtree(self._staging, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def open_processed_writer(processed_dir, file_name, schema):
+    """Writer for the processed output of one input file, per PROCESSED_OUTPUT_MODE."""
+    if config.PROCESSED_OUTPUT_MODE == "dataset":
+        return DatasetWriter(processed_dir, os.path.splitext(file_name)[0], schema, config.PROCESSED_ROW_GROUP_SIZE,
+                             compression=config.PROCESSED_COMPRESSION)
+    return RowGroupWriter(os.path.join(processed_dir, file_name), schema, config.PROCESSED_ROW_GROUP_SIZE,
+                          compression=config.PROCESSED_COMPRESSION, atomic=True)
+
+
+def _output_pattern(file_name):
+    """File names the processed output of an input file can have: flat file, segments and their dataset files."""
+    stem = re.escape(os.path.splitext(file_name)[0])
+    return re.compile(rf"{re.escape(file_name)}|{stem}-part-\d+\.parquet|{stem}(-part-\d+)?-[0-9a-f]{{12}}-\d+\.parquet")
+
+def discard_processed_output(processed_dir, file_name, keep=()):
+    """Remove whatever earlier runs wrote for an input file except the paths in `keep`."""
+    output = _output_pattern(file_name)
+    keep = {os.path.abspath(path) for path in keep}
+    for path in _data_files(processed_dir):
+        if output.fullmatch(os.path.basename(path)) and os.path.abspath(path) not in keep:
+            os.remove(path)
+
+def publish_segments(processed_dir, file_name, segment_paths, schema):
+    """
+    Turn the staged segments of an input file into its processed output, then remove what earlier runs
+    wrote for it. The output appears atomically, so the previous output stays intact until then. In files
+    mode a single segment is hard-linked into place; otherwise the segments are copied row group by row
+    group. Returns the published paths.
+    """
+    target = os.path.join(processed_dir, file_name)
+    if config.PROCESSED_OUTPUT_MODE != "dataset" and len(segment_paths) == 1:
+        temp_path = f"{target}.tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.link(segment_paths[0], temp_path)
+        except OSError:
+            shutil.copyfile(segment_paths[0], temp_path)
+        os.replace(temp_path, target)
+        paths = [target]
+    else:
+        with open_processed_writer(processed_dir, file_name, schema) as writer:
+            for segment_path in segment_paths:
+                with pq.ParquetFile(segment_path) as segment:
+                    for row_group_index in range(segment.num_row_groups):
+                        writer.write(segment.read_row_group(row_group_index))
+        paths = writer.paths if isinstance(writer, DatasetWriter) else [writer.path]
+    discard_processed_output(processed_dir, file_name, keep=paths)
+    return paths
+
+
+def processed_dataset(root, partition_columns=None):
+    """The processed dataset under `root` as a pyarrow Dataset with its hive partitioning."""
+    from fetchFromLatLong import TRANSFORMED_SCHEMA
+
+    partitioning = ds.partitioning(partition_schema(TRANSFORMED_SCHEMA, partition_columns), flavor="hive")
+    return ds.dataset(root, format="parquet", partitioning=partitioning)
+
+def read_processed(root, columns=None, filter=None, **partition_values):
+    """
+    Read rows of the processed dataset, e.g.
+    read_processed("processed_dir", date="2024-02-27", device_country_code="US", columns=["deviceIfa", "city"]).
+
+    Keyword arguments are equality filters (None matches a missing value), combined with an optional
+    pyarrow.dataset expression in `filter`. Partitions that cannot match are never opened, and row
+    groups whose min/max statistics exclude the filter are skipped.
+    """
+    expression = filter
+    for column, value in partition_values.items():
+        term = ds.field(column).is_null() if value is None else ds.field(column) == value
+        expression = term if expression is None else expression & term
+    return processed_dataset(root).to_table(columns=columns, filter=expression)
+
+
+def compact_processed(root, min_file_mb=None, max_rows_per_file=None, row_group_size=None, compression=None,
+                      exclude_inputs=()):
+    """
+    Merge the small files (under `min_file_mb`, default PROCESSED_COMPACT_MIN_FILE_MB) of each partition
+    of a processed dataset into files of up to `max_rows_per_file` rows. Merged files are written to a
+    hidden directory and moved in before the originals are deleted, so readers never miss rows.
+
+    Compacted files no longer belong to one input, so a later rerun of an input whose files were
+    compacted adds its rows again. The pipeline therefore never compacts on its own; run it explicitly
+    (`main.py --compact`) once the inputs are final. Output of the input files in `exclude_inputs`
+    (e.g. ones with an open checkpoint) is left alone. Returns (files merged, files written).
+    """
+    min_file_mb = config.PROCESSED_COMPACT_MIN_FILE_MB if min_file_mb is None else min_file_mb
+    max_rows_per_file = max_rows_per_file or config.PROCESSED_MAX_ROWS_PER_FILE
+    row_group_size = min(row_group_size or config.PROCESSED_ROW_GROUP_SIZE, max_rows_per_file)
+    compression = compression or config.PROCESSED_COMPRESSION
+    if not min_file_mb or not os.path.isdir(root):
+        return 0, 0
+
+    excluded = [_output_pattern(file_name) for file_name in exclude_inputs]
+    small_files = defaultdict(list)
+    for path in _data_files(root):
+        if any(output.fullmatch(os.path.basename(path)) for output in excluded):
+            continue
+        if os.path.getsize(path) < min_file_mb * 1024 * 1024:
+            small_files[os.path.dirname(path)].append(path)
+
+    merged = written = 0
+    for directory, paths in small_files.items():
+        if len(paths) < 2:
+            continue
+        run = uuid.uuid4().hex[:12]
+        staging = os.path.join(directory, f".compact-{run}")
+        outputs = []
+        try:
+            ds.write_dataset(ds.dataset(sorted(paths), format="parquet"), staging, format="parquet",
+                             basename_template=f"compacted-{run}-{{i}}.parquet", file_options=_write_options(compression),
+                             max_rows_per_file=max_rows_per_file, min_rows_per_group=row_group_size,
+                             max_rows_per_group=row_group_size, file_visitor=lambda written_file: outputs.append(written_file.path))
+            for path in outputs:
+                os.replace(path, os.path.join(directory, os.path.basename(path)))
+            for path in paths:
+                os.remove(path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        merged += len(paths)
+        written += len(outputs)
+        logger.info(f"Compacted {len(paths)} files into {len(outputs)} in {directory}")
+    return merged, written
@@ -1,10 +1,13 @@
 import os
 import pandas as pd
+from config import config
 import gc
 import pyarrow.parquet as pq
 from logger import get_logger
+from parquetIO import present_columns, row_group_bytes, scan_stats
 from tqdm import tqdm
-from RedisUtils.redisProcessing import load_or_create_vendors, save_vendor, get_model_mapping, update_model_mapping
+from RedisUtils.redisProcessing import save_vendor, model_catalog, bulk_update_model_mapping
+from vendorMatcher import get_vendor_matcher, matcher_for, ua_vendor_cache
 
 logger = get_logger("Filling Data in Redis")
 
@@ -61,6 +64,7 @@ logger = get_logger("Filling Data in Redis")
 def process_chunk(chunk, predefined_vendors,model_mapping):
     """
     Process a chunk of the DataFrame to handle make and model processing.
+    model_mapping is the ModelCatalog the chunk's models are looked up in and written through.
     """
     try:
         chunk = chunk.astype(str).apply(lambda x: x.str.lower().fillna(""))
@@ -73,6 +77,14 @@ def process_chunk(chunk, predefined_vendors,model_mapping):
         logger.error(f"Error processing columns: {e}")
         return
 
+    # Resolve each distinct UA once per chunk (and across chunks through the shared LRU)
+    ua_vendors = ua_vendor_cache.vendors_for(matcher_for(predefined_vendors), chunk['ua'])
+
+    # Current entries of the chunk's models in one HMGET (or from the catalog cache); kept up to date with our writes
+    models = [_strip_vendor(model, vendor, predefined_vendors).strip()
+              for model, vendor in zip(chunk['device_model'], chunk['device_vendor'])]
+    known_entries = model_mapping.lookup(models)
+
     for index, row in chunk.iterrows():
         try:
             model = row['device_model'] if row['device_model'] else ""
@@ -84,12 +96,11 @@ def process_chunk(chunk, predefined_vendors,model_mapping):
                 model = model.replace(vendor, "").strip("_ .").replace("_", " ").replace(".", " ").strip()
 
             if not vendor or (len(vendor) <= 3 and vendor != "lg"):
-                vendor = extract_vendor_from_ua(row['ua'], predefined_vendors)
+                vendor = ua_vendors[index]
                 if vendor and vendor not in predefined_vendors:
                     save_vendor(vendor)
 
-            # Fetch latest model mapping dynamically instead of using stale data
-            existing_entry = get_model_mapping().get(model, {})
+            existing_entry = known_entries.get(model.strip()) or {}
 
             updated_entry = {
                 "vendor": vendor or existing_entry.get("vendor"),
@@ -101,31 +112,61 @@ def process_chunk(chunk, predefined_vendors,model_mapping):
             normalized_updated = {k: str(v).strip().lower() for k, v in updated_entry.items()}
 
             if normalized_existing != normalized_updated:
-                update_model_mapping(model, updated_entry)
+                model_mapping.update(model, updated_entry)
+                known_entries[model.strip()] = updated_entry
 
         except Exception as e:
             logger.error(f"Error processing row: {e}")
 
-def extract_vendor_from_ua(ua, predefined_vendors, current_vendor=None):
-    """
-    Extract the vendor from the 'ua' field using the predefined vendors list.
-    """
-    if pd.notna(ua):
-        ua_section = ua.split(")")[0] if ")" in ua else ua
+MODEL_FIELDS = {"device_vendor": "vendor", "device_height": "height", "device_width": "width"}
+# Input columns the model mapping build reads
+MODEL_INPUT_COLUMNS = ("ua", "device_model", *MODEL_FIELDS)
 
-        for vendor in predefined_vendors:
-            if vendor in ua_section:
-                if current_vendor is not None and "android" in current_vendor and vendor == "apple":
-                    continue
-                elif current_vendor is not None and "apple" in current_vendor and vendor == "android":
-                    continue
-                return vendor
+def _strip_vendor(model, vendor, predefined_vendors):
+    if vendor in predefined_vendors:
+        return model.replace(vendor, "").strip("_ .").replace("_", " ").replace(".", " ").strip()
+    return model
 
-    return None
+def reduce_chunk(chunk, predefined_vendors):
+    """
+    Reduce a chunk to what process_chunk would write: per model the last non-empty vendor, height
+    and width (in row order), plus the UA-derived vendors that are not predefined yet.
+    Returns (entries, new_vendors), entries being {model: {vendor, height, width}}.
+    """
+    chunk = chunk.astype(str).apply(lambda x: x.str.lower().fillna(""))
+
+    # Vendor strings of three characters or less (other than lg) are replaced by the UA vendor
+    vendors = chunk['device_vendor']
+    needs_ua = (vendors == "") | ((vendors.str.len() <= 3) & (vendors != "lg"))
+    ua_vendors = ua_vendor_cache.vendors_for(matcher_for(predefined_vendors), chunk.loc[needs_ua, 'ua'])
+    new_vendors = {vendor for vendor in ua_vendors if vendor and vendor not in predefined_vendors}
+
+    stripped = {pair: _strip_vendor(*pair, predefined_vendors)
+                for pair in set(zip(chunk['device_model'], vendors))}
+    rows = chunk[list(MODEL_FIELDS)].rename(columns=MODEL_FIELDS)
+    rows['vendor'] = vendors.mask(needs_ua, ua_vendors)
+    rows['model'] = [stripped[pair].strip() for pair in zip(chunk['device_model'], vendors)]
+
+    # Empty fields keep the value of an earlier row; groupby.last() skips them
+    fields = list(MODEL_FIELDS.values())
+    rows[fields] = rows[fields].mask(rows[fields] == "")
+    latest = rows.groupby('model', sort=False)[fields].last()
+    return latest.astype(object).where(latest.notna(), None).to_dict('index'), new_vendors
+
+def merge_model_entries(entries, chunk_entries):
+    """Fold a later chunk's entries into `entries`: set fields override, empty ones keep the earlier value."""
+    for model, details in chunk_entries.items():
+        entry = entries.setdefault(model, dict.fromkeys(MODEL_FIELDS.values()))
+        entry.update({field: value for field, value in details.items() if value})
 
 def process_parquet_files():
-    predefined_vendors = load_or_create_vendors()
-    model_mapping = get_model_mapping()
+    predefined_vendors = get_vendor_matcher()
+
+    # Bulk mode reduces every row group to per-model entries and writes them to Redis once at the end;
+    # both modes read only the models they touch, never the whole hash
+    bulk = config.MODEL_MAPPING_BUILD_MODE == "bulk"
+    model_mapping = model_catalog
+    entries, new_vendors = {}, set()
 
     baseDir="temp"
 
@@ -139,13 +180,28 @@ def process_parquet_files():
 
                 try:
                     parquet_file = pq.ParquetFile(file_path)
+                    columns = present_columns(parquet_file, MODEL_INPUT_COLUMNS)
+                    scan_stats.record("model_mapping", file_bytes=os.path.getsize(file_path))
                     for row_group_idx in tqdm(range(parquet_file.num_row_groups), desc=f"Processing {file_name}"):
-                        chunk = parquet_file.read_row_group(row_group_idx).to_pandas()
-                        process_chunk(chunk, predefined_vendors, model_mapping)
+                        chunk = parquet_file.read_row_group(row_group_idx, columns=columns).to_pandas()
+                        scan_stats.record("model_mapping", row_groups=1,
+                                          bytes_read=row_group_bytes(parquet_file.metadata, row_group_idx, columns))
+                        if bulk:
+                            chunk_entries, chunk_vendors = reduce_chunk(chunk, predefined_vendors)
+                            merge_model_entries(entries, chunk_entries)
+                            new_vendors |= chunk_vendors
+                        else:
+                            process_chunk(chunk, predefined_vendors, model_mapping)
 
                 except Exception as e:
                     logger.error(f"Error processing file {file_name}: {e}")
 
-                gc.collect()
+                ua_vendor_cache.log_stats()
 
+                gc.collect()
 
+    if bulk:
+        models_written, vendors_added = bulk_update_model_mapping(entries, new_vendors)
+        logger.info(f"Model mapping build wrote {models_written} models and {vendors_added} vendors "
+                    f"({len(entries)} distinct models seen)")
+    scan_stats.log_stats("model_mapping")
@@ -0,0 +1,111 @@
+import os
+import time
+import sqlite3
+import threading
+from logger import get_logger
+
+logger = get_logger("RunLedger")
+
+STATES = ("listed", "downloaded", "cleaned", "enriched", "failed")
+
+# Columns a stage may set besides the state; stages only touch their own
+FIELDS = ("s3_key", "etag", "size_bytes", "downloaded_bytes", "raw_rows", "cleaned_rows", "enriched_rows",
+          "download_seconds", "clean_seconds", "enrich_seconds", "failed_stage", "error")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    name TEXT PRIMARY KEY,          -- local file name, e.g. bid-0.parquet for bid/.../bid-0.parquet.zst
+    state TEXT NOT NULL,
+    s3_key TEXT,
+    etag TEXT,
+    size_bytes INTEGER,             -- object size in the bucket
+    downloaded_bytes INTEGER,
+    raw_rows INTEGER,               -- rows before cleaning
+    cleaned_rows INTEGER,
+    enriched_rows INTEGER,
+    download_seconds REAL,
+    clean_seconds REAL,
+    enrich_seconds REAL,
+    failed_stage TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_state ON objects (state, updated_at);
+CREATE INDEX IF NOT EXISTS objects_s3_key ON objects (s3_key);
+"""
+
+
+def object_name(key):
+    """Ledger name of an S3 object: the name its decompressed file gets in the temp dir."""
+    name = os.path.basename(key)
+    return name[:-4] if name.endswith(".zst") else name
+
+
+class RunLedger:
+    """
+    Per-object state of pipeline runs in a local SQLite database in WAL mode, replacing status.json.
+
+    Every stage updates only its object's row, in its own transaction (an upsert), so concurrent
+    workers and processes never rewrite each other's entries and a crash loses at most the update
+    in flight. Moving to a state other than "failed" clears the previous error.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, never corrupt in WAL mode
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def record(self, name, state, **fields):
+        """Set an object's state and the given FIELDS, creating its row if needed."""
+        if state not in STATES:
+            raise ValueError(f"Unknown state '{state}', expected one of {STATES}")
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown ledger fields: {', '.join(sorted(unknown))}")
+        if state != "failed":
+            fields.setdefault("failed_stage", None)
+            fields.setdefault("error", None)
+
+        now = time.time()
+        columns = ["name", "state", "updated_at", *fields]
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+        sql = (f"INSERT INTO objects ({', '.join(columns)}, created_at) VALUES ({', '.join('?' * (len(columns) + 1))}) "
+               f"ON CONFLICT (name) DO UPDATE SET {updates}")
+        with self._lock, self._conn:
+            self._conn.execute(sql, [name, state, now, *fields.values(), now])
+
+    def failed(self, name, stage, error):
+        """Record that `stage` failed on an object."""
+        self.record(name, "failed", failed_stage=stage, error=str(error)[:1000])
+
+    def get(self, name):
+        """The object's row as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM objects WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+
+    def names(self, state):
+        """Names of the objects in `state`, oldest update first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT name FROM objects WHERE state = ? ORDER BY updated_at", (state,)).fetchall()
+        return [row["name"] for row in rows]
+
+    def summary(self):
+        """Object count per state."""
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) AS objects FROM objects GROUP BY state").fetchall()
+        return {row["state"]: row["objects"] for row in rows}
+
+    def log_summary(self):
+        summary = self.summary()
+        logger.info("Run ledger: " + ", ".join(f"{summary.get(state, 0)} {state}" for state in STATES))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
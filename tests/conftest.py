@@ -0,0 +1,31 @@
+import os
+import sys
+
+import fakeredis
+import redis
+import redis.asyncio
+
+# Modules live at the repository root; keep test runs from appending to the pipeline's log file
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_FILE", os.devnull)
+
+# RedisUtils connects at import time: point every client at one in-memory server instead
+_redis_server = fakeredis.FakeServer()
+
+
+class _FakeRedis(fakeredis.FakeRedis):
+    def __init__(self, *args, **kwargs):
+        for name in ("host", "port", "db"):
+            kwargs.pop(name, None)
+        super().__init__(*args, server=_redis_server, **kwargs)
+
+
+class _FakeAsyncRedis(fakeredis.FakeAsyncRedis):
+    def __init__(self, *args, **kwargs):
+        for name in ("host", "port", "db", "connection_pool", "max_connections"):
+            kwargs.pop(name, None)
+        super().__init__(*args, server=_redis_server, **kwargs)
+
+
+redis.Redis = _FakeRedis
+redis.asyncio.Redis = _FakeAsyncRedis
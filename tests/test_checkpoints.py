@@ -0,0 +1,91 @@
+import asyncio
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import integratedProcessing
+from config import config
+from fetchFromLatLong import transform_columns, _coordinate_index, _input_column
+from processedDataset import read_processed
+from runLedger import RunLedger
+
+ROW_GROUPS = 5
+ROWS_PER_GROUP = 4
+
+
+def write_input(path):
+    table = pa.table({
+        "refId": [f"r{i}" for i in range(ROW_GROUPS * ROWS_PER_GROUP)],
+        "date": [1709000000000 + i for i in range(ROW_GROUPS * ROWS_PER_GROUP)],
+        "device_ifa": ["ifa"] * (ROW_GROUPS * ROWS_PER_GROUP),
+        "latitude": [""] * (ROW_GROUPS * ROWS_PER_GROUP),
+        "longitude": [""] * (ROW_GROUPS * ROWS_PER_GROUP),
+    })
+    pq.write_table(table, path, row_group_size=ROWS_PER_GROUP)
+
+
+@pytest.fixture
+def enrichment(monkeypatch, tmp_path):
+    """process_file_with_corrections without Redis or the geocoder; `fail_at` makes a row group fail."""
+    calls = {"row_groups": 0, "fail_at": None}
+
+    async def transform_chunk(chunk, redis_conn):
+        calls["row_groups"] += 1
+        if calls["row_groups"] == calls["fail_at"]:
+            raise RuntimeError("geocoder down")
+        indices, pairs = _coordinate_index(_input_column(chunk, "latitude", len(chunk)),
+                                           _input_column(chunk, "longitude", len(chunk)))
+        return transform_columns(chunk, indices, pairs, {})
+
+    async def flush_location_writes():
+        pass
+
+    monkeypatch.setattr(integratedProcessing, "correct_data_with_mapping", lambda chunk, *args: chunk)
+    monkeypatch.setattr(integratedProcessing, "transform_chunk", transform_chunk)
+    monkeypatch.setattr(integratedProcessing, "flush_location_writes", flush_location_writes)
+    monkeypatch.setattr(config, "ENRICH_REDIS_ASYNC", False)
+    monkeypatch.setattr(config, "PROCESSED_CHECKPOINT_ROW_GROUPS", 2)
+    ledger = RunLedger(str(tmp_path / "ledger.db"))
+    yield calls, ledger
+    ledger.close()
+
+
+def run(input_path, processed_dir, ledger):
+    return asyncio.run(integratedProcessing.process_file_with_corrections(
+        str(input_path), str(processed_dir), ledger, None, None))
+
+
+def output_rows(processed_dir):
+    if config.PROCESSED_OUTPUT_MODE == "dataset":
+        return sorted(read_processed(str(processed_dir), columns=["refId"])["refId"].to_pylist())
+    return sorted(pq.read_table(processed_dir / "bid-0.parquet")["refId"].to_pylist())
+
+
+@pytest.mark.parametrize("mode", ["files", "dataset"])
+def test_failed_rerun_keeps_previous_output_and_resume_skips_committed_row_groups(enrichment, monkeypatch,
+                                                                                  tmp_path, mode):
+    calls, ledger = enrichment
+    monkeypatch.setattr(config, "PROCESSED_OUTPUT_MODE", mode)
+    input_path, processed_dir = tmp_path / "bid-0.parquet", tmp_path / "processed"
+    expected = sorted(f"r{i}" for i in range(ROW_GROUPS * ROWS_PER_GROUP))
+
+    write_input(input_path)
+    assert run(input_path, processed_dir, ledger)
+    assert output_rows(processed_dir) == expected
+
+    # A rerun that fails after its first segment leaves the previous output as it was
+    write_input(input_path)
+    calls.update(row_groups=0, fail_at=4)
+    assert not run(input_path, processed_dir, ledger)
+    assert output_rows(processed_dir) == expected
+    assert ledger.get("bid-0.parquet")["state"] == "failed"
+
+    # The next run only enriches the row groups after the committed segment
+    calls.update(row_groups=0, fail_at=None)
+    assert run(input_path, processed_dir, ledger)
+    assert calls["row_groups"] == ROW_GROUPS - 2
+    assert output_rows(processed_dir) == expected
+    assert ledger.get("bid-0.parquet")["state"] == "enriched"
+    assert not os.listdir(processed_dir / ".checkpoints")
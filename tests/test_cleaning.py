@@ -0,0 +1,120 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from dataCleaning import clean_file, CLEANING_COUNTERS, _as_clean_string
+from deduplication import RowHashIndex
+
+
+def make_table(rows, seed):
+    rnd = random.Random(seed)
+
+    def pick(*values):
+        return [rnd.choice(values) for _ in range(rows)]
+
+    columns = {
+        "date": pick("1709000000000", "1709000000001", "", None, "x"),
+        "device_ifa": pick(None, None, "", "ifa-1", "ifa-2"),
+        "dpidsha1": pick(None, "", "sha-1"),
+        "dpidmd5": pick(None, "", "md5-1"),
+        "device_vendor": pick(None, "", "samsung", "apple"),
+        "device_model": pick(None, "", "SM-G960F", "iphone"),
+        "latitude": pick(None, "", "12.971599", "0"),
+        "longitude": pick(None, "", "77.594566"),
+        "connection_type": pick(None, "", "0", "2"),
+        # "1.0" and "1" are the same price once converted, so they must dedup together
+        "bid_price": pick("1", "1.0", "0.5", "inf", "-Infinity", "nan", "", None, "abc"),
+        "curr_excg_rate": pick("1", "2", " 3 "),
+    }
+    table = pa.table(columns)
+    # A non-string column with nulls: pandas renders its values as "5.0"
+    return table.append_column("device_height", pa.array(pick(None, 5, 7), pa.int64()))
+
+
+def numeric_ids(table, seed):
+    """The same table with ID columns that parquet files hold as numbers: int with nulls, float, int."""
+    rnd = random.Random(seed)
+    rows = table.num_rows
+    ids = {
+        "device_ifa": pa.array([rnd.choice([None, 1, 2, 10**17 + 1]) for _ in range(rows)], pa.int64()),
+        "dpidsha1": pa.array([rnd.choice([None, float("nan"), 1.0, 0.5, 1e-05, 2e16]) for _ in range(rows)]),
+        "dpidmd5": pa.array([rnd.choice([0, 7]) for _ in range(rows)], pa.int64()),
+    }
+    for name, values in ids.items():
+        table = table.set_column(table.column_names.index(name), name, values)
+    return table
+
+
+@pytest.mark.parametrize("seed, ids", [(0, "string"), (1, "string"), (2, "string"), (3, "numeric"), (4, "numeric")])
+def test_arrow_and_pandas_engines_clean_identically(tmp_path, seed, ids):
+    table = make_table(3000, seed)
+    if ids == "numeric":
+        table = numeric_ids(table, seed)
+    results = {}
+    for engine in ("pandas", "arrow"):
+        path = tmp_path / f"{engine}.parquet"
+        pq.write_table(table, path, row_group_size=1000)
+        counters = clean_file(str(path), engine=engine)
+        results[engine] = counters, pq.read_table(path)
+
+    (pandas_counters, pandas_table), (arrow_counters, arrow_table) = results["pandas"], results["arrow"]
+    assert set(pandas_counters) == set(CLEANING_COUNTERS)
+    assert arrow_counters == pandas_counters
+    assert pandas_counters["duplicates"] > 0
+    assert (pandas_counters["all_null_ids"] > 0) == (ids == "string")  # numeric IDs are never empty
+    assert arrow_table.schema == pandas_table.schema
+    assert arrow_table.to_pylist() == pandas_table.to_pylist()
+    # Null IDs are kept as "None", like astype(str) does
+    assert ("None" if ids == "string" else "nan") in pandas_table["dpidsha1"].to_pylist()
+
+
+FLOATS = [1.0, -0.0, 0.5, 12.971599, 1e-05, 9.9e-05, 1e-4, 1.2654214710460525e-09, 130400004513013.72, 1e15,
+          9999999999999998.0, 1e16, 1.5e300, 5e-324, float("inf"), float("-inf"), float("nan")]
+
+
+@pytest.mark.parametrize("column", [
+    pa.array(FLOATS),
+    pa.array(FLOATS + [None]),
+    pa.array(FLOATS, pa.float32()),
+    pa.array(FLOATS[:-1], pa.float32()),
+    pa.array(FLOATS + [None], pa.float32()),
+    pa.array([0, -1, 5, 2**53 + 1, 2**62]),
+    pa.array([0, -1, 5, 2**53 + 1, None]),
+    pa.array([1, None], pa.int8()),
+    pa.array([2**64 - 1, 3], pa.uint64()),
+    pa.array([True, False]),
+    pa.array([True, False, None]),
+], ids=lambda column: str(column.type))
+@pytest.mark.parametrize("null", ["", "None"])
+def test_numbers_are_written_like_pandas(column, null):
+    column = pa.chunked_array([column[:3], column[3:]])
+    values = column.to_pandas()
+    expected = (values if null == "None" else values.fillna(null)).astype(str).tolist()
+    assert _as_clean_string(column, null).to_pylist() == expected
+
+
+def test_random_floats_are_written_like_pandas():
+    rng = np.random.default_rng(0)
+    column = pa.array(rng.standard_normal(5000) * 10.0 ** rng.integers(-30, 30, 5000))
+    assert _as_clean_string(column).to_pylist() == column.to_pandas().astype(str).tolist()
+
+
+def test_clean_file_in_a_shared_process_pool_matches_the_serial_path(tmp_path):
+    table = make_table(3000, 5)
+    results = {}
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        for mode, pool in (("serial", None), ("pool", executor)):
+            index = RowHashIndex(key_columns=["refId", "device_ifa", "date"])
+            paths = [tmp_path / f"{mode}-bid-{i}.parquet" for i in range(2)]
+            for path in paths:
+                pq.write_table(table, path, row_group_size=500)
+            counters = [clean_file(str(path), engine="arrow", dedup_index=index, executor=pool, workers=2)
+                        for path in paths]
+            results[mode] = counters, [pq.read_table(path).to_pylist() for path in paths]
+
+    assert results["pool"] == results["serial"]
+    assert results["serial"][0][1]["duplicates_cross_file"] > 0
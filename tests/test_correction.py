@@ -0,0 +1,79 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+from correctTheData import correct_data_with_mapping, correct_data_with_mapping_rowwise
+from RedisUtils.redisProcessing import ModelCatalog, r
+from vendorMatcher import matcher_for
+
+VENDORS = matcher_for(["samsung", "apple", "xiaomi", "redmi", "oppo", "vivo", "google"])
+
+CATALOG = {
+    "galaxy s9": {"vendor": "samsung", "height": "2960", "width": "1440"},
+    "sm-g960f": {"vendor": "samsung", "height": "2960"},  # no width: the row keeps its own
+    "iphone": {"vendor": "apple", "height": "2532", "width": "1170"},
+    "note 8": {"vendor": "redmi"},
+}
+
+
+@pytest.fixture
+def catalog():
+    r.delete("model_mapping")
+    r.hset("model_mapping", mapping={model: json.dumps(details) for model, details in CATALOG.items()})
+    yield ModelCatalog(0)
+    r.delete("model_mapping")
+
+
+def chunk():
+    rows = [
+        # model, vendor, os_version, ua, height, width
+        ("SM-G960F", "Samsung", "10.1", "Mozilla/5.0 (Linux; Android 10; SM-G960F)", "100", "200"),
+        ("samsung_galaxy s9", "", "9", "ua", "100", "200"),               # vendor-prefixed model, vendor from prefix
+        ("samsung.galaxy s9", None, None, "ua", "100", "200"),            # null vendor and os_version
+        ("iphone", "apple", "14.0.2", "Mozilla/5.0 (iPhone; CPU iPhone OS 14_0)", "1", "2"),
+        ("redmi note 8", "xiaomi", "11", "ua", "3", "4"),                 # prefix stripped, catalog vendor wins
+        ("Pixel 5", "google", "12", "ua", "5", "6"),                      # missing from the catalog
+        ("unknown-model", "", None, "ua", None, None),                    # missing, no vendor at all
+        ("android", "", "10", "Mozilla/5.0 (Linux; Android 10; oppo CPH1909)", "7", "8"),
+        ("SM-A505", "android", "9.0", "Dalvik/2.1.0 (Linux; U; Android 9; vivo 1906)", "9", "10"),
+        ("android", None, None, None, "11", "12"),                        # android with no user agent
+        ("  IPHONE  ", " APPLE ", "15", "ua", "13", "14"),                 # whitespace and case
+    ]
+    frame = pd.DataFrame(rows, columns=["device_model", "device_vendor", "os_version", "ua",
+                                        "device_height", "device_width"])
+    frame["refId"] = [f"r{i}" for i in range(len(frame))]
+    return frame
+
+
+def assert_same(expected, actual):
+    # The row-wise version rebuilds the frame from dicts, so only the values are compared
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True).astype(str),
+                                  actual.reset_index(drop=True).astype(str), check_dtype=False)
+
+
+def test_vectorized_correction_matches_rowwise(catalog):
+    expected = correct_data_with_mapping_rowwise(chunk(), VENDORS, catalog, r)
+    actual = correct_data_with_mapping(chunk(), VENDORS, catalog, r)
+
+    assert_same(expected, actual)
+    by_ref = actual.set_index("refId")
+    assert by_ref.loc["r1", ["device_vendor", "device_model", "device_width"]].tolist() == ["samsung", "galaxy s9", "1440"]
+    assert by_ref.loc["r0", ["device_height", "device_width"]].tolist() == ["2960", "200"]
+    assert by_ref.loc["r5", ["device_vendor", "device_model"]].tolist() == ["google", "pixel 5"]
+    assert by_ref.loc["r2", "normalized_os_version"] == ""
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_vectorized_correction_matches_rowwise_on_random_chunks(catalog, seed):
+    rng = np.random.default_rng(seed)
+    base = chunk()
+    sample = base.iloc[rng.integers(0, len(base), 300)].reset_index(drop=True)
+    sample["refId"] = [f"r{i}" for i in range(len(sample))]
+
+    assert_same(correct_data_with_mapping_rowwise(sample, VENDORS, catalog, r),
+                correct_data_with_mapping(sample, VENDORS, catalog, r))
+
+
+def test_empty_chunk(catalog):
+    assert correct_data_with_mapping(chunk().iloc[:0], VENDORS, catalog, r).empty
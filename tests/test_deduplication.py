@@ -0,0 +1,123 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import dataCleaning
+from deduplication import RowHashIndex, _Partition, _MAX_SPILLED_RUNS
+
+KEY_COLUMNS = ["refId", "device_ifa", "latitude"]
+
+
+def rows(count, start=0, **extra):
+    table = pa.table({
+        "refId": [f"r{i}" for i in range(start, start + count)],
+        "device_ifa": [f"ifa{i % 7}" for i in range(start, start + count)],
+        "latitude": ["12.97"] * count,
+    })
+    for name, value in extra.items():
+        table = table.append_column(name, pa.array([value] * count))
+    return table
+
+
+def test_rows_of_a_failed_file_are_not_treated_as_seen():
+    index = RowHashIndex(key_columns=KEY_COLUMNS)
+    kept, _ = index.filter_table(rows(100), "bid-0.parquet")
+    assert kept.num_rows == 100
+    index.discard("bid-0.parquet")
+
+    retried, removed = index.filter_table(rows(100), "bid-0.parquet")
+    assert retried.num_rows == 100 and sum(removed.values()) == 0
+    index.commit("bid-0.parquet")
+
+    again, removed = index.filter_table(rows(100), "bid-1.parquet")
+    assert again.num_rows == 0 and removed["cross_file"] == 100
+    assert index.removed["cross_file"] == 0  # counted once bid-1 commits
+    index.commit("bid-1.parquet")
+    assert index.removed["cross_file"] == 100
+
+
+def test_duplicates_within_a_file_span_row_groups_before_commit():
+    index = RowHashIndex(key_columns=KEY_COLUMNS)
+    index.filter_table(rows(50), "bid-0.parquet")
+    second, removed = index.filter_table(pa.concat_tables([rows(50, start=25), rows(10, start=100)]), "bid-0.parquet")
+    assert second.num_rows == 35
+    assert removed["file"] == 25
+
+
+def test_bid_and_nobid_dumps_match_on_key_columns():
+    index = RowHashIndex(key_columns=KEY_COLUMNS)
+    index.filter_table(rows(40, bid_price=1.5), "bid-0.parquet")
+    index.commit("bid-0.parquet")
+
+    # The nobid dump lacks bid_price and has its own columns, but the key columns match
+    nobid, removed = index.filter_table(rows(60, nobid_reason="timeout"), "nobid-0.parquet")
+    assert nobid.num_rows == 20
+    assert removed["cross_dump"] == 40
+
+
+def test_spilled_index_still_finds_duplicates(tmp_path):
+    index = RowHashIndex(memory_budget_mb=0, spill_dir=str(tmp_path), key_columns=KEY_COLUMNS)
+    index.filter_table(rows(5000), "bid-0.parquet")
+    index.commit("bid-0.parquet")
+    assert index.memory_bytes == 0
+
+    kept, removed = index.filter_table(rows(6000), "bid-1.parquet")
+    assert kept.num_rows == 1000 and removed["cross_file"] == 5000
+    index.close()
+
+
+def test_clean_file_failure_does_not_drop_rows_on_retry(tmp_path, monkeypatch):
+    table = pa.table({
+        "date": ["1709000000000"] * 30,
+        "refId": [f"r{i}" for i in range(30)],
+        "device_ifa": ["ifa"] * 30, "dpidsha1": [""] * 30, "dpidmd5": [""] * 30,
+        "device_vendor": ["samsung"] * 30, "device_model": ["SM-G960F"] * 30,
+        "latitude": ["12.97"] * 30, "longitude": ["77.59"] * 30,
+    })
+    path = tmp_path / "bid-0.parquet"
+    pq.write_table(table, path, row_group_size=10)
+    index = RowHashIndex(key_columns=["refId", "device_ifa"])
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(dataCleaning, "_replace_with_cleaned", fail)
+        assert dataCleaning.clean_file(str(path), dedup_index=index) is None
+
+    counters = dataCleaning.clean_file(str(path), dedup_index=index)
+    assert counters["duplicates_file"] == 0
+    assert pq.read_table(path).num_rows == 30
+
+
+def test_staged_hashes_count_against_the_budget(tmp_path):
+    index = RowHashIndex(memory_budget_mb=0, spill_dir=str(tmp_path), key_columns=KEY_COLUMNS)
+    for row_group in range(10):
+        index.filter_table(rows(1000, start=row_group * 1000), "bid-0.parquet")
+        assert index.memory_bytes == 0
+
+    again, removed = index.filter_table(rows(500, start=9500), "bid-0.parquet")
+    assert again.num_rows == 0 and removed["file"] == 500
+    index.discard("bid-0.parquet")
+    assert not list(tmp_path.rglob("*.npy"))
+    index.close()
+
+
+def test_partition_runs_stay_few():
+    partition = _Partition()
+    for batch in range(1000):
+        hashes = np.arange(batch * 10, batch * 10 + 10, dtype=np.uint64)
+        partition.add(hashes, np.zeros(10, dtype=np.uint16))
+    assert len(partition.runs) <= 12
+    assert (partition.lookup(np.arange(10_000, dtype=np.uint64)) == 0).all()
+
+
+def test_spilled_runs_are_merged_on_disk(tmp_path):
+    partition = _Partition()
+    for batch in range(50):
+        hashes = np.arange(batch * 100, batch * 100 + 100, dtype=np.uint64)
+        partition.add(hashes, np.full(100, batch, dtype=np.uint16))
+        partition.spill(str(tmp_path / f"run{batch}"))
+    assert len(partition.runs) <= _MAX_SPILLED_RUNS
+    assert len(list(tmp_path.glob("*_hashes.npy"))) == len(partition.runs)
+    assert (partition.lookup(np.arange(5000, dtype=np.uint64)) == np.arange(5000) // 100).all()
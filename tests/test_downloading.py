@@ -0,0 +1,109 @@
+import os
+import boto3
+import pytest
+import zstandard as zstd
+from moto import mock_aws
+
+import downloadingAndDecompressing as downloading
+from runLedger import RunLedger
+
+BUCKET = "test-dumps"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    with mock_aws():
+        monkeypatch.setattr(downloading, "ENDPOINT_URL", None)
+        monkeypatch.setattr(downloading, "REGION_NAME", "us-east-1")
+        monkeypatch.setattr(downloading, "ACCESS_KEY", "testing")
+        monkeypatch.setattr(downloading, "SECRET_KEY", "testing")
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def listed_prefixes(client):
+    """Record the Prefix of every ListObjectsV2 call made with `client`."""
+    prefixes = []
+    client.meta.events.register("provide-client-params.s3.ListObjectsV2",
+                                lambda params, **kwargs: prefixes.append(params.get("Prefix", "")))
+    return prefixes
+
+
+def test_listing_follows_pages_past_1000_keys(s3):
+    for i in range(2500):
+        s3.put_object(Bucket=BUCKET, Key=f"bid/2024-02-27/bid-{i}.parquet.zst", Body=b"x")
+    prefixes = listed_prefixes(s3)
+
+    files = list(downloading.iterFilesInBucket(BUCKET, s3_client=s3))
+
+    assert len(files) == 2500
+    assert len({key for key, _, _ in files}) == 2500
+    assert len(prefixes) == 3
+
+
+@pytest.mark.parametrize("template", ["", "{kind}/{date}/"])
+def test_listing_pushes_date_range_down_as_prefixes(s3, monkeypatch, template):
+    monkeypatch.setattr(downloading.config, "S3_LISTING_PREFIX_TEMPLATE", template)
+    for kind in ("bid", "nobid", "other"):
+        for day in ("2024-02-26", "2024-02-27", "2024-02-28"):
+            for i in range(3):
+                s3.put_object(Bucket=BUCKET, Key=f"{kind}/{day}/{kind}-{day}-{i}.parquet.zst", Body=b"x")
+    prefixes = listed_prefixes(s3)
+
+    files = list(downloading.iterFilesInBucket(BUCKET, ("2024-02-26", "2024-02-27"), s3_client=s3))
+
+    assert sorted(key for key, _, _ in files) == sorted(
+        f"{kind}/{day}/{kind}-{day}-{i}.parquet.zst"
+        for kind in ("bid", "nobid") for day in ("2024-02-26", "2024-02-27") for i in range(3))
+    assert not any("2024-02-28" in prefix for prefix in prefixes)
+
+
+def test_listing_yields_etags(s3):
+    s3.put_object(Bucket=BUCKET, Key="bid/2024-02-27/bid-0.parquet.zst", Body=b"x" * 2048)
+
+    [(key, size_kb, etag)] = downloading.iterFilesInBucket(BUCKET, "2024-02-27", s3_client=s3)
+
+    assert key == "bid/2024-02-27/bid-0.parquet.zst"
+    assert size_kb == 2
+    assert etag == s3.head_object(Bucket=BUCKET, Key=key)["ETag"].strip('"')
+
+
+@pytest.mark.parametrize("mode", ["stream", "file"])
+def test_corrupt_object_is_recorded_as_failed_at_download(s3, tmp_path, monkeypatch, mode):
+    monkeypatch.chdir(tmp_path)
+    data = os.urandom(1000) * 50
+    s3.put_object(Bucket=BUCKET, Key="bid/2024-02-27/bid-0.parquet.zst", Body=zstd.ZstdCompressor().compress(data))
+    s3.put_object(Bucket=BUCKET, Key="bid/2024-02-27/bid-1.parquet.zst", Body=b"not zstd at all")
+    ledger = RunLedger(str(tmp_path / "ledger.db"))
+
+    try:
+        paths = downloading.downloadAndDecompressFiles(downloading.iterFilesInBucket(BUCKET, "2024-02-27"),
+                                                       workers=2, bucket_name=BUCKET, mode=mode, ledger=ledger)
+
+        assert paths == [str(tmp_path / "temp" / "bid-0.parquet")]
+        assert open(paths[0], "rb").read() == data
+        assert ledger.get("bid-0.parquet")["state"] == "downloaded"
+        failed = ledger.get("bid-1.parquet")
+        assert failed["state"] == "failed"
+        assert failed["failed_stage"] == "download"
+        assert failed["s3_key"] == "bid/2024-02-27/bid-1.parquet.zst"
+        assert failed["error"]
+    finally:
+        ledger.close()
+
+
+def test_streaming_fetches_large_objects_as_ordered_ranged_parts(s3, tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 12345)  # incompressible, so the object spans four 1 MB parts
+    key = "bid/2024-02-27/bid-0.parquet.zst"
+    s3.put_object(Bucket=BUCKET, Key=key, Body=zstd.ZstdCompressor().compress(data))
+    ranges = []
+    s3.meta.events.register("provide-client-params.s3.GetObject",
+                            lambda params, **kwargs: ranges.append(params.get("Range")))
+    _, transfer_config, fetch_one = downloading.prepare_transfer(1, part_size_mb=1, part_concurrency=3, mode="stream")
+
+    path, size_bytes, _ = fetch_one(s3, BUCKET, key, str(tmp_path), transfer_config)
+
+    assert open(path, "rb").read() == data
+    assert size_bytes == s3.head_object(Bucket=BUCKET, Key=key)["ContentLength"]
+    assert len(ranges) == 4 and all(ranges)
@@ -0,0 +1,258 @@
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import fetchFromLatLong
+import geocoderClient
+from geocoderClient import GeocoderClient
+from locationQuantization import location_quantizer
+from RedisUtils.redisProcessing import r
+
+FEATURE = {"features": [{"properties": {"city": "Bengaluru", "countrycode": "IN"}}]}
+
+
+def run_against(handler, scenario):
+    """Start a stub geocoder serving `handler` on /reverse and run `scenario(base_url)` against it."""
+    async def main():
+        app = web.Application()
+        app.router.add_get("/reverse", handler)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            return await scenario(str(server.make_url("")).rstrip("/"))
+        finally:
+            await server.close()
+    return asyncio.run(main())
+
+
+def client_for(base_url, **kwargs):
+    options = dict(min_concurrency=1, max_concurrency=32, initial_concurrency=8, timeout=5, max_retries=3,
+                   backoff_base=0.01, backoff_max=1, latency_target=1000)
+    options.update(kwargs)
+    return GeocoderClient(base_url, **options)
+
+
+def test_429_and_503_are_retried_after_retry_after():
+    statuses = iter([(429, "0.3"), (503, "0.2")])
+
+    async def handler(request):
+        status = next(statuses, None)
+        if status:
+            return web.Response(status=status[0], headers={"Retry-After": status[1]})
+        return web.json_response(FEATURE)
+
+    async def scenario(base_url):
+        client = client_for(base_url)
+        start = time.monotonic()
+        properties = await client.reverse(12.97, 77.59)
+        elapsed = time.monotonic() - start
+        await client.close()
+        return client, properties, elapsed
+
+    client, properties, elapsed = run_against(handler, scenario)
+    assert properties == {"city": "Bengaluru", "countrycode": "IN"}
+    assert elapsed >= 0.5  # slept for both Retry-After values rather than the 10 ms backoff
+    assert (client.requests, client.retries, client.failures) == (3, 2, 0)
+    assert client.limiter.limit < 8  # throttling halved the limit
+
+
+def test_gives_up_after_max_retries():
+    async def handler(request):
+        return web.Response(status=503)
+
+    async def scenario(base_url):
+        client = client_for(base_url, max_retries=2)
+        properties = await client.reverse(12.97, 77.59)
+        await client.close()
+        return client, properties
+
+    client, properties = run_against(handler, scenario)
+    assert properties is None
+    assert (client.requests, client.retries, client.failures) == (3, 2, 1)
+
+
+def test_limit_grows_on_fast_responses_and_halves_on_slow_ones():
+    delay = {"seconds": 0}
+
+    async def handler(request):
+        await asyncio.sleep(delay["seconds"])
+        return web.json_response(FEATURE)
+
+    async def scenario(base_url):
+        client = client_for(base_url, initial_concurrency=2, max_concurrency=16, latency_target=50)
+        await asyncio.gather(*[client.reverse(12.97, 77.59) for _ in range(60)])
+        grown = client.limiter.limit
+
+        delay["seconds"] = 0.1  # slower than the 50 ms latency target
+        for _ in range(5):
+            await asyncio.gather(*[client.reverse(12.97, 77.59) for _ in range(4)])
+        shrunk = client.limiter.limit
+        await client.close()
+        return grown, shrunk
+
+    grown, shrunk = run_against(handler, scenario)
+    assert grown > 4
+    assert shrunk < grown / 2
+    assert shrunk >= 1
+
+
+@pytest.mark.parametrize("body, content_type", [
+    ("not json", "text/plain"),
+    ("<html>busy</html>", "text/html"),
+    ("{", "application/json"),
+    ("[1, 2]", "application/json"),
+    ('{"features": "none"}', "application/json"),
+    ('{"features": [1]}', "application/json"),
+    ('{"features": [{"properties": "x"}]}', "application/json"),
+])
+def test_malformed_body_is_a_failed_lookup(body, content_type):
+    async def handler(request):
+        return web.Response(text=body, content_type=content_type)
+
+    async def scenario(base_url):
+        client = client_for(base_url)
+        properties = await client.reverse(12.97, 77.59)
+        await client.close()
+        return client, properties
+
+    client, properties = run_against(handler, scenario)
+    assert properties is None
+    assert (client.requests, client.retries, client.failures) == (1, 0, 1)
+    assert client.limiter.limit >= 8  # not treated as overload
+
+
+def test_malformed_body_does_not_fail_bulk_fetch(monkeypatch):
+    async def handler(request):
+        if request.query["lat"].startswith("13"):
+            return web.Response(text="{oops", content_type="application/json")
+        return web.json_response(FEATURE)
+
+    async def scenario(base_url):
+        monkeypatch.setattr(geocoderClient.config, "REVERSE_GEOCODER_API", base_url)
+        try:
+            return await fetchFromLatLong.bulk_fetch_location_data(r, [(12.5, 77.5), (13.5, 77.5), (12.5, 77.5)])
+        finally:
+            await fetchFromLatLong.flush_location_writes()
+            await geocoderClient.close_geocoder_client()
+
+    r.flushdb()
+    locations = run_against(handler, scenario)
+    r.flushdb()
+    assert list(locations) == [(12.5, 77.5)]
+    assert locations[(12.5, 77.5)]["city"] == "Bengaluru"
+
+
+def test_clients_on_several_loops_share_one_limit():
+    active = {"now": 0, "max": 0}
+
+    async def handler(request):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.02)
+        active["now"] -= 1
+        return web.json_response(FEATURE)
+
+    limiter = geocoderClient.AdaptiveLimiter(floor=4, ceiling=4, initial=4, latency_target=1)
+
+    def worker(base_url):
+        async def lookups():
+            client = client_for(base_url, limiter=limiter)
+            results = await asyncio.gather(*[client.reverse(12.97, 77.59) for _ in range(20)])
+            await client.close()
+            return results
+        return asyncio.run(lookups())
+
+    async def scenario(base_url):
+        return await asyncio.gather(*[asyncio.to_thread(worker, base_url) for _ in range(3)])
+
+    results = run_against(handler, scenario)
+    assert all(properties == FEATURE["features"][0]["properties"] for loop_results in results
+               for properties in loop_results)
+    assert active["max"] == 4  # not 4 per loop
+    assert limiter.in_flight == 0
+
+
+def counting_handler(requests, delay=0.0):
+    """Stub geocoder counting requests per latitude; latitudes from 13 on have no feature."""
+    async def handler(request):
+        requests[request.query["lat"]] += 1
+        await asyncio.sleep(delay)
+        if float(request.query["lat"]) >= 13:
+            return web.json_response({"features": []})
+        return web.json_response(FEATURE)
+    return handler
+
+
+async def bulk_fetch(base_url, monkeypatch, *batches):
+    """bulk_fetch_location_data for each batch of pairs, run concurrently on the running loop."""
+    monkeypatch.setattr(geocoderClient.config, "REVERSE_GEOCODER_API", base_url)
+    try:
+        return await asyncio.gather(*[fetchFromLatLong.bulk_fetch_location_data(r, pairs) for pairs in batches])
+    finally:
+        await fetchFromLatLong.flush_location_writes()
+        await geocoderClient.close_geocoder_client()
+
+
+def test_unresolved_cells_are_cached_as_negative_entries(monkeypatch):
+    monkeypatch.setattr(fetchFromLatLong.config, "LOCATION_NEGATIVE_TTL_SECONDS", 120)
+    requests = Counter()
+    pairs = [(12.5, 77.5), (13.5, 77.5)]
+    found_key, missing_key = (location_quantizer.cell(*pair)[0] for pair in pairs)
+
+    r.flushdb()
+    [first] = run_against(counting_handler(requests), lambda base_url: bulk_fetch(base_url, monkeypatch, pairs))
+    assert list(first) == [(12.5, 77.5)]
+    assert json.loads(r.get(missing_key))["_negative"]
+    assert 0 < r.ttl(missing_key) <= 120
+    assert r.ttl(found_key) > 120
+
+    # Both cells are answered from Redis now: the negative one is skipped, not asked again
+    [second] = run_against(counting_handler(requests), lambda base_url: bulk_fetch(base_url, monkeypatch, pairs))
+    assert second == first
+    assert requests == {"12.5": 1, "13.5": 1}
+
+    # Once the negative entry expires the cell is requested again
+    r.delete(missing_key)
+    run_against(counting_handler(requests), lambda base_url: bulk_fetch(base_url, monkeypatch, pairs))
+    r.flushdb()
+    assert requests == {"12.5": 1, "13.5": 2}
+
+
+def test_concurrent_lookups_of_a_cell_share_one_request(monkeypatch):
+    requests = Counter()
+    batches = [[(12.5, 77.5), (13.5, 77.5)], [(12.5, 77.5), (12.25, 77.5)], [(13.5, 77.5), (12.5, 77.5)]]
+
+    r.flushdb()
+    results = run_against(counting_handler(requests, delay=0.1),
+                          lambda base_url: bulk_fetch(base_url, monkeypatch, *batches))
+    r.flushdb()
+    assert requests == {"12.5": 1, "13.5": 1, "12.25": 1}
+    assert [sorted(result) for result in results] == [[(12.5, 77.5)], [(12.25, 77.5), (12.5, 77.5)], [(12.5, 77.5)]]
+    assert not fetchFromLatLong._in_flight
+
+
+def test_lookups_on_other_event_loops_await_the_request_in_flight(monkeypatch):
+    requests = Counter()
+    pairs = [(12.5, 77.5), (13.5, 77.5)]
+    start = threading.Barrier(3)
+
+    def worker(base_url):
+        async def lookup():
+            start.wait()
+            return (await bulk_fetch(base_url, monkeypatch, pairs))[0]
+        return asyncio.run(lookup())
+
+    async def scenario(base_url):
+        return await asyncio.gather(*[asyncio.to_thread(worker, base_url) for _ in range(3)])
+
+    r.flushdb()
+    results = run_against(counting_handler(requests, delay=0.3), scenario)
+    r.flushdb()
+    assert requests == {"12.5": 1, "13.5": 1}
+    assert all(list(result) == [(12.5, 77.5)] for result in results)
+    assert not fetchFromLatLong._in_flight
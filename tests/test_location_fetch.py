@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+import redis.asyncio
+
+import fetchFromLatLong
+
+
+def test_background_writes_are_tracked_per_event_loop():
+    errors = []
+
+    def worker(index):
+        async def store_and_flush():
+            client = redis.asyncio.Redis(decode_responses=True)
+            for batch in range(20):
+                fetchFromLatLong._store_locations(
+                    client, [(f"loop{index}:{batch}:{i}", {"city": "x"}, 60) for i in range(50)])
+                await fetchFromLatLong.flush_location_writes()
+            assert not fetchFromLatLong._pending_writes[asyncio.get_running_loop()]
+            assert len(await client.keys(f"loop{index}:*")) == 20 * 50
+
+        try:
+            asyncio.run(store_and_flush())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
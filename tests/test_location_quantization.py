@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from locationQuantization import LocationQuantizer, geohash_center, geohash_encode
+
+
+@pytest.mark.parametrize("lat, lon, geohash", [
+    (57.64911, 10.40744, "u4pruydqqvj"),
+    (42.6, -5.6, "ezs42"),
+    (-33.8688, 151.2093, "r3gx2f"),
+    (0.0, 0.0, "s0000"),
+])
+def test_geohash_encodes_known_points(lat, lon, geohash):
+    assert geohash_encode(lat, lon, len(geohash)) == geohash
+
+
+@pytest.mark.parametrize("length", [1, 5, 7, 9])
+def test_cell_center_is_within_half_a_cell_and_encodes_to_the_same_cell(length):
+    rng = random.Random(length)
+    # A geohash of `length` chars halves longitude ceil(5 * length / 2) times and latitude floor(5 * length / 2) times
+    lon_size, lat_size = 360 / 2 ** -(-5 * length // 2), 180 / 2 ** (5 * length // 2)
+    for _ in range(200):
+        lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        geohash = geohash_encode(lat, lon, length)
+        center_lat, center_lon = geohash_center(geohash)
+        assert abs(center_lat - lat) <= lat_size / 2 and abs(center_lon - lon) <= lon_size / 2
+        assert geohash_encode(center_lat, center_lon, length) == geohash
+
+
+def test_cell_keys_and_requests_per_mode():
+    assert LocationQuantizer("none").cell("12.971599", "77.594566") == (
+        "location:12.971599:77.594566", "12.971599", "77.594566")
+    assert LocationQuantizer("decimal", decimals=3).cell("12.971599", 77.5) == (
+        "location:d3:12.972:77.500", "12.972", "77.500")
+
+    key, lat, lon = LocationQuantizer("geohash", geohash_length=7).cell("12.971599", "77.594566")
+    assert key == f"location:gh:{geohash_encode(12.971599, 77.594566, 7)}"
+    assert (lat, lon) == tuple(round(value, 6) for value in geohash_center(key.rsplit(":", 1)[1]))
+
+
+def test_nearby_points_share_a_cell_and_precisions_never_mix():
+    decimal, geohash = LocationQuantizer("decimal", decimals=4), LocationQuantizer("geohash", geohash_length=7)
+    assert decimal.cell(12.97161, 77.59449)[0] == decimal.cell(12.971599, 77.594501)[0]
+    assert geohash.cell(12.97161, 77.59449)[0] == geohash.cell(12.971599, 77.594501)[0]
+    assert geohash.cell(12.97161, 77.59449)[0] != geohash.cell(12.99, 77.59449)[0]
+
+    keys = {quantizer.cell(12.97, 77.59)[0] for quantizer in
+            (LocationQuantizer("none"), decimal, LocationQuantizer("decimal", decimals=2), geohash,
+             LocationQuantizer("geohash", geohash_length=5))}
+    assert len(keys) == 5
+    assert [quantizer.precision for quantizer in (LocationQuantizer("none"), decimal, geohash)] == [
+        "raw", "decimal:4", "geohash:7"]
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError, match="Unknown location quantization"):
+        LocationQuantizer("h3")
@@ -0,0 +1,30 @@
+import json
+import pytest
+
+from RedisUtils.redisProcessing import ModelCatalog, MODEL_MAPPING_VERSION_KEY, r, update_model_mapping
+
+
+@pytest.fixture
+def catalog():
+    r.delete("model_mapping", MODEL_MAPPING_VERSION_KEY)
+    r.hset("model_mapping", "iphone", json.dumps({"vendor": "apple"}))
+    yield ModelCatalog(100)
+    r.delete("model_mapping", MODEL_MAPPING_VERSION_KEY)
+
+
+def test_own_writes_keep_the_cache_current(catalog):
+    assert catalog.lookup(["iphone", "pixel 5"]) == {"iphone": {"vendor": "apple"}, "pixel 5": None}
+    catalog.update("Pixel 5", {"vendor": "google", "height": "2340", "width": None})
+
+    r.hset("model_mapping", "iphone", json.dumps({"vendor": "changed behind the version"}))
+    assert catalog.lookup(["iphone", "pixel 5"]) == {
+        "iphone": {"vendor": "apple"}, "pixel 5": {"vendor": "google", "height": "2340", "width": None}}
+    assert catalog.hits == 2
+
+
+def test_other_writers_invalidate_the_cache(catalog):
+    catalog.lookup(["iphone"])
+    update_model_mapping("iphone", {"vendor": "apple inc"})  # another process's write bumps the version
+    catalog.update("pixel 5", {"vendor": "google"})
+
+    assert catalog.lookup(["iphone", "pixel 5"]) == {"iphone": {"vendor": "apple inc"}, "pixel 5": {"vendor": "google"}}
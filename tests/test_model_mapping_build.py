@@ -0,0 +1,63 @@
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import processingData
+from config import config
+from RedisUtils.redisProcessing import ModelCatalog, MODEL_MAPPING_VERSION_KEY, r
+
+VENDORS = ["samsung", "apple", "xiaomi", "redmi", "google", "lg"]
+
+# model, vendor, height, width, ua
+ROW_GROUPS = [
+    [
+        ("SM-G960F", "Samsung", "2960", "1440", "Mozilla/5.0 (Linux; Android 10; SM-G960F)"),
+        ("samsung_galaxy s9", "samsung", "", "1440", "ua"),                   # vendor prefix stripped
+        ("Redmi Note 8", "", "2340", "", "Mozilla/5.0 (Linux; Android 10; Redmi Note 8)"),  # vendor from the UA
+        ("iPhone", "APL", None, None, "Mozilla/5.0 (iPhone; CPU iPhone OS 14_0)"),  # short vendor, UA wins
+        ("G8", "lg", "3120", "1440", "ua"),                                   # lg is kept despite its length
+        ("iphone", "apple", "2532", "1170", "ua"),                           # already in the catalog
+    ],
+    [
+        ("SM-G960F", "", "", "1080", "Mozilla/5.0 (Linux; Android 10; SM-G960F)"),  # later width, earlier height
+        ("Pixel 5", "google", "2340", "1080", "ua"),
+        ("Pixel 5", "", "", "", "no vendor here"),                            # empty fields keep the earlier values
+        ("redmi note 8", "xiaomi", "", "1080", "ua"),
+        ("unknown", None, None, None, None),
+    ],
+]
+
+
+@pytest.fixture
+def build(monkeypatch, tmp_path):
+    """Run process_parquet_files in a build mode over ROW_GROUPS; returns the 'model_mapping' hash and 'vendors' set."""
+    (tmp_path / "temp").mkdir()
+    columns = list(zip(*[row for group in ROW_GROUPS for row in group]))
+    table = pa.table(dict(zip(["device_model", "device_vendor", "device_height", "device_width", "ua"], columns)))
+    pq.write_table(table, tmp_path / "temp" / "bid-0.parquet", row_group_size=len(ROW_GROUPS[0]))
+    monkeypatch.chdir(tmp_path)
+
+    def run(mode):
+        r.delete("model_mapping", "vendors", MODEL_MAPPING_VERSION_KEY)
+        r.sadd("vendors", *VENDORS)
+        r.hset("model_mapping", "iphone", json.dumps({"vendor": "apple", "height": "2532", "width": None}))
+        monkeypatch.setattr(config, "MODEL_MAPPING_BUILD_MODE", mode)
+        monkeypatch.setattr(processingData, "model_catalog", ModelCatalog(100))
+        processingData.process_parquet_files()
+        return ({model: json.loads(details) for model, details in r.hgetall("model_mapping").items()},
+                r.smembers("vendors"))
+
+    yield run
+    r.delete("model_mapping", "vendors", MODEL_MAPPING_VERSION_KEY)
+
+
+def test_bulk_build_writes_the_same_mapping_as_the_rowwise_build(build):
+    rowwise_mapping, rowwise_vendors = build("rowwise")
+    bulk_mapping, bulk_vendors = build("bulk")
+
+    assert bulk_mapping == rowwise_mapping
+    assert bulk_vendors == rowwise_vendors
+    assert rowwise_mapping["sm-g960f"] == {"vendor": "samsung", "height": "2960", "width": "1080"}
+    assert rowwise_mapping["pixel 5"] == {"vendor": "google", "height": "2340", "width": "1080"}
@@ -0,0 +1,117 @@
+import asyncio
+import math
+
+import numpy as np
+import pytest
+
+import offlineGeocoder
+from config import config
+from fetchFromLatLong import bulk_fetch_location_data
+from offlineGeocoder import OfflineGeocoder, get_offline_geocoder, read_gazetteer
+from RedisUtils.redisProcessing import r
+
+# GeoNames postal code dump: headerless, tab separated
+GEONAMES_ROWS = [
+    ["IN", "560001", "Bengaluru", "Karnataka", "19", "Bangalore Urban", "", "", "", "12.9716", "77.5946", "4"],
+    ["IN", "400001", "Mumbai", "Maharashtra", "16", "Mumbai City", "", "", "", "19.0760", "72.8777", "4"],
+    ["IN", "600001", "Chennai", "Tamil Nadu", "25", "Chennai", "", "", "", "13.0827", "80.2707", "4"],
+]
+
+# Gazetteer with a header row, using aliases of the API property names
+HEADER_CSV = """name,admin_name1,country_code,zip,lat,lng,population
+Bengaluru,Karnataka,IN,560001,12.9716,77.5946,8443675
+Mumbai,Maharashtra,IN,400001,19.0760,72.8777,12442373
+Chennai,Tamil Nadu,IN,600001,not a number,80.2707,4646732
+"""
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * offlineGeocoder.EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+@pytest.fixture
+def geonames_path(tmp_path):
+    path = tmp_path / "IN.txt"
+    path.write_text("".join("\t".join(row) + "\n" for row in GEONAMES_ROWS))
+    return str(path)
+
+
+def test_reads_headerless_geonames_tsv(geonames_path):
+    places = read_gazetteer(geonames_path)
+
+    assert list(places.columns) == ["latitude", "longitude", "city", "district", "state", "countrycode", "postcode"]
+    assert places["city"].tolist() == ["Bengaluru", "Mumbai", "Chennai"]
+    assert places.loc[0, ["latitude", "longitude"]].tolist() == [12.9716, 77.5946]
+    assert places.loc[1, "district"] == "Mumbai City"
+
+
+def test_reads_csv_with_header_aliases_and_drops_unplaceable_rows(tmp_path):
+    path = tmp_path / "places.csv"
+    path.write_text(HEADER_CSV)
+    places = read_gazetteer(str(path))
+
+    assert list(places.columns) == ["latitude", "longitude", "city", "state", "countrycode", "postcode"]
+    assert places["city"].tolist() == ["Bengaluru", "Mumbai"]  # Chennai has no usable latitude
+    assert places.loc[1, "postcode"] == "400001"
+
+
+def test_gazetteer_without_coordinates_is_rejected(tmp_path):
+    path = tmp_path / "places.tsv"
+    path.write_text("name\tcountry\nBengaluru\tIndia\n")
+    with pytest.raises(ValueError, match="no latitude, longitude column"):
+        read_gazetteer(str(path))
+
+
+def test_nearest_place_and_great_circle_distance(geonames_path):
+    pytest.importorskip("scipy")
+    geocoder = OfflineGeocoder.load(geonames_path)
+    lats, lons = np.array([12.98, 19.2, 13.0827, -33.87]), np.array([77.60, 72.9, 80.2707, 151.21])
+
+    index, distance = geocoder.nearest(lats, lons)
+    assert index.tolist() == [0, 1, 2, 2]
+    expected = [haversine_km(lat, lon, *geocoder.places.loc[i, ["latitude", "longitude"]])
+                for lat, lon, i in zip(lats, lons, index)]
+    assert distance == pytest.approx(expected, rel=1e-6, abs=1e-6)
+
+
+def test_points_beyond_the_max_distance_are_left_to_the_api(geonames_path, monkeypatch):
+    pytest.importorskip("scipy")
+    geocoder = OfflineGeocoder.load(geonames_path)
+    lats, lons = [12.98, 12.5, 0.0], [77.60, 77.5946, 0.0]  # ~1.3 km, ~52 km and far from every place
+
+    monkeypatch.setattr(config, "LOCAL_GEOCODER_MAX_KM", 10)
+    near, mid, far = geocoder.resolve(lats, lons)
+    assert near == {"city": "Bengaluru", "district": "Bangalore Urban", "state": "Karnataka",
+                    "countrycode": "IN", "postcode": "560001", "_source": "offline"}
+    assert mid is None and far is None
+
+    monkeypatch.setattr(config, "LOCAL_GEOCODER_MAX_KM", 60)
+    assert [result and result["city"] for result in geocoder.resolve(lats, lons)] == ["Bengaluru", "Bengaluru", None]
+    assert geocoder.resolve(lats, lons, max_km=0.5) == [None, None, None]
+    assert geocoder.resolve([], []) == []
+
+
+def test_bulk_fetch_resolves_nearby_cells_offline(geonames_path, monkeypatch):
+    pytest.importorskip("scipy")
+    monkeypatch.setattr(config, "LOCAL_GEOCODER_PATH", geonames_path)
+    monkeypatch.setattr(config, "LOCAL_GEOCODER_MAX_KM", 10)
+    monkeypatch.setattr(offlineGeocoder, "_geocoder", None)
+
+    r.flushdb()
+    locations = asyncio.run(bulk_fetch_location_data(r, [("12.98", "77.60"), ("19.08", "72.88")]))
+    assert {pair: location["city"] for pair, location in locations.items()} == {
+        ("12.98", "77.60"): "Bengaluru", ("19.08", "72.88"): "Mumbai"}
+    assert not r.keys("location:*")  # answered in-process, nothing cached or requested
+
+
+def test_unreadable_gazetteer_disables_offline_geocoding(tmp_path, monkeypatch):
+    path = tmp_path / "places.csv"
+    path.write_text("name,country\nBengaluru,India\n")
+    monkeypatch.setattr(config, "LOCAL_GEOCODER_PATH", str(path))
+    monkeypatch.setattr(offlineGeocoder, "_geocoder", None)
+
+    assert get_offline_geocoder() is None
+    monkeypatch.setattr(config, "LOCAL_GEOCODER_PATH", "")
+    assert get_offline_geocoder() is None
@@ -0,0 +1,45 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from processedDataset import compact_processed, discard_processed_output
+
+RUN = "0123456789ab"
+
+
+def write(directory, name, start):
+    os.makedirs(directory, exist_ok=True)
+    pq.write_table(pa.table({"value": list(range(start, start + 10))}), os.path.join(directory, name))
+
+
+def names(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".parquet"))
+
+
+def test_compaction_skips_exactly_the_excluded_inputs(tmp_path):
+    partition = str(tmp_path / "date=2024-02-27")
+    write(partition, f"a-{RUN}-0.parquet", 0)
+    write(partition, f"a-part-00010-{RUN}-0.parquet", 10)
+    write(partition, f"a-b-{RUN}-0.parquet", 20)
+    write(partition, f"c-{RUN}-0.parquet", 30)
+
+    merged, written = compact_processed(str(tmp_path), min_file_mb=1, exclude_inputs=["a.parquet"])
+
+    assert (merged, written) == (2, 1)
+    remaining = names(partition)
+    assert f"a-{RUN}-0.parquet" in remaining and f"a-part-00010-{RUN}-0.parquet" in remaining
+    assert f"a-b-{RUN}-0.parquet" not in remaining and f"c-{RUN}-0.parquet" not in remaining
+    assert sum(pq.read_metadata(os.path.join(partition, name)).num_rows for name in remaining) == 40
+
+
+def test_discard_leaves_inputs_sharing_a_prefix_alone(tmp_path):
+    partition = str(tmp_path / "date=2024-02-27")
+    write(partition, f"a-{RUN}-0.parquet", 0)
+    write(partition, f"a-b-{RUN}-0.parquet", 10)
+    write(str(tmp_path), "a-part-00000.parquet", 20)
+
+    discard_processed_output(str(tmp_path), "a.parquet")
+
+    assert names(partition) == [f"a-b-{RUN}-0.parquet"]
+    assert names(str(tmp_path)) == []
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from runLedger import RunLedger, object_name
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = RunLedger(str(tmp_path / "ledger.db"))
+    yield ledger
+    ledger.close()
+
+
+def test_object_names_are_the_decompressed_file_names():
+    assert object_name("bid/2024/02/27/bid-0.parquet.zst") == "bid-0.parquet"
+    assert object_name("bid/bid-1.parquet") == "bid-1.parquet"
+
+
+def test_upserts_keep_earlier_fields_and_creation_time(ledger):
+    ledger.record("bid-0.parquet", "listed", s3_key="bid/bid-0.parquet.zst", etag='"abc"', size_bytes=100)
+    created = ledger.get("bid-0.parquet")
+    ledger.record("bid-0.parquet", "downloaded", downloaded_bytes=400, download_seconds=1.5)
+    ledger.record("bid-0.parquet", "cleaned", raw_rows=10, cleaned_rows=8)
+
+    row = ledger.get("bid-0.parquet")
+    assert row["state"] == "cleaned"
+    assert (row["s3_key"], row["etag"], row["size_bytes"]) == ("bid/bid-0.parquet.zst", '"abc"', 100)
+    assert (row["downloaded_bytes"], row["raw_rows"], row["cleaned_rows"]) == (400, 10, 8)
+    assert row["enriched_rows"] is None
+    assert row["created_at"] == created["created_at"] and row["updated_at"] >= created["updated_at"]
+    assert ledger.get("bid-1.parquet") is None
+
+
+def test_failures_record_the_stage_until_the_object_moves_on(ledger):
+    ledger.record("bid-0.parquet", "cleaned", cleaned_rows=8)
+    ledger.failed("bid-0.parquet", "enrich", RuntimeError("geocoder down " + "x" * 2000))
+
+    row = ledger.get("bid-0.parquet")
+    assert (row["state"], row["failed_stage"]) == ("failed", "enrich")
+    assert row["error"].startswith("geocoder down") and len(row["error"]) == 1000
+    assert row["cleaned_rows"] == 8
+
+    # A later success clears the failure
+    ledger.record("bid-0.parquet", "enriched", enriched_rows=8)
+    row = ledger.get("bid-0.parquet")
+    assert (row["state"], row["failed_stage"], row["error"]) == ("enriched", None, None)
+
+
+def test_names_and_summary_by_state(ledger):
+    for name in ("c", "a", "b"):
+        ledger.record(name, "listed")
+    ledger.record("a", "downloaded")
+    ledger.failed("b", "download", "timeout")
+
+    assert ledger.names("listed") == ["c"]
+    assert ledger.names("downloaded") == ["a"]
+    assert ledger.names("enriched") == []
+    assert ledger.summary() == {"listed": 1, "downloaded": 1, "failed": 1}
+
+
+def test_unknown_states_and_fields_are_rejected(ledger):
+    with pytest.raises(ValueError, match="Unknown state"):
+        ledger.record("bid-0.parquet", "done")
+    with pytest.raises(ValueError, match="Unknown ledger fields: rows"):
+        ledger.record("bid-0.parquet", "listed", rows=3)
+    assert ledger.get("bid-0.parquet") is None
+
+
+def test_concurrent_writers_only_touch_their_own_rows(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    ledgers = [RunLedger(path) for _ in range(2)]  # two processes sharing the file
+
+    def worker(index):
+        ledger = ledgers[index % 2]
+        name = f"bid-{index}.parquet"
+        for state in ("listed", "downloaded", "cleaned", "enriched"):
+            ledger.record(name, state, raw_rows=index)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reopened = RunLedger(path)
+    assert reopened.summary() == {"enriched": 8}
+    assert [reopened.get(f"bid-{index}.parquet")["raw_rows"] for index in range(8)] == list(range(8))
+    for ledger in (*ledgers, reopened):
+        ledger.close()
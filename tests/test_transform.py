@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+from benchmarks import transform_rows
+from fetchFromLatLong import transform_columns, _coordinate_index, _input_column
+
+LOCATIONS = {("12.971599", "77.594566"): {"city": "Bengaluru", "district": "Bangalore Urban", "state": "Karnataka",
+                                           "country": "India", "countrycode": "IN", "postcode": "560001"}}
+
+
+def chunk(connection_types, location_types):
+    rows = len(connection_types)
+    return pd.DataFrame({
+        "refId": [f"r{i}" for i in range(rows)],
+        "date": [1709000000000, 0, 1709000000123] * (rows // 3) + [1709000000000] * (rows % 3),
+        "device_ifa": ["ifa"] * rows,
+        "os": ["android"] * rows,
+        "os_version": ["10.1"] * rows,
+        "normalized_os_version": ["10"] * rows,
+        "connection_type": connection_types,
+        "location_type": location_types,
+        "latitude": ["12.971599", "95.0", ""] * (rows // 3) + ["12.971599"] * (rows % 3),
+        "longitude": ["77.594566", "77.5", ""] * (rows // 3) + ["77.594566"] * (rows % 3),
+        "city": ["Fallback"] * rows,
+        "zip": [""] * rows,
+    })
+
+
+def normalized(frame):
+    # The row-wise frame holds Python objects (ints become floats next to None); compare as text
+    return frame.map(lambda value: None if not pd.notna(value) else
+                     str(int(value)) if isinstance(value, float) and value.is_integer() else str(value))
+
+
+def columnar(frame):
+    indices, pairs = _coordinate_index(_input_column(frame, "latitude", len(frame)),
+                                       _input_column(frame, "longitude", len(frame)))
+    return transform_columns(frame, indices, pairs, LOCATIONS).to_pandas()
+
+
+@pytest.mark.parametrize("connection_types, location_types", [
+    # Cleaned files store the codes as strings: "0" is a real code, only "" and missing become null
+    (["0", "2", "", None, " 3 ", "0"], ["1", "0", None, "", "0", "2"]),
+    # Numeric inputs: 0 is falsy row-wise, so it becomes null
+    ([0, 2, 5, 1, 0, 3], [1.0, 0.0, 4.0, 2.0, 0.0, 1.0]),
+])
+def test_columnar_transform_matches_rowwise(connection_types, location_types):
+    frame = chunk(connection_types, location_types)
+    expected = pd.DataFrame(transform_rows(frame.to_dict("records"), LOCATIONS))
+    actual = columnar(frame)
+
+    pd.testing.assert_frame_equal(normalized(expected), normalized(actual), check_dtype=False)
+
+
+def test_string_zero_codes_are_kept():
+    actual = columnar(chunk(["0", "", None], ["0", "1", ""]))
+
+    assert actual["connectionType"].tolist()[0] == 0
+    assert actual["connectionType"].isna().tolist() == [False, True, True]
+    assert actual["location_type"].isna().tolist() == [False, False, True]
+    assert actual.loc[0, "city"] == "Bengaluru" and actual.loc[1, "city"] == "Fallback"
@@ -0,0 +1,44 @@
+import pandas as pd
+
+from vendorMatcher import UAVendorCache, excluded_vendors, matcher_for
+
+MATCHER = matcher_for(["samsung", "apple", "redmi", "xiaomi", "android"])
+
+
+def test_vendor_from_ua_reads_the_section_before_the_first_parenthesis():
+    assert MATCHER.vendor_from_ua("Mozilla/5.0 (Linux; Android 10; redmi note 8) samsung") == "redmi"
+    assert MATCHER.vendor_from_ua("Mozilla/5.0 (iPhone; apple) android", excluded_vendors("android")) is None
+    assert MATCHER.vendor_from_ua(None) is None
+
+
+def test_cache_counts_hits_and_misses_and_evicts_least_recently_used():
+    cache = UAVendorCache(2)
+    assert cache.get(MATCHER, "(samsung)") == "samsung"
+    assert cache.get(MATCHER, "(apple)") == "apple"
+    assert cache.get(MATCHER, "(samsung)") == "samsung"       # hit, samsung is now the most recent
+    assert cache.get(MATCHER, "(redmi)") == "redmi"           # evicts apple
+    assert cache.stats() == {"hits": 1, "misses": 3, "size": 2, "hit_rate": 0.25}
+
+    cache.get(MATCHER, "(samsung)")
+    cache.get(MATCHER, "(apple)")                              # missed again after the eviction
+    assert (cache.hits, cache.misses) == (2, 4)
+
+    # The same UA with other excluded vendors is a separate entry
+    cache.get(MATCHER, "(apple)", excluded_vendors("android"))
+    assert (cache.hits, cache.misses) == (2, 5)
+
+
+def test_cache_is_cleared_when_the_vendor_set_changes():
+    cache = UAVendorCache(10)
+    cache.get(MATCHER, "(samsung)")
+    assert cache.get(matcher_for(["apple"]), "(samsung)") is None
+    assert (cache.hits, cache.misses, cache.stats()["size"]) == (0, 2, 1)
+
+
+def test_vendors_for_looks_up_each_distinct_ua_once():
+    cache = UAVendorCache(10)
+    uas = pd.Series(["(samsung)", "(apple)", None, "(samsung)", "(apple)"], index=[5, 6, 7, 8, 9])
+    vendors = cache.vendors_for(MATCHER, uas, pd.Series(["x", "android", "x", "x", "x"], index=uas.index))
+    assert vendors.tolist() == ["samsung", None, None, "samsung", "apple"]
+    assert vendors.index.tolist() == [5, 6, 7, 8, 9]
+    assert (cache.hits, cache.misses) == (0, 4)
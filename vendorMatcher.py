@@ -0,0 +1,154 @@
+import re
+import threading
+from collections import OrderedDict
+import pandas as pd
+from logger import get_logger
+from config import config
+from RedisUtils.redisProcessing import load_or_create_vendors
+
+logger = get_logger("VendorMatcher")
+
+
+class VendorMatcher:
+    """
+    Find predefined vendor names inside UA and model strings with one compiled regex.
+
+    Every vendor occurring in the text is a candidate and the longest one wins (ties broken
+    alphabetically), so the result no longer depends on set iteration order. Behaves like the
+    vendor set for `in` checks and iteration.
+    """
+
+    def __init__(self, vendors):
+        self.vendors = frozenset(vendor for vendor in vendors if vendor)
+        self._patterns = {}
+
+    def __contains__(self, vendor):
+        return vendor in self.vendors
+
+    def __iter__(self):
+        return iter(sorted(self.vendors, key=lambda vendor: (-len(vendor), vendor)))
+
+    def __len__(self):
+        return len(self.vendors)
+
+    def _pattern(self, excluded):
+        """Alternation of all vendors but `excluded`, longest first, as a lookahead so overlapping matches are found."""
+        if excluded not in self._patterns:
+            alternatives = [re.escape(vendor) for vendor in self if vendor not in excluded]
+            self._patterns[excluded] = re.compile(f"(?=({'|'.join(alternatives)}))") if alternatives else None
+        return self._patterns[excluded]
+
+    def find(self, text, excluded=frozenset()):
+        """Longest vendor occurring in `text`, or None."""
+        pattern = self._pattern(excluded)
+        if pattern is None:
+            return None
+        best = None
+        for match in pattern.finditer(text):
+            vendor = match.group(1)
+            if best is None or (-len(vendor), vendor) < (-len(best), best):
+                best = vendor
+        return best
+
+    def vendor_from_ua(self, ua, excluded=frozenset()):
+        """Vendor named in the part of a UA before the first ')', other than the `excluded` ones (see excluded_vendors())."""
+        if not pd.notna(ua):
+            return None
+        ua_section = ua.split(")")[0] if ")" in ua else ua
+        return self.find(ua_section, excluded)
+
+
+def excluded_vendors(current_vendor):
+    """Vendors a UA may not resolve to given the row's current vendor (apple and android never cross)."""
+    excluded = set()
+    if current_vendor and "android" in current_vendor:
+        excluded.add("apple")
+    if current_vendor and "apple" in current_vendor:
+        excluded.add("android")
+    return frozenset(excluded)
+
+
+class UAVendorCache:
+    """
+    Process-wide, bounded LRU memo of UA -> vendor lookups, shared by the correction and the Redis
+    population paths. Entries are keyed on (ua, excluded vendors) and dropped when the vendor set
+    changes. vendors_for() resolves a whole column: unique keys -> lookup -> broadcast.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._vendors = None
+        self._lock = threading.Lock()
+
+    def _check_vendors(self, matcher):
+        if self._vendors != matcher.vendors:
+            self._entries.clear()
+            self._vendors = matcher.vendors
+
+    def get(self, matcher, ua, excluded=frozenset()):
+        key = (ua, excluded)
+        with self._lock:
+            self._check_vendors(matcher)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        vendor = matcher.vendor_from_ua(ua, excluded)
+        with self._lock:
+            self._entries[key] = vendor
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return vendor
+
+    def vendors_for(self, matcher, uas, current_vendors=None):
+        """Vendor extracted from each UA of a Series (None where nothing matches), aligned to its index."""
+        uas = uas.astype(object).where(uas.notna(), None)  # one hashable missing value
+        if current_vendors is None:
+            keys = pd.Series([frozenset()] * len(uas), index=uas.index, dtype=object)
+        else:
+            exclusions = {vendor: excluded_vendors(vendor) for vendor in pd.unique(current_vendors)}
+            keys = current_vendors.map(exclusions)
+        resolved = {pair: self.get(matcher, *pair) for pair in set(zip(uas, keys))}
+        return pd.Series([resolved[pair] for pair in zip(uas, keys)], index=uas.index, dtype=object)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(f"UA vendor cache: {stats['hits']} hits, {stats['misses']} misses "
+                    f"({stats['hit_rate']:.1%} hit rate), {stats['size']} entries")
+
+
+ua_vendor_cache = UAVendorCache(config.UA_CACHE_SIZE)
+
+
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+def matcher_for(vendors):
+    """The VendorMatcher for a vendor collection, built once per distinct set."""
+    if isinstance(vendors, VendorMatcher):
+        return vendors
+    key = frozenset(vendors)
+    with _matchers_lock:
+        if key not in _matchers:
+            if len(_matchers) >= 8:
+                _matchers.clear()
+            _matchers[key] = VendorMatcher(key)
+        return _matchers[key]
+
+def get_vendor_matcher():
+    """Matcher for the current Redis 'vendors' set; rebuilt only when the set has changed."""
+    return matcher_for(load_or_create_vendors())
+
+def extract_vendor_from_ua(ua, predefined_vendors, current_vendor=None):
+    """Extract vendor from the 'ua' field using predefined vendor names."""
+    return ua_vendor_cache.get(matcher_for(predefined_vendors), ua, excluded_vendors(current_vendor))